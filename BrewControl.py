@@ -1,67 +1,118 @@
+import os
 import sys
 import json
-import serial
+import math
 import time
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QLabel, QPushButton, QSpinBox, 
                              QDoubleSpinBox, QComboBox, QGroupBox, QGridLayout,
-                             QTextEdit, QTabWidget, QCheckBox, QMessageBox)
-from PyQt5.QtCore import QTimer, QThread, pyqtSignal
+                             QTextEdit, QTabWidget, QCheckBox, QMessageBox,
+                             QLineEdit, QTableWidget, QTableWidgetItem, QHeaderView,
+                             QAbstractItemView, QDialog, QFormLayout, QFileDialog)
+from PyQt5.QtCore import Qt, QObject, QTimer, pyqtSignal
 from PyQt5.QtGui import QFont
 
-class SerialThread(QThread):
-    data_received = pyqtSignal(dict)
+from autotune import (AutoTuner, METHOD_STEP, METHOD_RELAY, TUNING_RULES, PHASE_DONE, PHASE_FAILED,
+                      PHASE_PREPARE, PHASE_BASELINE, PHASE_STEP, PHASE_RELAY, CONTROLLER_PID,
+                      MAX_TEMPERATURE as AUTOTUNE_MAX_TEMPERATURE)
+from acquisition import (AcquisitionCore, NUM_THERMOSTATS, NUM_SENSORS, HISTORY_DIR,
+                         EVENT_CONNECTED, EVENT_DISCONNECTED, EVENT_FRAME, EVENT_LATENCY,
+                         EVENT_COMMAND, EVENT_ALARM, EVENT_PREDICTION, EVENT_SENSOR_HEALTH)
+from controller_manager import ControllerManager
+from log_view import LogView, DEBUG, INFO, WARNING, ERROR
+from metrics_view import MetricsView, StallMonitor
+from plant_sim import from_model, simulate
+from predictive_alarms import LIMIT_NAMES, DISABLED_LIMIT
+from recipe import RecipeRunner, load_recipe, describe
+from recorder import StatusRecorder
+from sensor_health import ISSUE_NAMES, ISSUE_DROPOUTS, ISSUE_NOISY, ISSUE_STUCK
+from status_server import StatusServer, DEFAULT_PORT as STATUS_SERVER_PORT
+from status_model import StatusSnapshot
+
+# Lines kept in the log views before the oldest are dropped
+LOG_LINES = 5000
+MANUAL_RESPONSE_LINES = 1000
+
+# Milliseconds between refreshes of the sensor statistics
+SENSOR_HEALTH_REFRESH = 1000
+
+ALARM_LEVEL_NAMES = ["OK", "Advarsel", "Alarm", "Teknisk"]
+
+AUTOTUNE_PHASE_NAMES = {
+    PHASE_PREPARE: "Læser konfiguration",
+    PHASE_BASELINE: "Basisperiode",
+    PHASE_STEP: "Springrespons",
+    PHASE_RELAY: "Relætest",
+    PHASE_DONE: "Færdig",
+    PHASE_FAILED: "Fejlet",
+}
+AUTOTUNE_RULE_NAMES = ["SIMC", "AMIGO", "Cohen-Coon"]
+
+class CoreBridge(QObject):
+    """Subscribes to an AcquisitionCore and re-emits its events in the GUI thread"""
     
-    def __init__(self, port='COM3', baudrate=115200):
-        super().__init__()
-        self.port = port
-        self.baudrate = baudrate
-        self.serial_conn = None
-        self.running = False
+    # Frames are passed as plain Python objects so they reach the GUI thread
+    # without being converted to a QVariantMap and back. Events carry the
+    # core's link_id, as they may still be queued after a reconnect
+    event = pyqtSignal(str, object, int)
     
-    def run(self):
-        try:
-            self.serial_conn = serial.Serial(self.port, self.baudrate, timeout=1)
-            self.running = True
-            
-            while self.running:
-                if self.serial_conn.in_waiting:
-                    line = self.serial_conn.readline().decode().strip()
-                    if line:
-                        try:
-                            data = json.loads(line)
-                            self.data_received.emit(data)
-                        except json.JSONDecodeError:
-                            pass
-                time.sleep(0.1)
-        except Exception as e:
-            print(f"Serial error: {e}")
+    def __init__(self, core, parent=None):
+        super().__init__(parent)
+        self.core = core
+        core.subscribe(self.forward)
     
-    def send_command(self, command):
-        if self.serial_conn and self.serial_conn.is_open:
-            try:
-                json_str = json.dumps(command) + '\n'
-                self.serial_conn.write(json_str.encode())
-            except Exception as e:
-                print(f"Send error: {e}")
+    def forward(self, event, data):
+        # Called in the serial thread; the queued connection does the hand-over
+        self.event.emit(event, data, self.core.link_id)
     
-    def stop(self):
-        self.running = False
-        if self.serial_conn:
-            self.serial_conn.close()
+    def detach(self):
+        self.core.unsubscribe(self.forward)
+
+class ManagerBridge(QObject):
+    """Subscribes to a ControllerManager and re-emits its events in the GUI thread"""
+    
+    event = pyqtSignal(str, str, object)
+    
+    def __init__(self, manager, parent=None):
+        super().__init__(parent)
+        self.manager = manager
+        manager.subscribe(self.forward)
+    
+    def forward(self, name, event, data):
+        # Called in the manager's event loop thread
+        self.event.emit(name, event, data)
+    
+    def detach(self):
+        self.manager.unsubscribe(self.forward)
+
+class StatusLabel(QLabel):
+    """QLabel that ignores updates which would not change what it shows"""
+    
+    def __init__(self, text="", parent=None):
+        super().__init__(text, parent)
+        self.style_class = None
+    
+    def set_status(self, text, style):
+        if text != self.text():
+            self.setText(text)
+        # Restyling forces a polish of the widget, so only do it on a change
+        if style != self.style_class:
+            self.setStyleSheet(style)
+            self.style_class = style
 
 class ThermostatWidget(QWidget):
     def __init__(self, regulator_id, parent=None):
         super().__init__(parent)
         self.regulator_id = regulator_id
         self.parent_app = parent
+        self.last_data = {}
         self.init_ui()
     
     def init_ui(self):
         layout = QVBoxLayout()
         
         # Status display
-        self.status_label = QLabel(f"Termostat {self.regulator_id + 1}: Deaktiveret")
+        self.status_label = StatusLabel(f"Termostat {self.regulator_id + 1}: Deaktiveret")
         self.status_label.setFont(QFont('Arial', 12, QFont.Bold))
         layout.addWidget(self.status_label)
         
@@ -84,25 +135,26 @@ class ThermostatWidget(QWidget):
         # Sensor selector
         controls.addWidget(QLabel("Sensor:"), 2, 0)
         self.sensor_combo = QComboBox()
-        self.sensor_combo.addItems([f"Sensor {i+1}" for i in range(7)])
+        self.sensor_combo.addItems([f"Sensor {i+1}" for i in range(NUM_SENSORS)])
         controls.addWidget(self.sensor_combo, 2, 1)
         
         # PID parameters
         controls.addWidget(QLabel("Kp:"), 3, 0)
         self.kp_spin = QDoubleSpinBox()
-        self.kp_spin.setRange(0, 100)
+        self.kp_spin.setRange(0, 1000)
         self.kp_spin.setDecimals(2)
         controls.addWidget(self.kp_spin, 3, 1)
         
         controls.addWidget(QLabel("Ki:"), 4, 0)
         self.ki_spin = QDoubleSpinBox()
         self.ki_spin.setRange(0, 100)
-        self.ki_spin.setDecimals(2)
+        # Slow kettles need an integral gain well below 0.01 per second
+        self.ki_spin.setDecimals(4)
         controls.addWidget(self.ki_spin, 4, 1)
         
         controls.addWidget(QLabel("Kd:"), 5, 0)
         self.kd_spin = QDoubleSpinBox()
-        self.kd_spin.setRange(0, 100)
+        self.kd_spin.setRange(0, 10000)
         self.kd_spin.setDecimals(2)
         controls.addWidget(self.kd_spin, 5, 1)
         
@@ -127,6 +179,11 @@ class ThermostatWidget(QWidget):
         self.enable_btn.clicked.connect(self.toggle_enable)
         controls.addWidget(self.enable_btn, 8, 0, 1, 2)
         
+        # Step or relay test that proposes PID gains
+        autotune_btn = QPushButton("Autotune...")
+        autotune_btn.clicked.connect(self.open_autotune)
+        controls.addWidget(autotune_btn, 9, 0, 1, 2)
+        
         layout.addLayout(controls)
         self.setLayout(layout)
         
@@ -156,12 +213,16 @@ class ThermostatWidget(QWidget):
         setpoint_visible = thermostat_type != 2
         self.setpoint_spin.setVisible(setpoint_visible)
     
+    def open_autotune(self):
+        if self.parent_app:
+            self.parent_app.open_autotune(self.regulator_id)
+    
     def toggle_enable(self):
         if self.parent_app:
             enabled = self.enable_btn.text() == "Aktiver"
             self.parent_app.toggle_thermostat(self.regulator_id, enabled)
     
-    def update_display(self, thermostat_data, sensor_data):
+    def update_display(self, thermostat_data, sensor=None):
         enabled = thermostat_data.get('enabled', False)
         setpoint = thermostat_data.get('setpoint', 0)
         output = thermostat_data.get('output', 0)
@@ -169,51 +230,70 @@ class ThermostatWidget(QWidget):
         sensor_idx = thermostat_data.get('sensorIndex', 0)
         thermostat_type = thermostat_data.get('type', 0)
         
-        # Find sensor data by sensor_id
+        # Sensor record for sensorIndex, looked up by the caller
         sensor_temp = current_temp
         sensor_health = 0
-        for sensor in sensor_data:
-            if sensor.get('sensor_id') == sensor_idx:
-                sensor_temp = sensor.get('temperature', current_temp)
-                sensor_health = sensor.get('health', 0)
-                break
+        if sensor is not None:
+            sensor_temp = sensor.get('temperature', current_temp)
+            sensor_health = sensor.get('health', 0)
         
         status = "Aktiv" if enabled else "Deaktiveret"
         health_str = ["OK", "Fejl", "Timeout"][sensor_health]
         type_str = ["PID", "Simple", "Manuel"][thermostat_type]
         
-        self.status_label.setText(
+        text = (
             f"Termostat {self.regulator_id + 1}: {status} ({type_str}) | "
             f"Temp: {sensor_temp:.1f}°C | Sæt: {setpoint:.1f}°C | "
             f"Output: {output:.0f}% | Sensor: {health_str}"
         )
         # Color coding
         if not enabled:
-            self.status_label.setStyleSheet("background-color: gray; color: white; padding: 5px;")
+            style = "background-color: gray; color: white; padding: 5px;"
         elif sensor_health > 0:
-            self.status_label.setStyleSheet("background-color: orange; color: white; padding: 5px;")
+            style = "background-color: orange; color: white; padding: 5px;"
         elif abs(sensor_temp - setpoint) > 2:
-            self.status_label.setStyleSheet("background-color: red; color: white; padding: 5px;")
+            style = "background-color: red; color: white; padding: 5px;"
         else:
-            self.status_label.setStyleSheet("background-color: green; color: white; padding: 5px;")
+            style = "background-color: green; color: white; padding: 5px;"
+        self.status_label.set_status(text, style)
+        
+        # Only push values into the controls when the regulator reports a
+        # change, so unchanged frames leave the widgets (and user edits) alone
+        previous = self.last_data
+        self.last_data = thermostat_data
+        
+        def changed(key):
+            return not previous or previous.get(key) != thermostat_data.get(key)
         
         # Update controls
-        self.setpoint_spin.setValue(setpoint)
-        self.sensor_combo.setCurrentIndex(sensor_idx)
-        self.type_combo.setCurrentIndex(thermostat_type)
+        if changed('setpoint'):
+            self.setpoint_spin.setValue(setpoint)
+        if changed('sensorIndex'):
+            while sensor_idx >= self.sensor_combo.count():
+                self.sensor_combo.addItem(f"Sensor {self.sensor_combo.count() + 1}")
+            self.sensor_combo.setCurrentIndex(sensor_idx)
+        type_changed = changed('type')
+        if type_changed:
+            # Emits currentIndexChanged, which updates the control visibility
+            self.type_combo.setCurrentIndex(thermostat_type)
         
         # Update type-specific controls
         if thermostat_type == 0:  # PID
-            self.kp_spin.setValue(thermostat_data.get('kp', 2.0))
-            self.ki_spin.setValue(thermostat_data.get('ki', 1.0))
-            self.kd_spin.setValue(thermostat_data.get('kd', 0.5))
+            if type_changed or changed('kp'):
+                self.kp_spin.setValue(thermostat_data.get('kp', 2.0))
+            if type_changed or changed('ki'):
+                self.ki_spin.setValue(thermostat_data.get('ki', 1.0))
+            if type_changed or changed('kd'):
+                self.kd_spin.setValue(thermostat_data.get('kd', 0.5))
         elif thermostat_type == 1:  # Simple
-            self.hysteresis_spin.setValue(thermostat_data.get('hysteresis', 1.0))
+            if type_changed or changed('hysteresis'):
+                self.hysteresis_spin.setValue(thermostat_data.get('hysteresis', 1.0))
         elif thermostat_type == 2:  # Manual
-            self.manual_output_spin.setValue(thermostat_data.get('manualOutput', 0))
+            if type_changed or changed('manualOutput'):
+                self.manual_output_spin.setValue(thermostat_data.get('manualOutput', 0))
         
-        self.enable_btn.setText("Deaktiver" if enabled else "Aktiver")
-        self.update_controls_visibility()
+        if changed('enabled'):
+            self.enable_btn.setText("Deaktiver" if enabled else "Aktiver")
 
 class AlarmWidget(QWidget):
     def __init__(self, alarm_index, parent=None):
@@ -226,10 +306,16 @@ class AlarmWidget(QWidget):
         layout = QVBoxLayout()
         
         # Status
-        self.status_label = QLabel(f"Alarm {self.alarm_index + 1}: OK")
+        self.status_label = StatusLabel(f"Alarm {self.alarm_index + 1}: OK")
         self.status_label.setFont(QFont('Arial', 10, QFont.Bold))
         layout.addWidget(self.status_label)
         
+        # Early warning from the temperature's rate of change
+        self.prediction_label = QLabel("")
+        self.prediction_label.setWordWrap(True)
+        layout.addWidget(self.prediction_label)
+        self.predictions = {}
+        
         # Controls
         controls = QGridLayout()
         
@@ -257,6 +343,16 @@ class AlarmWidget(QWidget):
         self.alarm_high_spin.setSuffix("°C")
         controls.addWidget(self.alarm_high_spin, 3, 1)
         
+        # The limits show the regulator's until edited here; edited ones are
+        # what the early warnings on this machine use
+        self.limit_spins = {'warningLow': self.warn_low_spin, 'warningHigh': self.warn_high_spin,
+                            'alarmLow': self.alarm_low_spin, 'alarmHigh': self.alarm_high_spin}
+        self.limits_edited = False
+        for spin in self.limit_spins.values():
+            spin.setToolTip("Bruges til tidlige advarsler på denne computer; "
+                            "grænserne i regulatoren ændres ikke herfra")
+            spin.valueChanged.connect(self.limits_changed)
+        
         # Reset mode
         self.auto_reset_cb = QCheckBox("Auto reset")
         controls.addWidget(self.auto_reset_cb, 4, 0)
@@ -273,42 +369,726 @@ class AlarmWidget(QWidget):
         if self.parent_app:
             self.parent_app.acknowledge_alarm(self.alarm_index)
     
+    def show_limits(self, config):
+        """Show the regulator's limits, unless they have been edited here"""
+        if self.limits_edited:
+            return
+        for name, spin in self.limit_spins.items():
+            if name in config:
+                spin.blockSignals(True)
+                spin.setValue(config[name])
+                spin.blockSignals(False)
+    
+    def limits(self):
+        # A limit at the end of the range is as good as switched off
+        limits = {}
+        for name, spin in self.limit_spins.items():
+            value = spin.value()
+            if value >= spin.maximum():
+                value = DISABLED_LIMIT
+            elif value <= spin.minimum():
+                value = -DISABLED_LIMIT
+            limits[name] = value
+        return limits
+    
+    def limits_changed(self):
+        self.limits_edited = True
+        if self.parent_app:
+            self.parent_app.core.predictions.set_limits(self.alarm_index, self.limits())
+    
+    def update_prediction(self, prediction):
+        if prediction.active:
+            # Kept as a time of day, which stays right between updates
+            self.predictions[prediction.limit] = (time.time() + prediction.eta, prediction)
+        else:
+            self.predictions.pop(prediction.limit, None)
+        if not self.predictions:
+            self.prediction_label.setText("")
+            self.prediction_label.setStyleSheet("")
+            return
+        # The limit reached first, and the more serious one of two at once
+        expected, first = min(self.predictions.values(), key=lambda item: (item[0], -item[1].level))
+        self.prediction_label.setText(
+            f"Forventet {LIMIT_NAMES[first.limit]} ({first.threshold:g}°C) "
+            f"ca. kl. {time.strftime('%H:%M', time.localtime(expected))}, {first.rate * 60:+.2f}°C/min")
+        color = "orange" if first.level == 1 else "red"
+        self.prediction_label.setStyleSheet(f"color: {color}; font-weight: bold;")
+    
     def update_display(self, alarm_data):
         level = alarm_data.get('level', 0)
         active = alarm_data.get('active', False)
         acknowledged = alarm_data.get('acknowledged', False)
         error_code = alarm_data.get('errorCode', 0)
         
-        level_names = ["OK", "Advarsel", "Alarm", "Teknisk"]
-        status = level_names[level] if level < len(level_names) else "Ukendt"
+        status = ALARM_LEVEL_NAMES[level] if level < len(ALARM_LEVEL_NAMES) else "Ukendt"
         
         if error_code > 0:
             status += f" (Fejl: {error_code})"
         
-        self.status_label.setText(f"Alarm {self.alarm_index + 1}: {status}")
-        
         # Color coding
         if level == 0:
-            self.status_label.setStyleSheet("background-color: green; color: white; padding: 5px;")
+            style = "background-color: green; color: white; padding: 5px;"
         elif level == 1:
-            self.status_label.setStyleSheet("background-color: orange; color: white; padding: 5px;")
+            style = "background-color: orange; color: white; padding: 5px;"
         else:
-            self.status_label.setStyleSheet("background-color: red; color: white; padding: 5px;")
+            style = "background-color: red; color: white; padding: 5px;"
+        self.status_label.set_status(f"Alarm {self.alarm_index + 1}: {status}", style)
         
         self.ack_btn.setEnabled(active and not acknowledged)
 
+class AutoTuneDialog(QDialog):
+    """Runs an AutoTuner on one thermostat and offers its proposed gains.
+
+    Not modal, as a test takes up to a couple of hours; the window feeds it
+    every status frame.
+    """
+    
+    def __init__(self, regulator_id, setpoint, parent=None):
+        super().__init__(parent)
+        self.regulator_id = regulator_id
+        self.parent_app = parent
+        self.tuner = None
+        self.setWindowTitle(f"Autotune - Termostat {regulator_id + 1}")
+        self.init_ui(setpoint)
+    
+    def init_ui(self, setpoint):
+        layout = QVBoxLayout()
+        form = QFormLayout()
+        
+        self.method_combo = QComboBox()
+        self.method_combo.addItems(["Springrespons", "Relæ omkring sætpunkt"])
+        self.method_combo.currentIndexChanged.connect(self.update_controls_visibility)
+        form.addRow("Metode:", self.method_combo)
+        
+        # Outputs in the firmware's range, 0-255
+        self.base_output_spin = QSpinBox()
+        self.base_output_spin.setRange(0, 255)
+        form.addRow("Basis-output:", self.base_output_spin)
+        self.step_output_spin = QSpinBox()
+        self.step_output_spin.setRange(1, 255)
+        self.step_output_spin.setValue(128)
+        form.addRow("Step-output:", self.step_output_spin)
+        
+        self.baseline_spin = QSpinBox()
+        self.baseline_spin.setRange(0, 3600)
+        self.baseline_spin.setValue(60)
+        self.baseline_spin.setSuffix(" s")
+        form.addRow("Basisperiode:", self.baseline_spin)
+        
+        self.setpoint_spin = QDoubleSpinBox()
+        self.setpoint_spin.setRange(-50, 150)
+        self.setpoint_spin.setValue(setpoint)
+        self.setpoint_spin.setSuffix("°C")
+        form.addRow("Sætpunkt:", self.setpoint_spin)
+        self.hysteresis_spin = QDoubleSpinBox()
+        self.hysteresis_spin.setRange(0.1, 10.0)
+        self.hysteresis_spin.setDecimals(1)
+        self.hysteresis_spin.setValue(0.5)
+        self.hysteresis_spin.setSuffix("°C")
+        form.addRow("Hysterese:", self.hysteresis_spin)
+        self.cycles_spin = QSpinBox()
+        self.cycles_spin.setRange(1, 20)
+        self.cycles_spin.setValue(3)
+        form.addRow("Cykler:", self.cycles_spin)
+        
+        self.max_duration_spin = QSpinBox()
+        self.max_duration_spin.setRange(5, 24 * 60)
+        self.max_duration_spin.setValue(120)
+        self.max_duration_spin.setSuffix(" min")
+        form.addRow("Maks varighed:", self.max_duration_spin)
+        self.max_temperature_spin = QDoubleSpinBox()
+        self.max_temperature_spin.setRange(0, 150)
+        self.max_temperature_spin.setValue(AUTOTUNE_MAX_TEMPERATURE)
+        self.max_temperature_spin.setSuffix("°C")
+        form.addRow("Maks temperatur:", self.max_temperature_spin)
+        
+        self.rule_combo = QComboBox()
+        self.rule_combo.addItems(AUTOTUNE_RULE_NAMES)
+        self.rule_combo.setToolTip("SIMC: hurtig uden oversving, AMIGO: robust, Cohen-Coon: aggressiv")
+        form.addRow("Indstillingsregel:", self.rule_combo)
+        layout.addLayout(form)
+        
+        self.status_label = QLabel("Klar")
+        layout.addWidget(self.status_label)
+        self.result_label = QLabel("")
+        self.result_label.setWordWrap(True)
+        layout.addWidget(self.result_label)
+        
+        buttons = QHBoxLayout()
+        self.start_btn = QPushButton("Start")
+        self.start_btn.clicked.connect(self.start)
+        buttons.addWidget(self.start_btn)
+        self.finish_btn = QPushButton("Afslut og beregn")
+        self.finish_btn.clicked.connect(self.finish)
+        buttons.addWidget(self.finish_btn)
+        self.abort_btn = QPushButton("Afbryd")
+        self.abort_btn.clicked.connect(self.abort)
+        buttons.addWidget(self.abort_btn)
+        self.apply_btn = QPushButton("Anvend forslag")
+        self.apply_btn.clicked.connect(self.apply_gains)
+        buttons.addWidget(self.apply_btn)
+        layout.addLayout(buttons)
+        
+        self.setLayout(layout)
+        self.update_controls_visibility()
+        self.update_buttons()
+    
+    def update_controls_visibility(self):
+        relay = self.method_combo.currentIndex() == 1
+        form = self.layout().itemAt(0).layout()
+        for widget, visible in ((self.baseline_spin, not relay), (self.setpoint_spin, relay),
+                                (self.hysteresis_spin, relay), (self.cycles_spin, relay)):
+            widget.setVisible(visible)
+            form.labelForField(widget).setVisible(visible)
+    
+    def update_buttons(self):
+        running = self.tuner is not None and self.tuner.running
+        self.start_btn.setEnabled(not running)
+        self.finish_btn.setEnabled(running)
+        self.abort_btn.setEnabled(running)
+        self.apply_btn.setEnabled(self.tuner is not None and self.tuner.phase == PHASE_DONE)
+    
+    @property
+    def running(self):
+        return self.tuner is not None and self.tuner.running
+    
+    def start(self):
+        if not self.parent_app.connected:
+            QMessageBox.warning(self, "Fejl", "Ikke forbundet til enhed")
+            return
+        relay = self.method_combo.currentIndex() == 1
+        self.tuner = AutoTuner(
+            self.parent_app.core.send, self.regulator_id,
+            method=METHOD_RELAY if relay else METHOD_STEP,
+            base_output=self.base_output_spin.value(),
+            step_output=self.step_output_spin.value(),
+            baseline=self.baseline_spin.value(),
+            setpoint=self.setpoint_spin.value() if relay else None,
+            hysteresis=self.hysteresis_spin.value(),
+            cycles=self.cycles_spin.value(),
+            max_duration=self.max_duration_spin.value() * 60,
+            max_temperature=self.max_temperature_spin.value(),
+            rule=TUNING_RULES[self.rule_combo.currentIndex()])
+        self.result_label.setText("")
+        self.tuner.start()
+        self.parent_app.log_autotune(self.regulator_id, "startet")
+        self.update_status()
+    
+    def finish(self):
+        if self.running:
+            self.tuner.finish()
+            self.update_status()
+    
+    def abort(self, reason="Afbrudt af bruger", disable=False):
+        if self.running:
+            self.tuner.abort(reason, disable)
+            self.update_status()
+    
+    def handle_frame(self, frame):
+        if self.running:
+            self.tuner.handle_frame(frame)
+            self.update_status()
+    
+    def update_status(self):
+        tuner = self.tuner
+        phase = AUTOTUNE_PHASE_NAMES.get(tuner.phase, tuner.phase)
+        text = f"{phase} | {tuner.elapsed / 60:.1f} min | {len(tuner.samples)} målinger"
+        if tuner.temperature is not None:
+            text += f" | {tuner.temperature:.2f}°C, output {tuner.output:.0f}"
+        self.status_label.setText(text)
+        if tuner.phase == PHASE_DONE:
+            model, gains = tuner.model, tuner.gains
+            self.result_label.setText(
+                f"Model: K = {model.gain:.4f}°C pr. output, tidskonstant {model.tau:.0f} s, "
+                f"dødtid {model.dead_time:.0f} s (afvigelse {model.rms:.2f}°C)\n"
+                f"Forslag: Kp = {gains.kp:.2f}, Ki = {gains.ki:.4f}, Kd = {gains.kd:.2f}\n"
+                f"{self.simulate_gains(model, gains)}")
+            self.parent_app.log_autotune(self.regulator_id, "færdig")
+        elif tuner.phase == PHASE_FAILED:
+            self.result_label.setText(f"Autotune fejlede: {tuner.error}")
+            self.parent_app.log_autotune(self.regulator_id, f"fejlede: {tuner.error}", ERROR)
+        self.update_buttons()
+    
+    def simulate_gains(self, model, gains):
+        """What the proposal would do on the fitted model, heating from the
+        model's zero output temperature to the setpoint"""
+        plant = from_model(model)
+        setpoint = self.setpoint_spin.value()
+        result = simulate(plant, {"kp": gains.kp, "ki": gains.ki, "kd": gains.kd,
+                                  "setpoint": setpoint}, 6 * (model.tau + model.dead_time))
+        row = result.row(0)
+        settling = row["settling_time"]
+        settling = "ikke indsvinget" if math.isnan(settling) else f"indsvinget efter {settling / 60:.0f} min"
+        return (f"Simuleret fra {plant.ambient:.0f}°C til {setpoint:.0f}°C: "
+                f"oversving {row['overshoot']:.1f}°C, {settling}")
+    
+    def apply_gains(self):
+        gains = self.tuner.gains
+        command = {
+            "command": "setConfig",
+            "regulator_id": self.regulator_id,
+            "type": CONTROLLER_PID,
+            "kp": round(gains.kp, 4),
+            "ki": round(gains.ki, 6),
+            "kd": round(gains.kd, 4)
+        }
+        if self.parent_app.send_command_with_log(command) is None:
+            QMessageBox.warning(self, "Fejl", "Ikke forbundet til enhed")
+            return
+        self.parent_app.log_autotune(self.regulator_id, "forslag anvendt")
+        self.apply_btn.setEnabled(False)
+    
+    def closeEvent(self, event):
+        if self.running:
+            answer = QMessageBox.question(self, "Autotune", "Afbryd den igangværende test?")
+            if answer != QMessageBox.Yes:
+                event.ignore()
+                return
+            self.abort()
+        event.accept()
+
+class RecipeWidget(QWidget):
+    """Loads a recipe and runs it with a RecipeRunner, one table row per step"""
+    
+    COLUMNS = ["Termostat", "Trin", "Sætpunkt", "Rampe", "Hold", "Status"]
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.parent_app = parent
+        self.runner = None
+        self.rows = []
+        self.init_ui()
+    
+    def init_ui(self):
+        layout = QVBoxLayout()
+        
+        controls = QHBoxLayout()
+        load_btn = QPushButton("Indlæs...")
+        load_btn.clicked.connect(self.load)
+        controls.addWidget(load_btn)
+        self.name_label = QLabel("Ingen opskrift indlæst")
+        controls.addWidget(self.name_label)
+        controls.addStretch()
+        self.start_btn = QPushButton("Start")
+        self.start_btn.clicked.connect(self.start)
+        controls.addWidget(self.start_btn)
+        self.pause_btn = QPushButton("Pause")
+        self.pause_btn.clicked.connect(self.toggle_pause)
+        controls.addWidget(self.pause_btn)
+        self.skip_btn = QPushButton("Spring trin over")
+        self.skip_btn.setToolTip("Gå videre til næste trin for den valgte termostat")
+        self.skip_btn.clicked.connect(self.skip)
+        controls.addWidget(self.skip_btn)
+        self.stop_btn = QPushButton("Stop")
+        self.stop_btn.clicked.connect(self.stop)
+        controls.addWidget(self.stop_btn)
+        layout.addLayout(controls)
+        
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(len(self.COLUMNS) - 1, QHeaderView.Stretch)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        layout.addWidget(self.table)
+        
+        self.setLayout(layout)
+        self.update_buttons()
+    
+    @property
+    def running(self):
+        return self.runner is not None and self.runner.running
+    
+    def update_buttons(self):
+        self.start_btn.setEnabled(self.runner is not None and not self.running)
+        self.pause_btn.setEnabled(self.running)
+        self.pause_btn.setText("Fortsæt" if self.running and self.runner.paused else "Pause")
+        self.skip_btn.setEnabled(self.running)
+        self.stop_btn.setEnabled(self.running)
+    
+    def load(self):
+        if self.running:
+            QMessageBox.warning(self, "Opskrift", "Stop den kørende opskrift først")
+            return
+        path, _ = QFileDialog.getOpenFileName(self, "Indlæs opskrift", "", "Opskrift (*.json)")
+        if path:
+            self.load_file(path)
+    
+    def load_file(self, path):
+        try:
+            recipe = load_recipe(path)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Fejl", f"Kunne ikke indlæse opskriften: {str(e)}")
+            return False
+        for program in recipe.programs:
+            if program.regulator_id >= NUM_THERMOSTATS:
+                QMessageBox.warning(self, "Fejl", f"Opskriften bruger termostat {program.regulator_id + 1}, "
+                                                   f"men der er kun {NUM_THERMOSTATS}")
+                return False
+        self.runner = RecipeRunner(self.parent_app.core.send, recipe, notify=self.notify)
+        self.name_label.setText(recipe.name)
+        self.rows = []
+        self.table.setRowCount(sum(len(program.steps) for program in recipe.programs))
+        for program in recipe.programs:
+            for index, step in enumerate(program.steps):
+                cells = [f"Termostat {program.regulator_id + 1}", step.name, f"{step.setpoint:.1f}°C",
+                         "--" if step.ramp is None else f"{step.ramp:g}°C/min", f"{step.hold / 60:g} min", ""]
+                for column, text in enumerate(cells):
+                    self.table.setItem(len(self.rows), column, QTableWidgetItem(text))
+                self.rows.append((program.regulator_id, index))
+        self.update_buttons()
+        return True
+    
+    def start(self):
+        if not self.parent_app.connected:
+            QMessageBox.warning(self, "Fejl", "Ikke forbundet til enhed")
+            return
+        snapshot = self.parent_app.core.snapshot
+        for program in self.runner.recipe.programs:
+            thermostat = snapshot.thermostat(program.regulator_id)
+            if thermostat is not None and not thermostat.get('outputActive'):
+                self.parent_app.log_text.append(
+                    f"[{time.strftime('%H:%M:%S')}] Opskrift: termostat {program.regulator_id + 1} "
+                    f"styrer ikke output - den skal aktiveres for at varme", WARNING)
+        self.runner.start()
+        self.parent_app.log_text.append(f"[{time.strftime('%H:%M:%S')}] Opskrift {self.runner.recipe.name} startet")
+        self.refresh()
+    
+    def toggle_pause(self):
+        if self.runner.paused:
+            self.runner.resume()
+        else:
+            self.runner.pause()
+        state = "sat på pause" if self.runner.paused else "fortsat"
+        self.parent_app.log_text.append(f"[{time.strftime('%H:%M:%S')}] Opskrift {state}")
+        self.refresh()
+    
+    def skip(self):
+        row = self.table.currentRow()
+        if row < 0:
+            QMessageBox.information(self, "Opskrift", "Vælg et trin for den termostat der skal videre")
+            return
+        self.runner.skip(self.rows[row][0])
+        self.refresh()
+    
+    def stop(self):
+        self.runner.stop()
+        self.parent_app.log_text.append(
+            f"[{time.strftime('%H:%M:%S')}] Opskrift stoppet - termostaterne beholder deres sætpunkter")
+        self.refresh()
+    
+    def notify(self, regulator_id, text):
+        timestamp = time.strftime("%H:%M:%S")
+        self.parent_app.log_text.append(f"[{timestamp}] Opskrift, termostat {regulator_id + 1}: {text}")
+    
+    def handle_frame(self, frame):
+        if not self.running:
+            return
+        self.runner.handle_frame(frame)
+        if not self.runner.running:
+            self.parent_app.log_text.append(
+                f"[{time.strftime('%H:%M:%S')}] Opskrift {self.runner.recipe.name} er færdig")
+        self.refresh()
+    
+    def refresh(self):
+        started = self.runner.started is not None
+        for row, (regulator_id, index) in enumerate(self.rows):
+            run = self.runner.run_for(regulator_id)
+            if not started or index > run.index:
+                text = ""
+            elif index < run.index:
+                text = "Færdig"
+            else:
+                text = describe(run)
+                if self.runner.paused:
+                    text += " (pause)"
+            item = self.table.item(row, len(self.COLUMNS) - 1)
+            if item.text() != text:
+                item.setText(text)
+        self.update_buttons()
+
+
+class SensorHealthWidget(QWidget):
+    """Running statistics of every sensor from the core's SensorHealth, one
+    table row per sensor, refreshed while visible"""
+    
+    COLUMNS = ["Sensor", "Målinger", "Middel", "Min / maks", "Støj", "Uændret i",
+               "Udfald", "Afvigelse", "Vurdering"]
+    
+    def __init__(self, core, parent=None):
+        super().__init__(parent)
+        self.core = core
+        self.init_ui()
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(SENSOR_HEALTH_REFRESH)
+    
+    def init_ui(self):
+        layout = QVBoxLayout()
+        
+        groups_layout = QHBoxLayout()
+        groups_layout.addWidget(QLabel("Sensorer der måler det samme:"))
+        self.groups_edit = QLineEdit()
+        self.groups_edit.setPlaceholderText("f.eks. 1+4, 2+5+6")
+        self.groups_edit.setToolTip("Grupper af sensorer der bør vise samme temperatur. "
+                                    "En sensor der afviger fra gruppens median markeres som uenig")
+        self.groups_edit.editingFinished.connect(self.groups_edited)
+        groups_layout.addWidget(self.groups_edit)
+        layout.addLayout(groups_layout)
+        
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.horizontalHeader().setSectionResizeMode(len(self.COLUMNS) - 1, QHeaderView.Stretch)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionMode(QAbstractItemView.NoSelection)
+        layout.addWidget(self.table)
+        
+        self.setLayout(layout)
+    
+    def groups(self):
+        """The groups typed in, as lists of sensor ids; raises ValueError"""
+        groups = []
+        for text in self.groups_edit.text().replace(';', ',').split(','):
+            if not text.strip():
+                continue
+            group = [int(number) - 1 for number in text.split('+')]
+            if len(group) < 2 or min(group) < 0:
+                raise ValueError(f"Ugyldig gruppe: {text.strip()}")
+            groups.append(group)
+        return groups
+    
+    def groups_edited(self):
+        try:
+            groups = self.groups()
+        except ValueError:
+            self.groups_edit.setStyleSheet("background-color: #ffcccc;")
+            return
+        self.groups_edit.setStyleSheet("")
+        self.core.sensor_health.set_groups(groups)
+        self.refresh()
+    
+    def refresh(self):
+        if not self.isVisible():
+            return
+        summary = self.core.sensor_health.summary()
+        self.table.setRowCount(len(summary))
+        for row, sensor_id in enumerate(sorted(summary)):
+            stats = summary[sensor_id]
+            issues = [ISSUE_NAMES[issue] for issue in stats['issues']]
+            cells = [
+                str(sensor_id + 1),
+                str(stats['readings']),
+                "--" if stats['mean'] is None else f"{stats['mean']:.2f}°C ± {stats['std']:.2f}",
+                "--" if stats['minimum'] is None else f"{stats['minimum']:.1f} / {stats['maximum']:.1f}°C",
+                "--" if stats['noise'] is None else f"{stats['noise']:.3f}°C",
+                f"{stats['stuck_for'] / 60:.0f} min",
+                f"{stats['dropout_rate'] * 100:.1f}% ({stats['dropouts']})",
+                "--" if stats['deviation'] is None else f"{stats['deviation']:+.2f}°C",
+                ", ".join(issues).capitalize() if issues else "OK",
+            ]
+            for column, text in enumerate(cells):
+                item = self.table.item(row, column)
+                if item is None:
+                    self.table.setItem(row, column, QTableWidgetItem(text))
+                elif item.text() != text:
+                    item.setText(text)
+    
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+
+
+class ControllerOverviewWidget(QWidget):
+    """All controllers on a ControllerManager, one table row per thermostat,
+    the primary link (core) among them. The other tabs show only that one,
+    and it is connected with the button at the top of the window"""
+    
+    COLUMNS = ["Controller", "Port", "Forbindelse", "Termostat", "Temperatur", "Sætpunkt", "Output", "Alarm"]
+    
+    def __init__(self, manager, core=None, parent=None):
+        super().__init__(parent)
+        self.manager = manager
+        self.core = core
+        # (controller, regulator_id) -> table row. A controller without
+        # status yet has a single row keyed (controller, None)
+        self.rows = {}
+        self.init_ui()
+    
+    def init_ui(self):
+        layout = QVBoxLayout()
+        
+        layout.addWidget(QLabel("Oversigt over alle controllere. De øvrige faner viser kun "
+                                "den primære forbindelse øverst i vinduet."))
+        
+        controls = QHBoxLayout()
+        controls.addWidget(QLabel("Navn:"))
+        self.name_edit = QLineEdit()
+        self.name_edit.setPlaceholderText("f.eks. HLT")
+        controls.addWidget(self.name_edit)
+        
+        controls.addWidget(QLabel("Port:"))
+        self.port_combo = QComboBox()
+        self.port_combo.setEditable(True)
+        self.port_combo.addItems(["COM1", "COM2", "COM3", "COM4", "COM5", "COM6", "COM7", "COM8"])
+        controls.addWidget(self.port_combo)
+        
+        controls.addWidget(QLabel("Baudrate:"))
+        self.baudrate_combo = QComboBox()
+        self.baudrate_combo.addItems(["9600", "19200", "38400", "57600", "115200"])
+        self.baudrate_combo.setCurrentText("115200")
+        controls.addWidget(self.baudrate_combo)
+        
+        add_btn = QPushButton("Tilføj")
+        add_btn.clicked.connect(self.add_controller)
+        controls.addWidget(add_btn)
+        
+        reconnect_btn = QPushButton("Genforbind")
+        reconnect_btn.clicked.connect(self.reconnect_controller)
+        controls.addWidget(reconnect_btn)
+        
+        remove_btn = QPushButton("Fjern")
+        remove_btn.clicked.connect(self.remove_controller)
+        controls.addWidget(remove_btn)
+        layout.addLayout(controls)
+        
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        layout.addWidget(self.table)
+        
+        self.setLayout(layout)
+    
+    def add_controller(self):
+        name = self.name_edit.text().strip()
+        port = self.port_combo.currentText().strip()
+        if not name or not port:
+            QMessageBox.warning(self, "Fejl", "Angiv navn og port")
+            return
+        try:
+            self.manager.add(name, port, int(self.baudrate_combo.currentText()))
+        except ValueError as e:
+            QMessageBox.warning(self, "Fejl", str(e))
+            return
+        self.row_for(name, None)
+        self.set_connection(name, port, "Forbinder...")
+        self.name_edit.clear()
+    
+    def selected_controller(self):
+        row = self.table.currentRow()
+        if row < 0:
+            return None
+        return self.table.item(row, 0).data(Qt.UserRole)[0]
+    
+    def is_primary(self, name):
+        if self.core is not None and name == self.core.name:
+            QMessageBox.information(self, "Controllere",
+                                    "Den primære forbindelse styres med Tilslut-knappen øverst i vinduet")
+            return True
+        return False
+    
+    def reconnect_controller(self):
+        name = self.selected_controller()
+        if name is not None and not self.is_primary(name):
+            self.manager.reconnect(name)
+    
+    def remove_controller(self):
+        name = self.selected_controller()
+        if name is None or self.is_primary(name):
+            return
+        self.manager.remove(name)
+        for row in sorted((r for key, r in self.rows.items() if key[0] == name), reverse=True):
+            self.table.removeRow(row)
+        self.rows = {self.table.item(row, 0).data(Qt.UserRole): row
+                     for row in range(self.table.rowCount())}
+    
+    def row_for(self, name, regulator_id):
+        key = (name, regulator_id)
+        row = self.rows.get(key)
+        if row is not None:
+            return row
+        placeholder = self.rows.pop((name, None), None)
+        if placeholder is not None:
+            row = placeholder
+        else:
+            # Keep each controller's rows together
+            rows = [r for k, r in self.rows.items() if k[0] == name]
+            row = max(rows) + 1 if rows else self.table.rowCount()
+            self.table.insertRow(row)
+            self.rows = {k: r + 1 if r >= row else r for k, r in self.rows.items()}
+            for column in range(len(self.COLUMNS)):
+                self.table.setItem(row, column, QTableWidgetItem(""))
+            link = self.manager.links.get(name)
+            if link is not None:
+                self.set_cell(row, 1, link.port)
+                self.set_cell(row, 2, "Tilsluttet" if link.connected else "Ikke tilsluttet")
+        self.rows[key] = row
+        self.table.item(row, 0).setData(Qt.UserRole, key)
+        self.set_cell(row, 0, name)
+        self.set_cell(row, 3, "--" if regulator_id is None else str(regulator_id + 1))
+        return row
+    
+    def set_cell(self, row, column, text):
+        item = self.table.item(row, column)
+        if item.text() != text:
+            item.setText(text)
+    
+    def set_connection(self, name, port, text):
+        for key, row in self.rows.items():
+            if key[0] == name:
+                self.set_cell(row, 1, port)
+                self.set_cell(row, 2, text)
+    
+    def handle_event(self, name, event, data):
+        link = self.manager.links.get(name)
+        if link is None:
+            if self.core is not None and name == self.core.name and event == EVENT_DISCONNECTED:
+                # The primary link is removed as it closes; its rows stay
+                for key, row in self.rows.items():
+                    if key[0] == name:
+                        self.set_cell(row, 2, f"Fejl: {data}" if data else "Ikke tilsluttet")
+            # Removed while its events were still queued
+            return
+        if event == EVENT_CONNECTED:
+            self.set_connection(name, link.port, "Tilsluttet")
+        elif event == EVENT_DISCONNECTED:
+            self.set_connection(name, link.port, f"Fejl: {data}" if data else "Ikke tilsluttet")
+        elif event == EVENT_FRAME and ('thermostats' in data or 'alarms' in data):
+            snapshot = StatusSnapshot(data)
+            for regulator_id, thermostat in snapshot.thermostats.items():
+                if not isinstance(regulator_id, int):
+                    continue
+                row = self.row_for(name, regulator_id)
+                self.set_cell(row, 4, f"{thermostat.get('currentTemp', 0):.1f}°C")
+                self.set_cell(row, 5, f"{thermostat.get('setpoint', 0):.1f}°C")
+                self.set_cell(row, 6, f"{thermostat.get('output', 0):.1f}%")
+                alarm = snapshot.alarm(regulator_id)
+                if alarm is not None:
+                    level = alarm.get('level', 0)
+                    self.set_cell(row, 7, ALARM_LEVEL_NAMES[level] if 0 <= level < len(ALARM_LEVEL_NAMES) else "Ukendt")
+
 class BrewControlApp(QMainWindow):
     def __init__(self):
         super().__init__()
-        self.serial_thread = None
         self.current_data = {}
+        # Every regulator link runs on the manager's event loop and is shown
+        # on the "Controllere" tab
+        self.manager = ControllerManager(os.path.join(HISTORY_DIR, "controllere"))
+        # The core owns the primary link's status polling and recording; the
+        # window only subscribes to it
+        self.core = AcquisitionCore(StatusRecorder(HISTORY_DIR, NUM_SENSORS, NUM_THERMOSTATS),
+                                    manager=self.manager)
+        self.status_server = None
+        self.autotune_dialogs = {}
         self.init_ui()
         self.init_serial()
-        
-        # Timer for status updates
-        self.update_timer = QTimer()
-        self.update_timer.timeout.connect(self.request_status)
-        self.update_timer.start(2000)
+        # GUI timings go into the core's metrics, next to the link's
+        self.stall_monitor = StallMonitor(self.core.metrics, self)
     
     def init_ui(self):
         self.setWindowTitle('BrewControl - Arduino Temperaturregulator')
@@ -321,13 +1101,15 @@ class BrewControlApp(QMainWindow):
         
         # Connection status and controls
         conn_layout = QHBoxLayout()
-        self.conn_label = QLabel("Forbindelse: Ikke tilsluttet")
+        self.conn_label = StatusLabel("Forbindelse: Ikke tilsluttet")
         self.conn_label.setFont(QFont('Arial', 10, QFont.Bold))
         conn_layout.addWidget(self.conn_label)
         
         # Serial port controls
         conn_layout.addWidget(QLabel("Port:"))
         self.port_combo = QComboBox()
+        # Editable for other port names and URLs such as socket://localhost:7000
+        self.port_combo.setEditable(True)
         self.port_combo.addItems(["COM1", "COM2", "COM3", "COM4", "COM5", "COM6", "COM7", "COM8"])
         self.port_combo.setCurrentText("COM3")
         conn_layout.addWidget(self.port_combo)
@@ -346,59 +1128,58 @@ class BrewControlApp(QMainWindow):
         
         # Tabs
         tabs = QTabWidget()
+        self.tabs = tabs
         
         # Thermostat Controllers tab
         thermostat_tab = QWidget()
-        thermostat_layout = QHBoxLayout()
+        self.thermostat_layout = QHBoxLayout()
         
         self.thermostat_widgets = []
-        for i in range(3):
-            group = QGroupBox(f"Termostat {i+1}")
-            group_layout = QVBoxLayout()
-            
-            thermostat_widget = ThermostatWidget(i, self)
-            self.thermostat_widgets.append(thermostat_widget)
-            group_layout.addWidget(thermostat_widget)
-            group.setLayout(group_layout)
-            
-            thermostat_layout.addWidget(group)
+        for i in range(NUM_THERMOSTATS):
+            self.add_thermostat_widget()
         
-        thermostat_tab.setLayout(thermostat_layout)
+        thermostat_tab.setLayout(self.thermostat_layout)
         tabs.addTab(thermostat_tab, "Termostater")
         
         # Alarms tab
         alarm_tab = QWidget()
-        alarm_layout = QHBoxLayout()
+        self.alarm_layout = QHBoxLayout()
         
         self.alarm_widgets = []
-        for i in range(3):
-            group = QGroupBox(f"Alarm {i+1}")
-            group_layout = QVBoxLayout()
-            
-            alarm_widget = AlarmWidget(i, self)
-            self.alarm_widgets.append(alarm_widget)
-            group_layout.addWidget(alarm_widget)
-            group.setLayout(group_layout)
-            
-            alarm_layout.addWidget(group)
+        for i in range(NUM_THERMOSTATS):
+            self.add_alarm_widget()
         
-        alarm_tab.setLayout(alarm_layout)
+        alarm_tab.setLayout(self.alarm_layout)
         tabs.addTab(alarm_tab, "Alarmer")
         
         # Sensors tab
         sensor_tab = QWidget()
-        sensor_layout = QVBoxLayout()
+        sensor_tab_layout = QVBoxLayout()
+        self.sensor_layout = QVBoxLayout()
         
         self.sensor_labels = []
-        for i in range(7):
-            label = QLabel(f"Sensor {i+1}: --")
-            label.setFont(QFont('Arial', 12))
-            self.sensor_labels.append(label)
-            sensor_layout.addWidget(label)
-        
-        sensor_tab.setLayout(sensor_layout)
+        for i in range(NUM_SENSORS):
+            self.add_sensor_label()
+        
+        sensor_tab_layout.addLayout(self.sensor_layout)
+        sensor_health_group = QGroupBox("Sensorhelbred")
+        sensor_health_layout = QVBoxLayout()
+        self.sensor_health_widget = SensorHealthWidget(self.core)
+        sensor_health_layout.addWidget(self.sensor_health_widget)
+        sensor_health_group.setLayout(sensor_health_layout)
+        sensor_tab_layout.addWidget(sensor_health_group)
+        
+        sensor_tab.setLayout(sensor_tab_layout)
         tabs.addTab(sensor_tab, "Sensorer")
         
+        # All controllers on the connection manager
+        self.controller_overview = ControllerOverviewWidget(self.manager, self.core)
+        tabs.addTab(self.controller_overview, "Controllere")
+        
+        # Timed setpoint programs, e.g. step mashes
+        self.recipe_widget = RecipeWidget(self)
+        tabs.addTab(self.recipe_widget, "Opskrift")
+        
         # Manual command tab
         manual_tab = QWidget()
         manual_layout = QVBoxLayout()
@@ -417,8 +1198,7 @@ class BrewControlApp(QMainWindow):
         
         # Response
         manual_layout.addWidget(QLabel("Svar:"))
-        self.manual_response_text = QTextEdit()
-        self.manual_response_text.setReadOnly(True)
+        self.manual_response_text = LogView(max_lines=MANUAL_RESPONSE_LINES)
         manual_layout.addWidget(self.manual_response_text)
         
         manual_tab.setLayout(manual_layout)
@@ -442,15 +1222,41 @@ class BrewControlApp(QMainWindow):
         self.last_response_text.setMaximumHeight(100)
         comm_layout.addWidget(self.last_response_text)
         
+        # Receive latency of the last frame
+        self.latency_label = QLabel("Modtagelsesforsinkelse: --")
+        comm_layout.addWidget(self.latency_label)
+        
+        # Republish status to local dashboards without extra serial traffic
+        server_layout = QHBoxLayout()
+        self.server_cb = QCheckBox("Del status med lokale klienter (TCP/WebSocket) på port")
+        self.server_cb.toggled.connect(self.toggle_status_server)
+        server_layout.addWidget(self.server_cb)
+        self.server_port_spin = QSpinBox()
+        self.server_port_spin.setRange(1024, 65535)
+        self.server_port_spin.setValue(STATUS_SERVER_PORT)
+        server_layout.addWidget(self.server_port_spin)
+        self.server_commands_cb = QCheckBox("Tillad kommandoer fra klienter")
+        self.server_commands_cb.setToolTip("Lad klienter sende kommandoer til regulatoren. "
+                                           "Ellers kan de kun læse status")
+        server_layout.addWidget(self.server_commands_cb)
+        server_layout.addStretch()
+        comm_layout.addLayout(server_layout)
+        
         comm_tab.setLayout(comm_layout)
         tabs.addTab(comm_tab, "Kommunikation")
+        self.comm_tab = comm_tab
+        self.last_response_pending = None
+        tabs.currentChanged.connect(self.show_last_response)
+        
+        # Throughput, parse and round-trip times, losses and GUI stalls
+        self.metrics_view = MetricsView(self.core.metrics)
+        tabs.addTab(self.metrics_view, "Ydelse")
         
         # Log tab
         log_tab = QWidget()
         log_layout = QVBoxLayout()
         
-        self.log_text = QTextEdit()
-        self.log_text.setReadOnly(True)
+        self.log_text = LogView(max_lines=LOG_LINES)
         log_layout.addWidget(self.log_text)
         
         log_tab.setLayout(log_layout)
@@ -473,103 +1279,293 @@ class BrewControlApp(QMainWindow):
         layout.addLayout(button_layout)
         central_widget.setLayout(layout)
     
+    def add_thermostat_widget(self):
+        i = len(self.thermostat_widgets)
+        group = QGroupBox(f"Termostat {i+1}")
+        group_layout = QVBoxLayout()
+        
+        thermostat_widget = ThermostatWidget(i, self)
+        self.thermostat_widgets.append(thermostat_widget)
+        group_layout.addWidget(thermostat_widget)
+        group.setLayout(group_layout)
+        
+        self.thermostat_layout.addWidget(group)
+        return thermostat_widget
+    
+    def add_alarm_widget(self):
+        i = len(self.alarm_widgets)
+        group = QGroupBox(f"Alarm {i+1}")
+        group_layout = QVBoxLayout()
+        
+        alarm_widget = AlarmWidget(i, self)
+        self.alarm_widgets.append(alarm_widget)
+        group_layout.addWidget(alarm_widget)
+        group.setLayout(group_layout)
+        
+        self.alarm_layout.addWidget(group)
+        return alarm_widget
+    
+    def add_sensor_label(self):
+        i = len(self.sensor_labels)
+        label = StatusLabel(f"Sensor {i+1}: --")
+        label.setFont(QFont('Arial', 12))
+        self.sensor_labels.append(label)
+        self.sensor_layout.addWidget(label)
+        return label
+    
     def init_serial(self):
-        # Don't auto-start serial connection
-        pass
+        # Don't auto-start serial connection, only route core events to the GUI
+        self.bridge = CoreBridge(self.core, self)
+        self.bridge.event.connect(self.handle_core_event)
+        self.manager_bridge = ManagerBridge(self.manager, self)
+        self.manager_bridge.event.connect(self.controller_overview.handle_event)
+    
+    @property
+    def connected(self):
+        return self.core.connected
     
     def toggle_connection(self):
-        if self.serial_thread and self.serial_thread.isRunning():
+        if self.core.port is not None:
             # Disconnect
-            self.serial_thread.stop()
-            self.serial_thread.wait()
-            self.serial_thread = None
+            self.core.disconnect()
             self.connect_btn.setText("Tilslut")
-            self.conn_label.setText("Forbindelse: Ikke tilsluttet")
-            self.conn_label.setStyleSheet("background-color: red; color: white; padding: 5px;")
+            self.conn_label.set_status("Forbindelse: Ikke tilsluttet", "background-color: red; color: white; padding: 5px;")
         else:
-            # Connect
+            # Connect; the core starts polling for status by itself
             port = self.port_combo.currentText()
             baudrate = int(self.baudrate_combo.currentText())
-            self.serial_thread = SerialThread(port, baudrate)
-            self.serial_thread.data_received.connect(self.handle_serial_data)
-            self.serial_thread.start()
+            try:
+                self.core.connect(port, baudrate)
+            except ValueError as e:
+                # The port is used by another controller
+                QMessageBox.warning(self, "Fejl", str(e))
+                return
             self.connect_btn.setText("Afbryd")
-            
-            # Start status updates when connected
-            QTimer.singleShot(1000, self.request_status)
+    
+    def toggle_status_server(self, enabled):
+        timestamp = time.strftime("%H:%M:%S")
+        if enabled:
+            self.status_server = StatusServer(self.core, port=self.server_port_spin.value(),
+                                              allow_commands=self.server_commands_cb.isChecked())
+            try:
+                self.status_server.start()
+            except OSError as e:
+                self.status_server = None
+                QMessageBox.warning(self, "Fejl", f"Kunne ikke starte statusserver: {str(e)}")
+                self.server_cb.setChecked(False)
+                return
+            self.server_port_spin.setEnabled(False)
+            self.server_commands_cb.setEnabled(False)
+            self.log_text.append(f"[{timestamp}] Statusserver startet på port {self.status_server.port}")
+        elif self.status_server:
+            self.status_server.stop()
+            self.status_server = None
+            self.server_port_spin.setEnabled(True)
+            self.server_commands_cb.setEnabled(True)
+            self.log_text.append(f"[{timestamp}] Statusserver stoppet")
+    
+    def handle_core_event(self, event, data, link_id):
+        if link_id != self.core.link_id:
+            # From a link that has been replaced since, e.g. a late error
+            # that would otherwise tear down the new connection
+            return
+        if event == EVENT_FRAME:
+            started = time.perf_counter()
+            self.handle_serial_data(data)
+            self.core.metrics.observe('gui_frame_seconds', time.perf_counter() - started)
+            for dialog in self.autotune_dialogs.values():
+                dialog.handle_frame(data)
+            self.recipe_widget.handle_frame(data)
+        elif event == EVENT_LATENCY:
+            self.handle_frame_latency(data)
+        elif event == EVENT_COMMAND:
+            self.handle_command_finished(data)
+        elif event == EVENT_ALARM:
+            self.handle_alarm_change(data)
+        elif event == EVENT_PREDICTION:
+            self.handle_prediction(data)
+        elif event == EVENT_SENSOR_HEALTH:
+            self.handle_sensor_health(data)
+        elif event == EVENT_DISCONNECTED:
+            self.handle_disconnected(data)
+    
+    def handle_disconnected(self, reason):
+        if reason is None:
+            return
+        # The link dropped or could not be opened
+        for dialog in self.autotune_dialogs.values():
+            dialog.abort("Forbindelsen blev afbrudt")
+        self.core.disconnect()
+        self.connect_btn.setText("Tilslut")
+        self.conn_label.set_status("Forbindelse: Ikke tilsluttet", "background-color: red; color: white; padding: 5px;")
+        timestamp = time.strftime("%H:%M:%S")
+        self.log_text.append(f"[{timestamp}] Forbindelsesfejl: {reason}", ERROR)
+    
+    def handle_alarm_change(self, change):
+        name = ALARM_LEVEL_NAMES[change.level] if 0 <= change.level < len(ALARM_LEVEL_NAMES) else "Ukendt"
+        timestamp = time.strftime("%H:%M:%S")
+        level = INFO if change.level == 0 else WARNING
+        self.log_text.append(f"[{timestamp}] Alarm {change.regulator_id + 1}: {name}", level)
+    
+    def handle_prediction(self, prediction):
+        regulator_id = prediction.regulator_id
+        while regulator_id >= len(self.alarm_widgets):
+            self.add_alarm_widget()
+        self.alarm_widgets[regulator_id].update_prediction(prediction)
+        timestamp = time.strftime("%H:%M:%S")
+        name = LIMIT_NAMES[prediction.limit]
+        if prediction.active:
+            self.log_text.append(
+                f"[{timestamp}] Termostat {regulator_id + 1} forventes at nå {name} "
+                f"({prediction.threshold:g}°C) om {prediction.eta / 60:.0f} min, "
+                f"{prediction.rate * 60:+.2f}°C/min", WARNING)
+        else:
+            self.log_text.append(f"[{timestamp}] Termostat {regulator_id + 1}: {name} forventes ikke længere")
+    
+    def handle_sensor_health(self, change):
+        timestamp = time.strftime("%H:%M:%S")
+        name = ISSUE_NAMES[change.issue]
+        if not change.active:
+            self.log_text.append(f"[{timestamp}] Sensor {change.sensor_id + 1}: ikke længere {name}")
+            return
+        if change.issue == ISSUE_NOISY:
+            detail = f"støj {change.value:.2f}°C"
+        elif change.issue == ISSUE_STUCK:
+            detail = f"uændret i {change.value / 60:.0f} min"
+        elif change.issue == ISSUE_DROPOUTS:
+            detail = f"fejl {change.value * 100:.1f}% af tiden"
+        else:
+            detail = f"{change.value:.1f}°C fra gruppens median"
+        self.log_text.append(f"[{timestamp}] Sensor {change.sensor_id + 1}: {name} ({detail})", WARNING)
     
     def handle_serial_data(self, data):
+        previous = self.current_data
         self.current_data = data
-        self.conn_label.setText("Forbindelse: Tilsluttet")
-        self.conn_label.setStyleSheet("background-color: green; color: white; padding: 5px;")
         
-        # Update communication tab with response
-        self.last_response_text.setPlainText(json.dumps(data, indent=2, ensure_ascii=False))
+        self.conn_label.set_status("Forbindelse: Tilsluttet", "background-color: green; color: white; padding: 5px;")
+        
+        # Update communication tab with response. Pretty-printing is deferred
+        # until the tab is actually shown
+        self.last_response_pending = data
+        if self.tabs.currentWidget() is self.comm_tab:
+            self.show_last_response()
         
-        # Update manual command response
+        # Update manual command response, one compact line per frame
         timestamp = time.strftime("%H:%M:%S")
-        self.manual_response_text.append(f"[{timestamp}] MODTAGET: {json.dumps(data, indent=2, ensure_ascii=False)}")
-        
-        # Update displays
-        if 'thermostats' in data and 'sensors' in data:
-            for i, thermostat_widget in enumerate(self.thermostat_widgets):
-                if i < len(data['thermostats']):
-                    thermostat_widget.update_display(data['thermostats'][i], data['sensors'])
-        
-        if 'alarms' in data:
-            for i, alarm_widget in enumerate(self.alarm_widgets):
-                # Find alarm for this thermostat
-                for alarm in data['alarms']:
-                    if alarm.get('regulator_id') == i:
-                        alarm_widget.update_display(alarm)
-                        break
-        
-        if 'sensors' in data:
-            for i, sensor_label in enumerate(self.sensor_labels):
-                # Find sensor by sensor_id
-                for sensor in data['sensors']:
-                    if sensor.get('sensor_id') == i:
-                        temp = sensor.get('temperature', 0)
-                        health = sensor.get('health', 0)
-                        simulated = sensor.get('simulated', False)
-                        sensor_type = sensor.get('type', 'Unknown')
-                        
-                        health_str = ["OK", "Fejl", "Timeout"][health]
-                        sim_str = " (Simuleret)" if simulated else ""
-                        
-                        sensor_label.setText(f"Sensor {i+1} ({sensor_type}): {temp:.1f}°C - {health_str}{sim_str}")
-                        
-                        if health == 0:
-                            sensor_label.setStyleSheet("background-color: lightgreen; padding: 5px;")
-                        elif health == 1:
-                            sensor_label.setStyleSheet("background-color: orange; padding: 5px;")
-                        else:
-                            sensor_label.setStyleSheet("background-color: red; color: white; padding: 5px;")
-                        break
+        level = ERROR if 'error' in data else DEBUG
+        self.manual_response_text.append(f"[{timestamp}] MODTAGET: {json.dumps(data, ensure_ascii=False)}", level)
+        
+        # Index the frame once; every widget below reads from the snapshot.
+        # Widgets compare against what they already show, and whole sections
+        # are skipped when they are identical to the previous frame. Rigs
+        # reporting more regulators or sensors than we have widgets for get
+        # extra widgets on the fly.
+        snapshot = StatusSnapshot(data)
+        
+        for regulator_id, thermostat in snapshot.thermostats.items():
+            if not isinstance(regulator_id, int) or regulator_id < 0:
+                continue
+            while regulator_id >= len(self.thermostat_widgets):
+                self.add_thermostat_widget()
+            self.thermostat_widgets[regulator_id].update_display(
+                thermostat, snapshot.sensor(thermostat.get('sensorIndex')))
+        
+        if data.get('alarms') != previous.get('alarms'):
+            for regulator_id, alarm in snapshot.alarms.items():
+                if not isinstance(regulator_id, int) or regulator_id < 0:
+                    continue
+                while regulator_id >= len(self.alarm_widgets):
+                    self.add_alarm_widget()
+                self.alarm_widgets[regulator_id].update_display(alarm)
+        
+        config = data.get('config')
+        if config and config is not previous.get('config'):
+            for regulator_id, limits in enumerate(config.get('alarms') or []):
+                if regulator_id < len(self.alarm_widgets):
+                    self.alarm_widgets[regulator_id].show_limits(limits)
+        
+        for sensor_id, sensor in snapshot.sensors.items():
+            if not isinstance(sensor_id, int) or sensor_id < 0:
+                continue
+            while sensor_id >= len(self.sensor_labels):
+                self.add_sensor_label()
+            temp = sensor.get('temperature', 0)
+            health = sensor.get('health', 0)
+            simulated = sensor.get('simulated', False)
+            sensor_type = sensor.get('type', 'Unknown')
+            
+            health_str = ["OK", "Fejl", "Timeout"][health]
+            sim_str = " (Simuleret)" if simulated else ""
+            
+            if health == 0:
+                style = "background-color: lightgreen; padding: 5px;"
+            elif health == 1:
+                style = "background-color: orange; padding: 5px;"
+            else:
+                style = "background-color: red; color: white; padding: 5px;"
+            self.sensor_labels[sensor_id].set_status(
+                f"Sensor {sensor_id+1} ({sensor_type}): {temp:.1f}°C - {health_str}{sim_str}", style)
         
         # Log data
         timestamp = time.strftime("%H:%M:%S")
-        self.log_text.append(f"[{timestamp}] Status modtaget")
+        self.log_text.append(f"[{timestamp}] Status modtaget", DEBUG)
+    
+    def show_last_response(self):
+        if self.last_response_pending is None or self.tabs.currentWidget() is not self.comm_tab:
+            return
+        self.last_response_text.setPlainText(json.dumps(self.last_response_pending, indent=2, ensure_ascii=False))
+        self.last_response_pending = None
     
-    def send_command_with_log(self, command):
-        if self.serial_thread and self.serial_thread.isRunning():
+    def handle_frame_latency(self, latency):
+        session = self.core.session
+        mode = "strømmet" if session.streaming else "pollet"
+        self.latency_label.setText(
+            f"Modtagelsesforsinkelse: {latency * 1000:.1f} ms | "
+            f"Kasserede bytes: {session.parser.discarded_bytes} | Status: {mode}"
+        )
+    
+    def handle_command_finished(self, pending):
+        if pending.error is None:
+            return
+        timestamp = time.strftime("%H:%M:%S")
+        self.log_text.append(f"[{timestamp}] Kommando {pending.describe()} fejlede: {pending.error}", ERROR)
+    
+    def open_autotune(self, regulator_id):
+        dialog = self.autotune_dialogs.get(regulator_id)
+        if dialog is None:
+            setpoint = self.thermostat_widgets[regulator_id].setpoint_spin.value()
+            dialog = AutoTuneDialog(regulator_id, setpoint, self)
+            self.autotune_dialogs[regulator_id] = dialog
+        dialog.show()
+        dialog.raise_()
+    
+    def log_autotune(self, regulator_id, text, level=INFO):
+        timestamp = time.strftime("%H:%M:%S")
+        self.log_text.append(f"[{timestamp}] Autotune termostat {regulator_id + 1} {text}", level)
+    
+    def send_command_with_log(self, command, callback=None, priority=False):
+        if self.connected:
             # Update communication tab with command
             self.last_command_text.setPlainText(json.dumps(command, indent=2, ensure_ascii=False))
-            self.serial_thread.send_command(command)
+            return self.core.send(command, callback=callback, priority=priority)
+        return None
     
     def send_manual_command(self):
         try:
             # Parse JSON from text field
             command_text = self.manual_command_text.toPlainText().strip()
             command = json.loads(command_text)
+            if not isinstance(command, dict):
+                QMessageBox.warning(self, "JSON Fejl", "Kommandoen skal være et JSON-objekt, f.eks. {\"command\": \"getStatus\"}")
+                return
             
             # Send command
-            if self.serial_thread and self.serial_thread.isRunning():
-                self.serial_thread.send_command(command)
+            if self.connected:
+                self.send_command_with_log(command)
                 
                 # Show sent command in response area
                 timestamp = time.strftime("%H:%M:%S")
-                self.manual_response_text.append(f"[{timestamp}] SENDT: {json.dumps(command, indent=2, ensure_ascii=False)}")
+                self.manual_response_text.append(f"[{timestamp}] SENDT: {json.dumps(command, ensure_ascii=False)}")
                 
                 # Log in main log
                 self.log_text.append(f"[{timestamp}] Manuel kommando sendt")
@@ -580,14 +1576,6 @@ class BrewControlApp(QMainWindow):
             QMessageBox.warning(self, "JSON Fejl", f"Ugyldig JSON: {str(e)}")
         except Exception as e:
             QMessageBox.warning(self, "Fejl", f"Kunne ikke sende kommando: {str(e)}")
-        if self.serial_thread and self.serial_thread.isRunning():
-            # Update communication tab with command
-            self.last_command_text.setPlainText(json.dumps(command, indent=2, ensure_ascii=False))
-            self.serial_thread.send_command(command)
-    
-    def request_status(self):
-        command = {"command": "getStatus"}
-        self.send_command_with_log(command)
     
     def toggle_thermostat(self, regulator_id, enabled):
         command = {
@@ -612,7 +1600,7 @@ class BrewControlApp(QMainWindow):
         self.log_text.append(f"[{timestamp}] Alarm {alarm_index + 1} kvitteret")
     
     def apply_config(self):
-        if not self.serial_thread:
+        if not self.connected:
             return
         
         # Collect thermostat configuration
@@ -653,24 +1641,38 @@ class BrewControlApp(QMainWindow):
         QMessageBox.information(self, "Konfiguration", "Konfiguration sendt til Arduino")
     
     def emergency_stop(self):
+        # Nothing running may switch a thermostat back on afterwards
+        for dialog in self.autotune_dialogs.values():
+            dialog.abort("NØDSTOP", disable=True)
+        if self.recipe_widget.running:
+            self.recipe_widget.stop()
+        
         # Disable all thermostats
-        for i in range(3):
+        for i in range(len(self.thermostat_widgets)):
             command = {
                 "command": "toggleEnable",
                 "regulator_id": i,
                 "enabled": False
             }
-            self.send_command_with_log(command)
+            # Ahead of whatever else is queued
+            self.send_command_with_log(command, priority=True)
         
         timestamp = time.strftime("%H:%M:%S")
-        self.log_text.append(f"[{timestamp}] NØDSTOP aktiveret - alle termostater deaktiveret")
+        self.log_text.append(f"[{timestamp}] NØDSTOP aktiveret - alle termostater deaktiveret", WARNING)
         
         QMessageBox.warning(self, "NØDSTOP", "Alle termostater er blevet deaktiveret!")
     
     def closeEvent(self, event):
-        if self.serial_thread:
-            self.serial_thread.stop()
-            self.serial_thread.wait()
+        for dialog in self.autotune_dialogs.values():
+            # Puts the thermostat's configuration back while the link is up
+            dialog.abort("Programmet blev lukket")
+        if self.status_server:
+            self.status_server.stop()
+        self.stall_monitor.stop()
+        self.bridge.detach()
+        self.core.close()
+        self.manager_bridge.detach()
+        self.manager.close()
         event.accept()
 
 if __name__ == '__main__':
@@ -1,8 +1,35 @@
 #include "JSONHandler.h"
 #include <Arduino.h>
 
-JSONHandler::JSONHandler(AlarmSystem* alarm, SensorManager* sensor, PIDController* pid, ButtonManager* button) 
-  : alarmSystem(alarm), sensorManager(sensor), pidController(pid), buttonManager(button) {
+JSONHandler::JSONHandler(AlarmSystem* alarm, SensorManager* sensor, PIDController* pid, ButtonManager* button,
+                         Print* out) 
+  : alarmSystem(alarm), sensorManager(sensor), pidController(pid), buttonManager(button), output(out),
+    compactFormat(false), subscribeInterval(0), subscribeChangesOnly(false),
+    lastPublish(0), lastFullPublish(0) {
+}
+
+// Two decimals are plenty for the host and keep compact frames short
+static float round2(float value) {
+  return round(value * 100.0) / 100.0;
+}
+
+// Changes the host can see. Sensor lastUpdate moves on every read and is not
+// counted, or every sensor would be sent in every changesOnly frame
+static bool sensorChanged(const SensorReading& a, const SensorReading& b) {
+  return round2(a.temperature) != round2(b.temperature) || a.health != b.health ||
+         a.errorCode != b.errorCode || a.simulated != b.simulated;
+}
+
+static bool pidChanged(const PIDStatus& a, const PIDStatus& b) {
+  return round2(a.input) != round2(b.input) || round2(a.output) != round2(b.output) ||
+         round2(a.setpoint) != round2(b.setpoint) || a.enabled != b.enabled ||
+         a.type != b.type || a.outputActive != b.outputActive ||
+         a.sensorIndex != b.sensorIndex || a.state != b.state;
+}
+
+static bool alarmChanged(const AlarmState& a, const AlarmState& b) {
+  return a.level != b.level || a.errorCode != b.errorCode || a.acknowledged != b.acknowledged ||
+         a.timestamp != b.timestamp || a.active != b.active;
 }
 
 void JSONHandler::processCommand(const String& command) {
@@ -17,6 +44,11 @@ void JSONHandler::processCommand(const String& command) {
     return;
   }
   
+  // Echo the sequence number so the host can match the reply to its command
+  if (request.containsKey("seq")) {
+    response["seq"] = request["seq"];
+  }
+  
   String cmd = request["command"];
   if (cmd.length() == 0) {
     response["error"] = "Missing command";
@@ -27,8 +59,20 @@ void JSONHandler::processCommand(const String& command) {
   response["command"] = cmd;
   response["timestamp"] = millis();
   
+  if (cmd == "setFormat") {
+    // Decided before the marker below, so the reply is already in the new format
+    handleSetFormat(request, response);
+  }
+  if (compactFormat) {
+    response["f"] = COMPACT_FORMAT_VERSION;
+  }
+  
   if (cmd == "getStatus") {
-    handleGetStatus(response);
+    handleGetStatus(request, response);
+  } else if (cmd == "setFormat") {
+    // Handled above
+  } else if (cmd == "subscribe") {
+    handleSubscribe(request, response);
   } else if (cmd == "setConfig") {
     handleSetConfig(request, response);
   } else if (cmd == "ackAlarm") {
@@ -51,7 +95,7 @@ void JSONHandler::processCommand(const String& command) {
   sendResponse(response);
 }
 
-void JSONHandler::handleGetStatus(JsonDocument& response) {
+void JSONHandler::handleGetStatus(const JsonDocument& request, JsonDocument& response) {
   if (!alarmSystem || !sensorManager || !pidController || !buttonManager) {
     response["error"] = "System not initialized";
     response["errorCode"] = ERROR_CONFIGURATION;
@@ -61,6 +105,49 @@ void JSONHandler::handleGetStatus(JsonDocument& response) {
   addSensorData(response);
   addPIDData(response);
   addAlarmData(response);
+  // The configuration rarely changes, so compact polls only include it on request
+  if (!compactFormat || request["config"] == true) {
+    addConfigData(response);
+  }
+}
+
+void JSONHandler::handleSetFormat(const JsonDocument& request, JsonDocument& response) {
+  String format = request["format"] | "";
+  if (format == "compact") {
+    compactFormat = true;
+  } else if (format == "json") {
+    compactFormat = false;
+  } else {
+    response["error"] = "Invalid format";
+    response["errorCode"] = ERROR_COMMUNICATION;
+    return;
+  }
+  response["format"] = compactFormat ? "compact" : "json";
+  response["status"] = "format_set";
+}
+
+void JSONHandler::handleSubscribe(const JsonDocument& request, JsonDocument& response) {
+  long interval = request["interval"] | (long)UPDATE_INTERVAL;
+  if (interval < 0) {
+    response["error"] = "Invalid interval";
+    response["errorCode"] = ERROR_COMMUNICATION;
+    return;
+  }
+  if (interval > 0 && interval < SUBSCRIBE_MIN_INTERVAL) {
+    interval = SUBSCRIBE_MIN_INTERVAL;
+  }
+  subscribeInterval = interval;
+  subscribeChangesOnly = request["changesOnly"] | false;
+  lastPublish = lastFullPublish = millis();
+  
+  response["status"] = subscribeInterval > 0 ? "subscribed" : "unsubscribed";
+  response["interval"] = subscribeInterval;
+  response["changesOnly"] = subscribeChangesOnly;
+  response["keepalive"] = SUBSCRIBE_KEEPALIVE;
+  // The full status is the baseline later changesOnly frames build on
+  addSensorData(response);
+  addPIDData(response);
+  addAlarmData(response);
   addConfigData(response);
 }
 
@@ -154,14 +241,33 @@ void JSONHandler::handleSetSimulation(const JsonDocument& request, JsonDocument&
   addConfigData(response);
 }
 
-void JSONHandler::addSensorData(JsonDocument& doc) {
-  if (!sensorManager) return;
+int JSONHandler::addSensorData(JsonDocument& doc, bool changesOnly) {
+  if (!sensorManager) return 0;
   
-  JsonArray sensors = doc.createNestedArray("sensors");
+  // Compact: [temperature, health, errorCode, lastUpdate, simulated], index = sensor_id
+  JsonArray sensors = doc.createNestedArray(compactFormat ? "s" : "sensors");
+  int sent = 0;
   for (int i = 0; i < TOTAL_SENSORS; i++) {
-    JsonObject sensor = sensors.createNestedObject();
     const SensorReading& reading = sensorManager->getSensorReading(i);
+    if (changesOnly && !sensorChanged(reading, sentSensors[i])) {
+      // Compact records are positional, so unchanged ones leave a null
+      if (compactFormat) sensors.add(nullptr);
+      continue;
+    }
+    sentSensors[i] = reading;
+    sent++;
     
+    if (compactFormat) {
+      JsonArray sensor = sensors.createNestedArray();
+      sensor.add(round2(reading.temperature));
+      sensor.add(reading.health);
+      sensor.add(reading.errorCode);
+      sensor.add(reading.lastUpdate);
+      sensor.add(reading.simulated ? 1 : 0);
+      continue;
+    }
+    
+    JsonObject sensor = sensors.createNestedObject();
     sensor["sensor_id"] = i;
     sensor["temperature"] = reading.temperature;
     sensor["health"] = reading.health;
@@ -169,16 +275,39 @@ void JSONHandler::addSensorData(JsonDocument& doc) {
     sensor["lastUpdate"] = reading.lastUpdate;
     sensor["simulated"] = reading.simulated;
   }
+  return sent;
 }
 
-void JSONHandler::addPIDData(JsonDocument& doc) {
-  if (!pidController || !buttonManager) return;
+int JSONHandler::addPIDData(JsonDocument& doc, bool changesOnly) {
+  if (!pidController || !buttonManager) return 0;
   
-  JsonArray thermostats = doc.createNestedArray("thermostats");
+  // Compact: [currentTemp, output, setpoint, enabled, type, outputActive, sensorIndex, state],
+  // index = regulator_id
+  JsonArray thermostats = doc.createNestedArray(compactFormat ? "t" : "thermostats");
+  int sent = 0;
   for (int i = 0; i < NUM_PIDS; i++) {
-    JsonObject thermostat = thermostats.createNestedObject();
     const PIDStatus& status = pidController->getPIDStatus(i);
+    if (changesOnly && !pidChanged(status, sentPIDs[i])) {
+      if (compactFormat) thermostats.add(nullptr);
+      continue;
+    }
+    sentPIDs[i] = status;
+    sent++;
+    
+    if (compactFormat) {
+      JsonArray thermostat = thermostats.createNestedArray();
+      thermostat.add(round2(status.input));
+      thermostat.add(round2(status.output));
+      thermostat.add(round2(status.setpoint));
+      thermostat.add(status.enabled ? 1 : 0);
+      thermostat.add(status.type);
+      thermostat.add(status.outputActive ? 1 : 0);
+      thermostat.add(status.sensorIndex);
+      thermostat.add(status.state);
+      continue;
+    }
     
+    JsonObject thermostat = thermostats.createNestedObject();
     thermostat["regulator_id"] = i;
     thermostat["currentTemp"] = status.input;
     thermostat["output"] = status.output;
@@ -189,16 +318,35 @@ void JSONHandler::addPIDData(JsonDocument& doc) {
     thermostat["sensorIndex"] = status.sensorIndex;
     thermostat["state"] = status.state;
   }
+  return sent;
 }
 
-void JSONHandler::addAlarmData(JsonDocument& doc) {
-  if (!alarmSystem) return;
+int JSONHandler::addAlarmData(JsonDocument& doc, bool changesOnly) {
+  if (!alarmSystem) return 0;
   
-  JsonArray alarms = doc.createNestedArray("alarms");
+  // Compact: [level, errorCode, acknowledged, timestamp, active], index = regulator_id
+  JsonArray alarms = doc.createNestedArray(compactFormat ? "a" : "alarms");
+  int sent = 0;
   for (int i = 0; i < NUM_PIDS; i++) {
-    JsonObject alarm = alarms.createNestedObject();
     AlarmState state = alarmSystem->getAlarmState(i);
+    if (changesOnly && !alarmChanged(state, sentAlarms[i])) {
+      if (compactFormat) alarms.add(nullptr);
+      continue;
+    }
+    sentAlarms[i] = state;
+    sent++;
+    
+    if (compactFormat) {
+      JsonArray alarm = alarms.createNestedArray();
+      alarm.add(state.level);
+      alarm.add(state.errorCode);
+      alarm.add(state.acknowledged ? 1 : 0);
+      alarm.add(state.timestamp);
+      alarm.add(state.active ? 1 : 0);
+      continue;
+    }
     
+    JsonObject alarm = alarms.createNestedObject();
     alarm["regulator_id"] = i;
     alarm["level"] = state.level;
     alarm["errorCode"] = state.errorCode;
@@ -206,11 +354,43 @@ void JSONHandler::addAlarmData(JsonDocument& doc) {
     alarm["timestamp"] = state.timestamp;
     alarm["active"] = state.active;
   }
+  return sent;
 }
 
 void JSONHandler::addConfigData(JsonDocument& doc) {
   if (!pidController || !alarmSystem) return;
   
+  if (compactFormat) {
+    // p: [type, kp, ki, kd, setpoint, sensorIndex, enabled, manualOutput]
+    // a: [warningLow, warningHigh, alarmLow, alarmHigh, resetMode, enabled]
+    JsonObject config = doc.createNestedObject("c");
+    JsonArray pidConfigs = config.createNestedArray("p");
+    for (int i = 0; i < NUM_PIDS; i++) {
+      JsonArray pidConfig = pidConfigs.createNestedArray();
+      const PIDConfig& cfg = pidController->getPIDConfig(i);
+      pidConfig.add(cfg.type);
+      pidConfig.add(cfg.kp);
+      pidConfig.add(cfg.ki);
+      pidConfig.add(cfg.kd);
+      pidConfig.add(cfg.setpoint);
+      pidConfig.add(cfg.sensorIndex);
+      pidConfig.add(cfg.enabled ? 1 : 0);
+      pidConfig.add(cfg.manualOutput);
+    }
+    JsonArray alarmConfigs = config.createNestedArray("a");
+    for (int i = 0; i < NUM_PIDS; i++) {
+      JsonArray alarmConfig = alarmConfigs.createNestedArray();
+      const AlarmConfig& cfg = alarmSystem->getAlarmConfig(i);
+      alarmConfig.add(cfg.warningLow);
+      alarmConfig.add(cfg.warningHigh);
+      alarmConfig.add(cfg.alarmLow);
+      alarmConfig.add(cfg.alarmHigh);
+      alarmConfig.add(cfg.resetMode);
+      alarmConfig.add(cfg.enabled ? 1 : 0);
+    }
+    return;
+  }
+  
   JsonObject config = doc.createNestedObject("config");
   
   JsonArray pidConfigs = config.createNestedArray("pids");
@@ -243,8 +423,38 @@ void JSONHandler::addConfigData(JsonDocument& doc) {
 }
 
 void JSONHandler::sendResponse(const JsonDocument& response) {
-  serializeJson(response, Serial);
-  Serial.println();
+  serializeJson(response, *output);
+  output->println();
+}
+
+void JSONHandler::publishStatus() {
+  if (subscribeInterval == 0) return;
+  unsigned long now = millis();
+  if ((unsigned long)(now - lastPublish) < subscribeInterval) return;
+  lastPublish = now;
+  
+  StaticJsonDocument<JSON_BUFFER_SIZE> frame;
+  frame["command"] = "status";
+  frame["timestamp"] = now;
+  if (compactFormat) {
+    frame["f"] = COMPACT_FORMAT_VERSION;
+  }
+  frame["status"] = "ok";
+  
+  // A full frame every SUBSCRIBE_KEEPALIVE lets the host resync and tells
+  // it the link is alive while nothing changes
+  bool changesOnly = subscribeChangesOnly &&
+                     (unsigned long)(now - lastFullPublish) < SUBSCRIBE_KEEPALIVE;
+  if (changesOnly) {
+    frame["delta"] = true;
+  } else {
+    lastFullPublish = now;
+  }
+  int sent = addSensorData(frame, changesOnly);
+  sent += addPIDData(frame, changesOnly);
+  sent += addAlarmData(frame, changesOnly);
+  if (changesOnly && sent == 0) return;
+  sendResponse(frame);
 }
 
 void JSONHandler::handleToggleEnable(const JsonDocument& request, JsonDocument& response) {
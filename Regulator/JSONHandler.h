@@ -14,24 +14,44 @@ private:
   SensorManager* sensorManager;
   PIDController* pidController;
   ButtonManager* buttonManager;
+  // The serial port, read while replies are written
+  Print* output;
   
-  void handleGetStatus(JsonDocument& response);
+  // Send status records as value arrays instead of keyed objects
+  bool compactFormat;
+  
+  // Status streaming set up with the subscribe command; interval 0 = off
+  unsigned long subscribeInterval;
+  bool subscribeChangesOnly;
+  unsigned long lastPublish;
+  unsigned long lastFullPublish;
+  
+  // Last values sent to the host, so changesOnly frames can leave out the rest
+  SensorReading sentSensors[TOTAL_SENSORS];
+  PIDStatus sentPIDs[NUM_PIDS];
+  AlarmState sentAlarms[NUM_PIDS];
+  
+  void handleGetStatus(const JsonDocument& request, JsonDocument& response);
   void handleSetConfig(const JsonDocument& request, JsonDocument& response);
   void handleAckAlarm(const JsonDocument& request, JsonDocument& response);
   void handleSetSimulation(const JsonDocument& request, JsonDocument& response);
   void handleToggleEnable(const JsonDocument& request, JsonDocument& response);
   void handleAutotune(const JsonDocument& request, JsonDocument& response);
   void handleSetState(const JsonDocument& request, JsonDocument& response);
+  void handleSetFormat(const JsonDocument& request, JsonDocument& response);
+  void handleSubscribe(const JsonDocument& request, JsonDocument& response);
   
-  void addSensorData(JsonDocument& doc);
-  void addPIDData(JsonDocument& doc);
-  void addAlarmData(JsonDocument& doc);
+  int addSensorData(JsonDocument& doc, bool changesOnly = false);
+  int addPIDData(JsonDocument& doc, bool changesOnly = false);
+  int addAlarmData(JsonDocument& doc, bool changesOnly = false);
   void addConfigData(JsonDocument& doc);
 
 public:
-  JSONHandler(AlarmSystem* alarm, SensorManager* sensor, PIDController* pid, ButtonManager* button);
+  JSONHandler(AlarmSystem* alarm, SensorManager* sensor, PIDController* pid, ButtonManager* button,
+              Print* out);
   void processCommand(const String& command);
   void sendResponse(const JsonDocument& response);
+  void publishStatus();
 };
 
 #endif
\ No newline at end of file
@@ -0,0 +1,65 @@
+#include "SerialInput.h"
+
+void SerialInput::poll() {
+  while (Serial.available()) {
+    if (length == JSON_BUFFER_SIZE) {
+      bool complete = false;
+      for (int i = 0; i < length; i++) {
+        if (buffer[i] == '\n' || buffer[i] == '\r') {
+          complete = true;
+          break;
+        }
+      }
+      if (complete) {
+        // Full of whole commands; the rest waits in the receive buffer
+        return;
+      }
+      // One line longer than the buffer - drop it up to the next newline
+      length = 0;
+      discarding = true;
+      overflowed = true;
+    }
+    char c = Serial.read();
+    if (discarding) {
+      discarding = c != '\n' && c != '\r';
+      continue;
+    }
+    buffer[length++] = c;
+  }
+}
+
+bool SerialInput::readLine(String& line) {
+  poll();
+  int start = 0;
+  while (start < length && (buffer[start] == '\n' || buffer[start] == '\r')) {
+    start++;
+  }
+  int end = start;
+  while (end < length && buffer[end] != '\n' && buffer[end] != '\r') {
+    end++;
+  }
+  if (end == length) {
+    // No complete line yet; keep what has arrived of it
+    memmove(buffer, buffer + start, length - start);
+    length -= start;
+    return false;
+  }
+  buffer[end] = '\0';
+  line = buffer + start;
+  memmove(buffer, buffer + end + 1, length - end - 1);
+  length -= end + 1;
+  return true;
+}
+
+bool SerialInput::takeOverflow() {
+  bool result = overflowed;
+  overflowed = false;
+  return result;
+}
+
+size_t SerialInput::write(uint8_t c) {
+  while (Serial.availableForWrite() == 0) {
+    poll();
+  }
+  return Serial.write(c);
+}
@@ -0,0 +1,28 @@
+#ifndef SERIAL_INPUT_H
+#define SERIAL_INPUT_H
+
+#include "config.h"
+#include <Arduino.h>
+
+// Serial port with its input buffered in RAM. Replies are written through
+// it, and while the transmit buffer is full it keeps moving received bytes
+// into the input buffer, so commands sent while a ~2 KB reply goes out
+// are not lost in the 64 byte hardware receive buffer.
+class SerialInput : public Print {
+private:
+  char buffer[JSON_BUFFER_SIZE];
+  int length = 0;
+  // Dropping the rest of a line that did not fit
+  bool discarding = false;
+  bool overflowed = false;
+
+public:
+  void poll();
+  bool readLine(String& line);
+  // True once after a line longer than the buffer was dropped
+  bool takeOverflow();
+  size_t write(uint8_t c) override;
+  using Print::write;
+};
+
+#endif
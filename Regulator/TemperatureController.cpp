@@ -3,7 +3,7 @@
 #include <Arduino.h>
 
 TemperatureController::TemperatureController() 
-  : jsonHandler(&alarmSystem, &sensorManager, &pidController, &buttonManager) {
+  : jsonHandler(&alarmSystem, &sensorManager, &pidController, &buttonManager, &serialInput) {
 }
 
 void TemperatureController::begin() {
@@ -39,6 +39,8 @@ void TemperatureController::update() {
     updateSystem();
     lastUpdate = now;
   }
+  
+  jsonHandler.publishStatus();
 }
 
 void TemperatureController::updateSystem() {
@@ -80,32 +82,18 @@ void TemperatureController::updateSystem() {
 }
 
 void TemperatureController::processSerialInput() {
-  static char buffer[JSON_BUFFER_SIZE];
-  static int bufferIndex = 0;
+  // Commands that arrived while the previous reply was written are
+  // already waiting in serialInput
+  String line;
+  while (serialInput.readLine(line)) {
+    jsonHandler.processCommand(line);
+  }
   
-  while (Serial.available()) {
-    char c = Serial.read();
-    if (c == '\n' || c == '\r') {
-      if (bufferIndex > 0) {
-        buffer[bufferIndex] = '\0';
-        jsonHandler.processCommand(String(buffer));
-        bufferIndex = 0;
-      }
-    } else {
-      if (bufferIndex < JSON_BUFFER_SIZE - 1) {
-        buffer[bufferIndex++] = c;
-      } else {
-        // Buffer overflow - consume remaining characters until newline
-        StaticJsonDocument<256> errorResponse;
-        errorResponse["error"] = "Command too long";
-        errorResponse["errorCode"] = ERROR_COMMUNICATION;
-        serializeJson(errorResponse, Serial);
-        Serial.println();
-        bufferIndex = 0;
-        
-        // Consume remaining characters until newline
-        while (Serial.available() && Serial.read() != '\n');
-      }
-    }
+  if (serialInput.takeOverflow()) {
+    // The line was dropped up to its newline
+    StaticJsonDocument<256> errorResponse;
+    errorResponse["error"] = "Command too long";
+    errorResponse["errorCode"] = ERROR_COMMUNICATION;
+    jsonHandler.sendResponse(errorResponse);
   }
 }
\ No newline at end of file
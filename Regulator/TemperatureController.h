@@ -7,6 +7,7 @@
 #include "PIDController.h"
 #include "JSONHandler.h"
 #include "ButtonManager.h"
+#include "SerialInput.h"
 
 class TemperatureController {
 private:
@@ -14,6 +15,8 @@ private:
   SensorManager sensorManager;
   PIDController pidController;
   ButtonManager buttonManager;
+  // Before jsonHandler, which writes through it
+  SerialInput serialInput;
   JSONHandler jsonHandler;
   
   unsigned long lastUpdate = 0;
@@ -35,6 +35,9 @@
 #define UPDATE_INTERVAL 1000
 #define SENSOR_TIMEOUT 5000
 #define JSON_BUFFER_SIZE 2048
+#define COMPACT_FORMAT_VERSION 1
+#define SUBSCRIBE_MIN_INTERVAL 100
+#define SUBSCRIBE_KEEPALIVE 5000
 #define INVALID_SENSOR_VALUE -999.0
 
 #define NUM_PIDS 3
@@ -0,0 +1,550 @@
+"""Headless data acquisition for the BrewControl regulator.
+
+Everything needed to talk to the regulator without a GUI: the link, the
+command queue, adaptive status polling, the indexed status model, alarm
+tracking with early warnings, and the on-disk recorder. Run it directly
+to log a controller from a machine without a display:
+
+    python acquisition.py --port /dev/ttyACM0
+
+The PyQt GUI attaches to an AcquisitionCore as one subscriber among others.
+"""
+import argparse
+import os
+import threading
+import time
+from collections import namedtuple
+
+import serial
+
+from command_queue import CommandQueue, CommandTimeout
+from metrics import Metrics, export as export_metrics
+from poll_scheduler import PollScheduler
+from predictive_alarms import LIMIT_NAMES, PredictiveAlarms
+from recorder import StatusRecorder
+from sensor_health import ISSUE_NAMES, SensorHealth
+from serial_protocol import FrameParser
+from status_model import StatusSnapshot, merge_status
+
+# Default layout of the regulator; frames reporting more are handled too
+NUM_THERMOSTATS = 3
+NUM_SENSORS = 7
+
+# Full resolution history of every status frame
+HISTORY_DIR = os.path.join(os.path.expanduser('~'), 'BrewControl', 'historik')
+
+# Shortest poll interval once the compact status encoding is in use. A
+# compact frame takes ~35 ms on the wire at 115200 baud against ~190 ms for
+# the JSON one
+COMPACT_MIN_INTERVAL = 0.2
+
+# While subscribed, keepalive periods without any frame before the session
+# gives up on the stream and goes back to polling
+STREAM_WATCHDOG = 2.5
+
+# How often --metrics rewrites its file, in seconds
+METRICS_INTERVAL = 10.0
+
+# Name of an AcquisitionCore's link among a ControllerManager's controllers
+PRIMARY_NAME = "Primær"
+
+# Events passed to subscribers as callback(event, data)
+EVENT_CONNECTED = 'connected'        # data: port name
+EVENT_DISCONNECTED = 'disconnected'  # data: reason, or None on a normal close
+EVENT_FRAME = 'frame'                # data: frame dict
+EVENT_LATENCY = 'latency'            # data: receive latency of the frame in seconds
+EVENT_COMMAND = 'command'            # data: finished PendingCommand
+EVENT_ALARM = 'alarm'                # data: AlarmChange
+EVENT_PREDICTION = 'prediction'      # data: predictive_alarms.Prediction raised or cleared
+EVENT_SENSOR_HEALTH = 'sensor_health'  # data: sensor_health.HealthChange raised or cleared
+
+AlarmChange = namedtuple('AlarmChange', ['regulator_id', 'level', 'previous', 'alarm'])
+
+
+class ControllerSession:
+    """Protocol state for one regulator link, without any I/O of its own.
+
+    The owner feeds received bytes to feed(), calls poll() whenever the
+    deadline it returned has passed, and provides a write callable for the
+    command queue. Frames, finished commands, alarm changes, predicted
+    alarms (see predictive_alarms) and sensor issues (see sensor_health) are
+    reported through emit(event, data).
+
+    With compact set, the session asks the firmware for the compact status
+    encoding when the link starts and polls faster once it is accepted.
+    Firmware without it answers "Unknown command" and stays on JSON.
+
+    With a stream_interval (seconds) the session also subscribes to status
+    frames pushed by the firmware, sending only what changed, and stops
+    polling while they keep coming. If the stream goes quiet it falls back
+    to polling and subscribes again. Subscribers always get the complete,
+    merged status.
+
+    Traffic, parse and dispatch times, command round trips and losses are
+    recorded in metrics (a metrics.Metrics).
+    """
+
+    def __init__(self, write, emit, first_poll=1.0, compact=True, stream_interval=1.0,
+                 clock=time.monotonic, metrics=None):
+        self.write = write
+        self.emit = emit
+        self.first_poll = first_poll
+        self.compact = compact
+        self.format = 'json'
+        self.stream_interval = stream_interval
+        self.streaming = False
+        self.stream_timeout = None
+        self.clock = clock
+        self.parser = FrameParser()
+        self.metrics = Metrics() if metrics is None else metrics
+        self.commands = CommandQueue(self._write, clock=clock)
+        self.scheduler = PollScheduler()
+        self.frame = {}
+        self.snapshot = StatusSnapshot({})
+        self.predictions = PredictiveAlarms()
+        self.sensor_health = SensorHealth()
+        self.alarm_levels = {}
+        self.active = False
+        self.next_poll = None
+        self.frame_start = None
+        self.last_latency = 0.0
+        self.unreported_bytes = 0
+
+    def start(self):
+        self.parser.reset()
+        self.scheduler = PollScheduler()
+        self.format = 'json'
+        self.streaming = False
+        self.frame = {}
+        self.active = True
+        self.next_poll = self.clock() + self.first_poll
+        # The rates and statistics of a previous connection say nothing
+        # about this one, and its alarms are reported afresh
+        self.alarm_levels = {}
+        for prediction in self.predictions.reset():
+            self.emit(EVENT_PREDICTION, prediction)
+        for change in self.sensor_health.reset():
+            self.emit(EVENT_SENSOR_HEALTH, change)
+        # Both are submitted directly so a refusal from older firmware is not
+        # reported to subscribers as a failed command
+        if self.compact:
+            self.commands.submit({"command": "setFormat", "format": "compact"}, callback=self._format_done)
+        if self.stream_interval:
+            self._subscribe()
+
+    def stop(self, reason=None):
+        self.active = False
+        self.streaming = False
+        self.next_poll = None
+        self.frame_start = None
+        self.commands.cancel_all(reason or "Forbindelse lukket")
+
+    def send(self, command, callback=None, timeout=None, retries=None, priority=False):
+        """Queue a command; returns a PendingCommand for the reply"""
+        pending = self.commands.submit(command, timeout=timeout, retries=retries, callback=callback,
+                                       priority=priority)
+        pending.add_done_callback(self._command_done)
+        return pending
+
+    def feed(self, data):
+        """Handle received bytes"""
+        now = self.clock()
+        if self.frame_start is None:
+            self.frame_start = now
+        metrics = self.metrics
+        parser = self.parser
+        dropped, discarded = parser.frames_dropped, parser.discarded_bytes
+        # Reads are often much smaller than a frame, so received bytes are
+        # reported once a frame is complete or the data has been discarded
+        self.unreported_bytes += len(data)
+
+        started = time.perf_counter()
+        frames = parser.feed(data)
+        if frames:
+            # Per frame, as one read may complete several
+            metrics.observe('parse_seconds', (time.perf_counter() - started) / len(frames))
+        if frames or not parser.pending:
+            metrics.mark('received_bytes', self.unreported_bytes)
+            self.unreported_bytes = 0
+        if parser.frames_dropped != dropped:
+            metrics.count('dropped_frames', parser.frames_dropped - dropped)
+        if parser.discarded_bytes != discarded:
+            metrics.count('discarded_bytes', parser.discarded_bytes - discarded)
+
+        # Drain every frame completed by this chunk in one pass
+        for frame in frames:
+            started = time.perf_counter()
+            self.handle_frame(frame)
+            # Includes subscribers running in this thread, e.g. the recorder
+            metrics.observe('dispatch_seconds', time.perf_counter() - started)
+            metrics.mark('frames')
+            # Receive latency: first byte of the frame until dispatch
+            self.last_latency = self.clock() - self.frame_start
+            metrics.observe('receive_latency_seconds', self.last_latency)
+            self.emit(EVENT_LATENCY, self.last_latency)
+            self.frame_start = now
+
+        if not self.parser.pending:
+            self.frame_start = None
+
+    def handle_frame(self, frame):
+        self.commands.handle_frame(frame)
+
+        # Every reply carries the full status, so any frame restarts the
+        # poll timer with an interval that follows how fast things change.
+        # While streaming the timer is the watchdog for the stream instead
+        if self.streaming:
+            self.next_poll = self.clock() + self.stream_timeout
+        elif self.active:
+            interval = self.scheduler.observe(frame, self.clock())
+            self.next_poll = self.clock() + interval
+
+        if 'thermostats' in frame or 'sensors' in frame:
+            frame = self.frame = merge_status(self.frame, frame)
+            self.snapshot = StatusSnapshot(frame)
+            self._track_alarms()
+            # The regulator's clock, so link delays do not distort the rates
+            now = frame['timestamp'] / 1000 if 'timestamp' in frame else self.clock()
+            for prediction in self.predictions.update(self.snapshot, now):
+                self.emit(EVENT_PREDICTION, prediction)
+            for change in self.sensor_health.update(self.snapshot, now):
+                self.emit(EVENT_SENSOR_HEALTH, change)
+        self.emit(EVENT_FRAME, frame)
+
+    def poll(self):
+        """Expire commands and send a getStatus when one is due.
+
+        Returns the monotonic time by which poll() should be called again,
+        or None when nothing is scheduled.
+        """
+        if self.next_poll is not None and self.clock() >= self.next_poll:
+            # At most one getStatus in flight; its reply re-arms the timer
+            self.next_poll = None
+            if self.streaming:
+                # The stream went quiet, e.g. the firmware was reset. Poll
+                # until a new subscription is accepted
+                self.streaming = False
+                self.metrics.count('stream_timeouts')
+                self._subscribe()
+            if not self.commands.has_pending("getStatus"):
+                self.send({"command": "getStatus"})
+        deadline = self.commands.poll()
+        if self.next_poll is not None:
+            deadline = self.next_poll if deadline is None else min(deadline, self.next_poll)
+        return deadline
+
+    def _write(self, payload):
+        self.write(payload)
+        self.metrics.mark('sent_bytes', len(payload))
+
+    def _format_done(self, pending):
+        if pending.error is None and pending.response.get('format') == 'compact':
+            self.format = 'compact'
+            self.scheduler.min_interval = COMPACT_MIN_INTERVAL
+
+    def _subscribe(self):
+        interval = int(self.stream_interval * 1000)
+        self.commands.submit({"command": "subscribe", "interval": interval, "changesOnly": True},
+                             callback=self._subscribe_done)
+
+    def _subscribe_done(self, pending):
+        if pending.error is not None or not self.active:
+            return
+        response = pending.response
+        if response.get('status') != 'subscribed':
+            return
+        # Frames come at least every keepalive period, even when nothing
+        # changes; firmware without keepalives sends every interval
+        period = max(response.get('interval', 0), response.get('keepalive', 0)) / 1000
+        self.stream_timeout = STREAM_WATCHDOG * (period or self.stream_interval)
+        self.streaming = True
+
+    def _command_done(self, pending):
+        if pending.error is None:
+            self.metrics.observe('command_round_trip_seconds', pending.round_trip)
+        elif self.active:
+            # Commands cancelled by a disconnect are not the link's fault
+            self.metrics.count('command_timeouts' if isinstance(pending.error, CommandTimeout)
+                               else 'command_errors')
+        if pending.attempts > 1:
+            self.metrics.count('command_retries', pending.attempts - 1)
+        if pending.error is not None and pending.name == "getStatus" and self.active:
+            # No frame will re-arm the poll timer for this one
+            if self.next_poll is None:
+                self.next_poll = self.clock() + self.scheduler.interval
+        self.emit(EVENT_COMMAND, pending)
+
+    def _track_alarms(self):
+        for regulator_id, alarm in self.snapshot.alarms.items():
+            level = alarm.get('level', 0)
+            previous = self.alarm_levels.get(regulator_id, 0)
+            if level != previous:
+                self.alarm_levels[regulator_id] = level
+                self.emit(EVENT_ALARM, AlarmChange(regulator_id, level, previous, alarm))
+
+
+class SerialWorker(threading.Thread):
+    """Reads the serial port and drives a ControllerSession"""
+
+    def __init__(self, session, port, baudrate=115200, read_timeout=1.0):
+        super().__init__(daemon=True)
+        self.session = session
+        self.port = port
+        self.baudrate = baudrate
+        # Upper bound on how long a blocking read may sleep before the loop
+        # re-checks self.running; data wakes the reader immediately
+        self.read_timeout = read_timeout
+        self.serial_conn = None
+        self.running = False
+
+    def run(self):
+        reason = None
+        try:
+            # Also takes URLs such as socket://host:port, e.g. for simulator.py
+            self.serial_conn = serial.serial_for_url(self.port, self.baudrate, timeout=self.read_timeout)
+            self.running = True
+            self.session.start()
+            self.session.emit(EVENT_CONNECTED, self.port)
+
+            while self.running:
+                # Wake up in time for the next poll or command timeout
+                deadline = self.session.poll()
+                timeout = self.read_timeout
+                if deadline is not None:
+                    timeout = min(timeout, max(deadline - time.monotonic(), 0.01))
+                if self.serial_conn.timeout != timeout:
+                    self.serial_conn.timeout = timeout
+
+                # Block until at least one byte arrives, then take everything
+                # the driver has already buffered in the same call
+                chunk = self.serial_conn.read(self.serial_conn.in_waiting or 1)
+                if chunk:
+                    self.session.feed(chunk)
+        except Exception as e:
+            if self.running or self.serial_conn is None:
+                reason = str(e)
+                print(f"Serial error: {e}")
+        finally:
+            self.running = False
+            self.session.stop(reason)
+            if self.serial_conn:
+                self.serial_conn.close()
+            self.session.emit(EVENT_DISCONNECTED, reason)
+
+    def write(self, payload):
+        if not (self.running and self.serial_conn and self.serial_conn.is_open):
+            raise serial.SerialException("Port not open")
+        self.serial_conn.write(payload)
+
+    def stop(self):
+        self.running = False
+        # Wake the reader out of its blocking read; it closes the port itself
+        if self.serial_conn and hasattr(self.serial_conn, 'cancel_read'):
+            self.serial_conn.cancel_read()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+
+class AcquisitionCore:
+    """Connection, protocol state and recording for one regulator.
+
+    Subscribers are called as callback(event, data) from the serial thread
+    and must hand work over to their own thread if they need to; see the
+    EVENT_* constants for what they receive. Subscribers can come and go
+    while the link stays up and the recorder keeps writing.
+
+    With a ControllerManager the link runs on the manager's event loop, as
+    its controller called name, instead of on a SerialWorker thread, and
+    the manager's subscribers get its events too. Subscribers are then
+    called from the loop thread.
+
+    link_id counts the links opened by connect(). A link's events are all
+    delivered before the next link gets a new link_id, so a subscriber that
+    hands events to another thread can tag them with it and drop those of a
+    link that has since been replaced.
+    """
+
+    def __init__(self, recorder=None, manager=None, name=PRIMARY_NAME):
+        self.recorder = recorder
+        self.manager = manager
+        self.name = name
+        self.subscribers = []
+        self.subscriber_lock = threading.Lock()
+        self.worker = None
+        self.link = None
+        self.link_id = 0
+        self.session = ControllerSession(self._write, self._dispatch)
+        if recorder is not None and not recorder.is_alive():
+            recorder.start()
+
+    @property
+    def connected(self):
+        if self.link is not None:
+            return self.link.connected
+        return self.worker is not None and self.worker.running
+
+    @property
+    def port(self):
+        """Port of the current link, or None"""
+        if self.link is not None:
+            return self.link.port
+        return self.worker.port if self.worker is not None else None
+
+    @property
+    def frame(self):
+        """Latest status frame"""
+        return self.session.frame
+
+    @property
+    def snapshot(self):
+        return self.session.snapshot
+
+    @property
+    def metrics(self):
+        return self.session.metrics
+
+    @property
+    def predictions(self):
+        return self.session.predictions
+
+    @property
+    def sensor_health(self):
+        return self.session.sensor_health
+
+    def subscribe(self, callback):
+        with self.subscriber_lock:
+            self.subscribers = self.subscribers + [callback]
+
+    def unsubscribe(self, callback):
+        with self.subscriber_lock:
+            self.subscribers = [s for s in self.subscribers if s != callback]
+
+    def connect(self, port, baudrate=115200):
+        """Open the link. With a manager, raises ValueError for a port
+        another of its controllers uses"""
+        # Waits for the old link to close and report it
+        self.disconnect()
+        self.link_id += 1
+        if self.manager is not None:
+            self.link = self.manager.add(self.name, port, baudrate, session=self.session)
+        else:
+            self.worker = SerialWorker(self.session, port, baudrate)
+            self.worker.start()
+
+    def disconnect(self):
+        link, self.link = self.link, None
+        if link is not None:
+            self.manager.remove(link.name)
+        worker, self.worker = self.worker, None
+        if worker:
+            worker.stop()
+
+    def send(self, command, callback=None, timeout=None, retries=None, priority=False):
+        """Queue a command; returns a PendingCommand, or None when not connected.
+        A priority command goes ahead of everything else queued."""
+        if not self.connected:
+            return None
+        link = self.link
+        if link is not None:
+            # Handed over to the manager's loop, which owns the session
+            return link.send(command, callback=callback, timeout=timeout, retries=retries,
+                             priority=priority)
+        return self.session.send(command, callback=callback, timeout=timeout, retries=retries,
+                                 priority=priority)
+
+    def close(self):
+        self.disconnect()
+        if self.recorder is not None:
+            self.recorder.stop()
+
+    def _write(self, payload):
+        transport = self.link or self.worker
+        if transport is None:
+            raise serial.SerialException("Port not open")
+        transport.write(payload)
+
+    def _dispatch(self, event, data):
+        if event == EVENT_FRAME and self.recorder is not None:
+            self.recorder.record(data)
+        for callback in self.subscribers:
+            try:
+                callback(event, data)
+            except Exception as e:
+                print(f"Subscriber error: {e}")
+        if self.manager is not None:
+            self.manager.dispatch(self.name, event, data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Log a BrewControl regulator without the GUI")
+    parser.add_argument('--port', default='COM3', help="serial port (default: COM3)")
+    parser.add_argument('--baudrate', type=int, default=115200)
+    parser.add_argument('--history-dir', default=HISTORY_DIR,
+                        help="directory for the recorded history")
+    parser.add_argument('--no-record', action='store_true', help="do not record frames to disk")
+    parser.add_argument('--serve', type=int, metavar='PORT', nargs='?', const=8765,
+                        help="republish status to local TCP/WebSocket clients (default port 8765)")
+    parser.add_argument('--serve-host', default='127.0.0.1',
+                        help="interface for --serve (default: 127.0.0.1)")
+    parser.add_argument('--allow-commands', action='store_true',
+                        help="let --serve clients send commands to the regulator (read-only otherwise)")
+    parser.add_argument('--allow-origin', action='append', default=[], metavar='ORIGIN',
+                        help="web page origin allowed to connect over WebSocket, e.g. "
+                             "http://localhost:8000; may be repeated")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="keep link metrics in FILE, as JSON if it ends in .json and in "
+                             "the Prometheus text format otherwise")
+    args = parser.parse_args(argv)
+
+    recorder = None
+    if not args.no_record:
+        recorder = StatusRecorder(args.history_dir, NUM_SENSORS, NUM_THERMOSTATS)
+    core = AcquisitionCore(recorder)
+    closed = threading.Event()
+
+    def report(event, data):
+        timestamp = time.strftime("%H:%M:%S")
+        if event == EVENT_CONNECTED:
+            print(f"[{timestamp}] Tilsluttet {data}")
+        elif event == EVENT_DISCONNECTED:
+            print(f"[{timestamp}] Forbindelse lukket" + (f": {data}" if data else ""))
+            closed.set()
+        elif event == EVENT_ALARM:
+            print(f"[{timestamp}] Alarm {data.regulator_id + 1}: niveau {data.previous} -> {data.level}")
+        elif event == EVENT_PREDICTION and data.active:
+            print(f"[{timestamp}] Alarm {data.regulator_id + 1}: {LIMIT_NAMES[data.limit]} "
+                  f"{data.threshold:g}°C nås om {data.eta / 60:.0f} min ({data.rate * 60:+.2f}°C/min)")
+        elif event == EVENT_PREDICTION:
+            print(f"[{timestamp}] Alarm {data.regulator_id + 1}: {LIMIT_NAMES[data.limit]} forventes ikke længere")
+        elif event == EVENT_SENSOR_HEALTH:
+            state = "" if data.active else " ikke længere"
+            print(f"[{timestamp}] Sensor {data.sensor_id + 1}: {ISSUE_NAMES[data.issue]}{state}")
+        elif event == EVENT_COMMAND and data.error is not None:
+            print(f"[{timestamp}] Kommando {data.describe()} fejlede: {data.error}")
+
+    core.subscribe(report)
+    server = None
+    if args.serve:
+        # Imported here as the server module itself builds on this one
+        from status_server import StatusServer
+        server = StatusServer(core, args.serve_host, args.serve, args.allow_commands, args.allow_origin)
+        server.start()
+    # Tells the loggers of several regulators apart in one collector
+    labels = {'port': args.port}
+    core.connect(args.port, args.baudrate)
+    try:
+        while not closed.wait(METRICS_INTERVAL if args.metrics else 1.0):
+            if args.metrics:
+                export_metrics(core.metrics, args.metrics, labels)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server:
+            server.stop()
+        core.close()
+        if args.metrics:
+            export_metrics(core.metrics, args.metrics, labels)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,539 @@
+"""PID auto-tuning from a step or relay test on the real kettle.
+
+AutoTuner runs the test with the regulator's own commands: it switches the
+thermostat to the Manual type with setConfig, moves manualOutput, records
+temperature and output from the status frames, and puts the previous
+configuration back afterwards. Like ControllerSession it does no I/O of its
+own; the owner passes a send callable and feeds it every status frame.
+
+The recording is fitted to a first order plus dead time (FOPDT) model,
+
+    temperature = offset + gain * output delayed by dead_time, lagged by tau
+
+by least squares over a grid of time constants and dead times, all solved
+at once with numpy. Any test works as long as the output moves. PID gains
+are then proposed with one of TUNING_RULES. Gains are in the firmware's
+units: output 0-255, ki per second and kd in seconds, as PID_v1 takes them.
+
+    python autotune.py --port socket://localhost:7000 --regulator 1 --step-output 200
+"""
+import argparse
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from status_model import StatusSnapshot
+
+CONTROLLER_PID = 0
+CONTROLLER_MANUAL = 2
+STATE_IDLE = 0
+STATE_RUN = 1
+
+METHOD_STEP = 'step'
+METHOD_RELAY = 'relay'
+
+PHASE_IDLE = 'idle'
+PHASE_PREPARE = 'prepare'    # reading the configuration to restore later
+PHASE_BASELINE = 'baseline'  # holding the base output
+PHASE_STEP = 'step'          # holding the step output
+PHASE_RELAY = 'relay'        # switching around the setpoint
+PHASE_DONE = 'done'
+PHASE_FAILED = 'failed'
+
+# Resampled points the fit works on; longer tests are averaged into bins
+MAX_FIT_POINTS = 300
+MIN_FIT_POINTS = 20
+# Time constants tried per pass of the grid search
+TAU_GRID = 60
+
+# How long the regulator may take to report Manual mode and the new
+# output, in seconds on the host
+CONFIRM_TIMEOUT = 15.0
+# A step is over when the temperature has moved less than STEADY_SLOPE
+# (degrees per second) over the last STEADY_WINDOW seconds
+STEADY_WINDOW = 300.0
+STEADY_SLOPE = 0.05 / 60
+# A test is stopped at this temperature unless told otherwise, so the
+# heater cannot boil a kettle dry while nobody watches
+MAX_TEMPERATURE = 95.0
+
+TUNING_RULES = ('simc', 'amigo', 'cohen-coon')
+
+FopdtModel = namedtuple('FopdtModel', ['gain', 'tau', 'dead_time', 'offset', 'rms', 'r2', 'sample_time'])
+PidGains = namedtuple('PidGains', ['kp', 'ki', 'kd'])
+
+
+def _resample(t, temperature, output, dt):
+    """Bin averages of both signals on a uniform grid of dt seconds"""
+    bins = ((t - t[0]) / dt).astype(int)
+    n = bins[-1] + 1
+    counts = np.bincount(bins, minlength=n)
+    y = np.bincount(bins, weights=temperature, minlength=n)
+    u = np.bincount(bins, weights=output, minlength=n)
+    filled = counts > 0
+    y[filled] /= counts[filled]
+    u[filled] /= counts[filled]
+    grid = np.arange(n)
+    # Empty bins: temperatures are interpolated, the output holds its value
+    y = np.interp(grid, grid[filled], y[filled])
+    u = u[np.maximum.accumulate(np.where(filled, grid, 0))]
+    return y, u
+
+
+def _fit_grid(y, u, dt, taus, delays):
+    """Best (sse, tau, delay, offset, gain) over every combination of taus
+    and delays. For each pair the model is linear in offset, gain and the
+    decay of the initial state, so those come from least squares; the
+    normal equations of all pairs are built and solved in one go."""
+    n = len(y)
+    a = np.exp(-dt / taus)
+
+    # Unit gain first order response to the output for every tau, starting
+    # in steady state at the first output
+    x = np.empty((len(taus), n))
+    state = np.full(len(taus), u[0])
+    for k in range(n):
+        x[:, k] = state
+        state = a * state + (1 - a) * u[k]
+
+    # Every dead time is a shift: xs[g, d, k] = x[g, k - d]
+    shift = delays[-1]
+    padded = np.concatenate([np.repeat(x[:, :1], shift, axis=1), x], axis=1)
+    xs = padded[:, np.arange(n)[None, :] - delays[:, None] + shift]
+    decay = a[:, None] ** np.arange(n)[None, :]
+
+    # y = offset + gain * xs + c * decay
+    shape = xs.shape[:2]
+    S = np.empty(shape + (3, 3))
+    S[..., 0, 0] = n
+    S[..., 0, 1] = S[..., 1, 0] = xs.sum(axis=2)
+    S[..., 0, 2] = S[..., 2, 0] = decay.sum(axis=1)[:, None]
+    S[..., 1, 1] = np.einsum('gdk,gdk->gd', xs, xs)
+    S[..., 1, 2] = S[..., 2, 1] = np.einsum('gdk,gk->gd', xs, decay)
+    S[..., 2, 2] = np.einsum('gk,gk->g', decay, decay)[:, None]
+    r = np.empty(shape + (3,))
+    r[..., 0] = y.sum()
+    r[..., 1] = xs @ y
+    r[..., 2] = (decay @ y)[:, None]
+    # For long time constants the decay is almost constant and the system
+    # nearly singular; a tiny ridge keeps the solve well defined
+    S += np.eye(3) * (1e-9 * S.diagonal(axis1=-2, axis2=-1)[..., None, :] + 1e-12)
+    coef = np.linalg.solve(S, r[..., None])[..., 0]
+
+    sse = y @ y - np.einsum('gdi,gdi->gd', coef, r)
+    # Heating only ever raises the temperature
+    sse[coef[..., 1] <= 0] = np.inf
+    g, d = np.unravel_index(np.argmin(sse), sse.shape)
+    return sse[g, d], taus[g], delays[d], coef[g, d, 0], coef[g, d, 1]
+
+
+def fit_fopdt(t, temperature, output, max_dead_time=None, max_points=MAX_FIT_POINTS):
+    """Fit an FOPDT model to a recorded test. Times are in seconds, output
+    in the firmware's units. Raises ValueError when the recording is too
+    short or the output never moved."""
+    t = np.asarray(t, dtype=float)
+    temperature = np.asarray(temperature, dtype=float)
+    output = np.asarray(output, dtype=float)
+    if len(t) < MIN_FIT_POINTS:
+        raise ValueError("For få målinger")
+    if np.ptp(output) <= 0:
+        raise ValueError("Outputtet blev ikke ændret under testen")
+    duration = t[-1] - t[0]
+    dt = max(float(np.median(np.diff(t))), duration / max_points)
+    y, u = _resample(t, temperature, output, dt)
+    if len(y) < MIN_FIT_POINTS:
+        raise ValueError("Testen er for kort")
+
+    max_delay = len(y) // 3
+    if max_dead_time is not None:
+        max_delay = min(max_delay, int(max_dead_time / dt))
+    delays = np.arange(max_delay + 1)
+
+    # A coarse pass over everything from one sample to far beyond the test,
+    # then a fine one between the neighbours of the best time constant
+    taus = np.geomspace(dt, 20 * duration, TAU_GRID)
+    sse, tau, delay, offset, gain = _fit_grid(y, u, dt, taus, delays)
+    if not np.isfinite(sse):
+        raise ValueError("Temperaturen reagerede ikke på outputtet")
+    ratio = taus[1] / taus[0]
+    sse, tau, delay, offset, gain = _fit_grid(
+        y, u, dt, np.geomspace(tau / ratio, tau * ratio, TAU_GRID), delays)
+
+    rms = float(np.sqrt(max(sse, 0.0) / len(y)))
+    spread = float(np.sum((y - y.mean()) ** 2))
+    r2 = 1.0 - sse / spread if spread > 0 else 0.0
+    return FopdtModel(float(gain), float(tau), float(delay * dt), float(offset), rms, float(r2), dt)
+
+
+def pid_gains(model, rule='simc', tau_c=None):
+    """PID gains for an FOPDT model in the parallel form PID_v1 uses.
+
+    simc is Skogestad's rule with derivative action (improved SIMC), with
+    the closed loop time constant tau_c defaulting to the dead time for a
+    fast response without overshoot. amigo is Åström and Hägglund's robust
+    rule, cohen-coon the classic, faster but more oscillatory one.
+    """
+    gain, tau = model.gain, model.tau
+    # Sampling alone delays the response by half a sample
+    theta = max(model.dead_time, model.sample_time / 2)
+    if rule == 'simc':
+        tau_c = theta if tau_c is None else tau_c
+        kc = (tau + theta / 3) / (gain * (tau_c + theta))
+        ti = min(tau + theta / 3, 4 * (tau_c + theta))
+        td = theta / 3
+        # From series to parallel form
+        kc, ti, td = kc * (1 + td / ti), ti + td, ti * td / (ti + td)
+    elif rule == 'amigo':
+        kc = (0.2 + 0.45 * tau / theta) / gain
+        ti = theta * (0.4 * theta + 0.8 * tau) / (theta + 0.1 * tau)
+        td = 0.5 * theta * tau / (0.3 * theta + tau)
+    elif rule == 'cohen-coon':
+        kc = tau / (gain * theta) * (4 / 3 + theta / (4 * tau))
+        ti = theta * (32 + 6 * theta / tau) / (13 + 8 * theta / tau)
+        td = 4 * theta / (11 + 2 * theta / tau)
+    else:
+        raise ValueError(f"Unknown tuning rule {rule!r}")
+    return PidGains(kc, kc / ti, kc * td)
+
+
+class AutoTuner:
+    """Runs a step or relay test on one thermostat and fits the result.
+
+    send(command) queues a command and returns something other than None
+    when it could be sent, e.g. AcquisitionCore.send. Feed every status
+    frame (merged, as subscribers get them) to handle_frame() from one
+    thread. phase tells where the test is; once it is PHASE_DONE, model
+    and gains hold the result, and on PHASE_FAILED error says why.
+
+    Step test: hold base_output for baseline seconds, then step_output until
+    the temperature settles, max_duration passes or it reaches
+    max_temperature. Relay test: switch between base_output and
+    step_output whenever the temperature leaves setpoint +- hysteresis,
+    for the given number of cycles. The thermostat is switched on and set
+    running for the test, and everything is put back afterwards, also when
+    the test fails or is aborted. Output switched off from elsewhere during
+    the test, e.g. by an emergency stop, aborts it and stays off.
+
+    The recording and the test's durations use the regulator's clock from
+    the frames' timestamps, so link delays do not distort them; clock is
+    used for firmware that sends none and for command timeouts.
+    """
+
+    def __init__(self, send, regulator_id, method=METHOD_STEP, base_output=0.0, step_output=128.0,
+                 baseline=60.0, setpoint=None, hysteresis=0.5, cycles=3, max_duration=2 * 3600.0,
+                 max_temperature=None, rule='simc', clock=time.monotonic):
+        if method not in (METHOD_STEP, METHOD_RELAY):
+            raise ValueError(f"Unknown method {method!r}")
+        if rule not in TUNING_RULES:
+            raise ValueError(f"Unknown tuning rule {rule!r}")
+        self.send = send
+        self.regulator_id = regulator_id
+        self.method = method
+        self.base_output = base_output
+        self.step_output = step_output
+        self.baseline = baseline
+        self.setpoint = setpoint
+        self.hysteresis = hysteresis
+        self.cycles = cycles
+        self.max_duration = max_duration
+        self.max_temperature = max_temperature
+        self.rule = rule
+        self.clock = clock
+        self.phase = PHASE_IDLE
+        self.error = None
+        self.model = None
+        self.gains = None
+        self.saved = None
+        self.output = None
+        self.samples = []
+        self.now = None
+        self.started = None
+        self.phase_started = None
+        self.confirmed = False
+        self.confirm_deadline = None
+        self.switches = 0
+        self.temperature = None
+
+    @property
+    def running(self):
+        return self.phase not in (PHASE_IDLE, PHASE_DONE, PHASE_FAILED)
+
+    @property
+    def elapsed(self):
+        """Seconds since the test started, on the regulator's clock"""
+        if self.started is None:
+            return 0.0
+        return self.now - self.started
+
+    def start(self):
+        self.samples = []
+        self.error = None
+        self.model = self.gains = None
+        self.started = None
+        self.confirmed = False
+        self.switches = 0
+        self.phase = PHASE_PREPARE
+        # The reply carries the configuration, which is put back at the end
+        self._send({"command": "getStatus", "config": True})
+
+    def abort(self, reason="Afbrudt", disable=False):
+        """Stop the test and put the configuration back; with disable the
+        thermostat is left switched off, whatever it was before"""
+        if self.running:
+            self._fail(reason, disable)
+
+    def finish(self):
+        """End the test now and fit what has been recorded so far"""
+        if self.phase in (PHASE_BASELINE, PHASE_STEP, PHASE_RELAY):
+            self._complete()
+
+    def handle_frame(self, frame):
+        if not self.running:
+            return
+        thermostat = StatusSnapshot(frame).thermostats.get(self.regulator_id)
+        if thermostat is None:
+            return
+        now = frame['timestamp'] / 1000 if 'timestamp' in frame else self.clock()
+        if self.now is not None and now < self.now:
+            self._fail("Regulatoren blev genstartet")
+            return
+        self.now = now
+        if self.phase == PHASE_PREPARE:
+            if 'config' in frame:
+                self._prepare(frame, thermostat)
+            return
+
+        temperature = thermostat.get('currentTemp')
+        output = thermostat.get('output', 0.0)
+        if temperature is None:
+            return
+        self.temperature = temperature
+
+        if self.confirm_deadline is not None:
+            if (thermostat.get('type') == CONTROLLER_MANUAL and thermostat.get('outputActive')
+                    and abs(output - self.output) <= 1):
+                self.confirm_deadline = None
+                self.confirmed = True
+            elif self.clock() >= self.confirm_deadline:
+                if thermostat.get('type') != CONTROLLER_MANUAL:
+                    self._fail("Regulatoren skiftede ikke til manuel styring")
+                elif not thermostat.get('outputActive'):
+                    self._fail("Outputtet er ikke aktivt - er der en alarm?")
+                else:
+                    self._fail("Regulatoren satte ikke det ønskede output")
+                return
+        if not self.confirmed:
+            return
+        if not thermostat.get('outputActive', True) or not thermostat.get('enabled', True):
+            # Switched off by someone else; turning it back on is not ours to do
+            self._fail("Outputtet blev slået fra under testen", disable=True)
+            return
+        self.samples.append((now, temperature, output))
+
+        if self.max_temperature is not None and temperature >= self.max_temperature:
+            if self.method == METHOD_STEP and self.phase == PHASE_STEP:
+                # The response so far is usually enough for the fit
+                self._complete()
+            else:
+                self._fail(f"Temperaturen nåede {temperature:.1f}°C")
+            return
+        if self.elapsed >= self.max_duration:
+            self._complete()
+            return
+
+        if self.phase == PHASE_BASELINE and now - self.phase_started >= self.baseline:
+            self._enter(PHASE_STEP)
+            self._set_output(self.step_output)
+        elif self.phase == PHASE_STEP and self._settled(now):
+            self._complete()
+        elif self.phase == PHASE_RELAY:
+            self._relay(temperature)
+
+    def _prepare(self, frame, thermostat):
+        pids = frame['config'].get('pids') or ()
+        config = dict(pids[self.regulator_id]) if self.regulator_id < len(pids) else {}
+        # Older firmware: restore what the status shows
+        for key in ('type', 'setpoint', 'enabled'):
+            if key not in config and key in thermostat:
+                config[key] = thermostat[key]
+        self.saved = {'config': config, 'active': bool(thermostat.get('outputActive')),
+                      'state': thermostat.get('state', STATE_IDLE)}
+        if self.setpoint is None:
+            self.setpoint = config.get('setpoint', thermostat.get('setpoint', 0.0))
+        self.started = self.now
+
+        if self.method == METHOD_STEP:
+            self._enter(PHASE_BASELINE)
+            output = self.base_output
+        else:
+            self._enter(PHASE_RELAY)
+            temperature = thermostat.get('currentTemp', self.setpoint)
+            output = self.step_output if temperature < self.setpoint else self.base_output
+        self._set_output(output, enable=True)
+        if not self.running:
+            return
+        self._send({"command": "toggleEnable", "regulator_id": self.regulator_id, "enabled": True})
+        self._send({"command": "setState", "regulator_id": self.regulator_id, "state": STATE_RUN})
+
+    def _relay(self, temperature):
+        if self.output == self.step_output and temperature > self.setpoint + self.hysteresis:
+            self._switch(self.base_output)
+        elif self.output == self.base_output and temperature < self.setpoint - self.hysteresis:
+            self._switch(self.step_output)
+
+    def _switch(self, output):
+        self.switches += 1
+        if self.switches > 2 * self.cycles:
+            self._complete()
+        else:
+            self._set_output(output)
+
+    def _settled(self, now):
+        if now - self.phase_started < 2 * STEADY_WINDOW:
+            return False
+        recent = []
+        for t, temperature, _ in reversed(self.samples):
+            if t < now - STEADY_WINDOW:
+                break
+            recent.append((t, temperature))
+        if len(recent) < MIN_FIT_POINTS:
+            return False
+        t, temperature = np.array(recent).T
+        slope = np.polyfit(t - t[0], temperature, 1)[0]
+        return abs(slope) < STEADY_SLOPE
+
+    def _complete(self):
+        self._restore()
+        try:
+            if not self.samples:
+                raise ValueError("Ingen målinger")
+            t, temperature, output = np.array(self.samples).T
+            self.model = fit_fopdt(t, temperature, output)
+            self.gains = pid_gains(self.model, self.rule)
+        except ValueError as e:
+            self.error = str(e)
+            self.phase = PHASE_FAILED
+            return
+        self.phase = PHASE_DONE
+
+    def _fail(self, reason, disable=False):
+        self.error = reason
+        self._restore(disable)
+        self.phase = PHASE_FAILED
+
+    def _restore(self, disable=False):
+        saved, self.saved = self.saved, None
+        if saved is None:
+            return
+        command = {"command": "setConfig", "regulator_id": self.regulator_id}
+        command.update(saved['config'])
+        if disable:
+            command['enabled'] = False
+        commands = [
+            command,
+            {"command": "toggleEnable", "regulator_id": self.regulator_id,
+             "enabled": saved['active'] and not disable},
+            {"command": "setState", "regulator_id": self.regulator_id, "state": saved['state']},
+        ]
+        for command in commands:
+            if self.send(command) is None and self.error is None:
+                self.error = "Kunne ikke gendanne konfigurationen"
+
+    def _set_output(self, output, enable=False):
+        self.output = output
+        command = {"command": "setConfig", "regulator_id": self.regulator_id,
+                   "type": CONTROLLER_MANUAL, "manualOutput": output}
+        if enable:
+            command["enabled"] = True
+        if self._send(command):
+            self.confirm_deadline = self.clock() + CONFIRM_TIMEOUT
+
+    def _send(self, command):
+        if self.send(command) is None:
+            self._fail("Ikke forbundet til enhed")
+            return False
+        return True
+
+    def _enter(self, phase):
+        self.phase = phase
+        self.phase_started = self.now
+
+
+def main(argv=None):
+    from acquisition import AcquisitionCore, EVENT_FRAME, EVENT_DISCONNECTED
+
+    parser = argparse.ArgumentParser(description="Auto-tune one thermostat of a BrewControl regulator")
+    parser.add_argument('--port', default='COM3', help="serial port or URL (default: COM3)")
+    parser.add_argument('--baudrate', type=int, default=115200)
+    parser.add_argument('--regulator', type=int, default=1, help="thermostat number, from 1")
+    parser.add_argument('--method', choices=(METHOD_STEP, METHOD_RELAY), default=METHOD_STEP)
+    parser.add_argument('--base-output', type=float, default=0.0, help="output before the step (0-255)")
+    parser.add_argument('--step-output', type=float, default=128.0, help="output of the step (0-255)")
+    parser.add_argument('--baseline', type=float, default=60.0, help="seconds at the base output")
+    parser.add_argument('--setpoint', type=float, help="relay setpoint (default: the configured one)")
+    parser.add_argument('--hysteresis', type=float, default=0.5)
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--max-duration', type=float, default=120.0, help="minutes")
+    parser.add_argument('--max-temperature', type=float, default=MAX_TEMPERATURE,
+                        help=f"stop the test at this temperature (default: {MAX_TEMPERATURE:g})")
+    parser.add_argument('--rule', choices=TUNING_RULES, default='simc')
+    parser.add_argument('--apply', action='store_true', help="send the proposed gains to the regulator")
+    args = parser.parse_args(argv)
+
+    core = AcquisitionCore()
+    tuner = AutoTuner(core.send, args.regulator - 1, args.method, args.base_output, args.step_output,
+                      args.baseline, args.setpoint, args.hysteresis, args.cycles,
+                      args.max_duration * 60, args.max_temperature, args.rule)
+    frames = []
+
+    def collect(event, data):
+        # The tuner runs in the main thread
+        if event == EVENT_FRAME:
+            frames.append(data)
+        elif event == EVENT_DISCONNECTED and data:
+            frames.append(None)
+
+    core.subscribe(collect)
+    core.connect(args.port, args.baudrate)
+    try:
+        while not core.connected and core.worker.is_alive():
+            time.sleep(0.05)
+        tuner.start()
+        last_report = 0.0
+        while tuner.running:
+            time.sleep(0.1)
+            while frames:
+                frame = frames.pop(0)
+                if frame is None:
+                    tuner.abort("Forbindelsen blev afbrudt")
+                else:
+                    tuner.handle_frame(frame)
+            if tuner.running and time.monotonic() - last_report >= 10 and tuner.temperature is not None:
+                last_report = time.monotonic()
+                print(f"[{time.strftime('%H:%M:%S')}] {tuner.phase}: {tuner.temperature:.2f}°C "
+                      f"output {tuner.output:.0f}, {len(tuner.samples)} målinger")
+    except KeyboardInterrupt:
+        tuner.finish()
+        tuner.abort()
+    try:
+        if tuner.phase == PHASE_FAILED:
+            print(f"Autotune fejlede: {tuner.error}")
+            return 1
+        model, gains = tuner.model, tuner.gains
+        print(f"Model: K={model.gain:.4f}°C pr. output, tau={model.tau:.0f} s, "
+              f"dødtid={model.dead_time:.0f} s, RMS={model.rms:.3f}°C, R²={model.r2:.4f}")
+        print(f"Forslag ({tuner.rule}): kp={gains.kp:.4f} ki={gains.ki:.5f} kd={gains.kd:.3f}")
+        if args.apply:
+            pending = core.send({"command": "setConfig", "regulator_id": args.regulator - 1,
+                                 "type": CONTROLLER_PID, "kp": gains.kp, "ki": gains.ki, "kd": gains.kd})
+            if pending is not None:
+                pending.result(5.0)
+                print("Forslaget er sendt til regulatoren")
+        return 0
+    finally:
+        core.close()
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,440 @@
+"""Benchmarks for the host side hot paths.
+
+Measures frame parsing, the session's per-frame work, throughput of the
+serial reader on a pty, the GUI's frame handling and widget updates
+(offscreen Qt), log growth and graph redraws at several history lengths.
+Frames come from the simulated regulator, so every run sees the same data.
+
+    python benchmark.py                    # run everything
+    python benchmark.py parse gui.log      # only benchmarks starting with these names
+    python benchmark.py --save-baseline    # keep this run as the baseline
+    python benchmark.py --compare          # exit 1 if slower than the baseline
+
+Results go to a JSON file, one entry per benchmark with its value, unit
+and whether higher or lower is better. Timings are the best of several
+rounds, as with timeit.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from serial_protocol import FrameParser
+from history import EVENT_NONE, EVENT_START, EVENT_STOP
+from simulator import FaultInjector, SimulatedRegulator, STATE_RUN
+
+RESULTS_FILE = 'benchmark-results.json'
+BASELINE_FILE = 'benchmark-baseline.json'
+# Slowdown against the baseline reported as a regression
+DEFAULT_TOLERANCE = 0.2
+
+# Bytes per read: a USB serial adapter hands over data in small packets
+READ_SIZE = 64
+GRAPH_HISTORY_LENGTHS = (1000, 10000, 86400)
+
+BENCHMARKS = []
+
+
+def benchmark(name, unit, better):
+    """Register a function returning one value for the named benchmark"""
+    def register(func):
+        BENCHMARKS.append((name, unit, better, func))
+        return func
+    return register
+
+
+def best_time(func, repeat=5, min_batch=0.02):
+    """Best time per call of func, in seconds"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_batch or number >= 1 << 16:
+            break
+        number *= 2
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / number
+
+
+def make_frames(count=200, compact=False, kind='poll'):
+    """Encoded frames from a simulated regulator with its kettles heating.
+
+    kind 'poll' gives getStatus replies with the configuration, 'push' full
+    frames from a subscription and 'delta' its changesOnly frames.
+    """
+    regulator = SimulatedRegulator(seed=1)
+    regulator.compact = compact
+    for i in range(3):
+        regulator.pid_configs[i].update(enabled=True, setpoint=66.0)
+        regulator.buttons[i] = True
+        regulator.states[i] = STATE_RUN
+    frames = []
+    while len(frames) < count:
+        regulator.step()
+        if kind == 'poll':
+            frame = regulator.handle_line(b'{"command":"getStatus","config":true}')
+        else:
+            frame = regulator.status_frame(changes_only=kind == 'delta')
+        if frame is not None:
+            frames.append(frame)
+    return frames
+
+
+def chunked(frames, size=READ_SIZE):
+    data = b''.join(frames)
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def parse_rate(chunks, count):
+    def run():
+        parser = FrameParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+    return count / best_time(run)
+
+
+@benchmark('parse.json', 'frames/s', 'higher')
+def bench_parse_json():
+    frames = make_frames()
+    return parse_rate(chunked(frames), len(frames))
+
+
+@benchmark('parse.compact', 'frames/s', 'higher')
+def bench_parse_compact():
+    frames = make_frames(compact=True)
+    return parse_rate(chunked(frames), len(frames))
+
+
+@benchmark('parse.faults', 'frames/s', 'higher')
+def bench_parse_faults():
+    faults = FaultInjector(drop=0.0005, garble=0.05, junk=0.05, seed=1)
+    frames = [faults.apply(frame) for frame in make_frames()]
+    return parse_rate(chunked(frames), len(frames))
+
+
+def session_rate(frames):
+    from acquisition import ControllerSession
+    chunks = chunked(frames)
+
+    def run():
+        session = ControllerSession(lambda payload: None, lambda event, data: None)
+        session.active = True
+        for chunk in chunks:
+            session.feed(chunk)
+    return len(frames) / best_time(run)
+
+
+@benchmark('session.full', 'frames/s', 'higher')
+def bench_session_full():
+    return session_rate(make_frames(compact=True))
+
+
+@benchmark('session.delta', 'frames/s', 'higher')
+def bench_session_delta():
+    frames = make_frames(compact=True, kind='push')[:1] + make_frames(compact=True, kind='delta')
+    return session_rate(frames)
+
+
+@benchmark('link.pty', 'frames/s', 'higher')
+def bench_link_pty():
+    """Frames per second through SerialWorker and the session from a pty
+    written as fast as the kernel takes it"""
+    import tty
+    from acquisition import AcquisitionCore, EVENT_FRAME
+    frames = make_frames(compact=True, kind='push')
+    total = 5000
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    path = os.ttyname(slave)
+    received = [0]
+    done = threading.Event()
+
+    def count(event, data):
+        if event == EVENT_FRAME:
+            received[0] += 1
+            if received[0] >= total:
+                done.set()
+
+    core = AcquisitionCore()
+    core.session.compact = False
+    core.session.stream_interval = None
+    core.subscribe(count)
+    core.connect(path, 115200)
+    while not core.connected:
+        time.sleep(0.01)
+    # Whatever the session sends has to be read, or the pty fills up
+    drain = threading.Thread(target=lambda: _drain(master, done), daemon=True)
+    drain.start()
+    start = time.perf_counter()
+    data = b''.join(frames[i % len(frames)] for i in range(total))
+    view = memoryview(data)
+    while view:
+        view = view[os.write(master, view[:4096]):]
+    done.wait(30)
+    elapsed = time.perf_counter() - start
+    core.close()
+    os.close(master)
+    os.close(slave)
+    return received[0] / elapsed
+
+
+def _drain(fd, done):
+    import select
+    while not done.is_set():
+        if select.select([fd], [], [], 0.1)[0]:
+            try:
+                os.read(fd, 4096)
+            except OSError:
+                return
+
+
+_qt_app = None
+
+
+def qt_app():
+    global _qt_app
+    if _qt_app is None:
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        from PyQt5.QtWidgets import QApplication
+        _qt_app = QApplication.instance() or QApplication([])
+    return _qt_app
+
+
+def process_events(duration=0.0):
+    app = qt_app()
+    end = time.perf_counter() + duration
+    while True:
+        app.processEvents()
+        if time.perf_counter() >= end:
+            return
+
+
+def decoded_frames(**kwargs):
+    parser = FrameParser()
+    return parser.feed(b''.join(make_frames(**kwargs)))
+
+
+@benchmark('gui.frame', 'ms', 'lower')
+def bench_gui_frame():
+    """BrewControlApp.handle_serial_data per status frame"""
+    qt_app()
+    import BrewControl
+    history_dir = tempfile.mkdtemp(prefix='brewcontrol-bench-')
+    BrewControl.HISTORY_DIR = history_dir
+    window = BrewControl.BrewControlApp()
+    window.show()
+    process_events()
+    frames = decoded_frames(count=50)
+    position = [0]
+
+    def run():
+        window.handle_serial_data(frames[position[0] % len(frames)])
+        position[0] += 1
+    result = best_time(run) * 1000
+    window.close()
+    process_events()
+    return result
+
+
+@benchmark('gui.thermostat', 'ms', 'lower')
+def bench_gui_thermostat():
+    """ThermostatWidget.update_display per frame"""
+    qt_app()
+    from BrewControl import ThermostatWidget
+    from status_model import StatusSnapshot
+    widget = ThermostatWidget(0)
+    widget.show()
+    snapshots = [StatusSnapshot(frame) for frame in decoded_frames(count=50)]
+    position = [0]
+
+    def run():
+        snapshot = snapshots[position[0] % len(snapshots)]
+        widget.update_display(snapshot.thermostat(0), snapshot.sensor_for(0))
+        position[0] += 1
+    return best_time(run) * 1000
+
+
+def log_append(lines):
+    """Time per appended line with the log already holding lines lines"""
+    from log_view import LogView, DEBUG
+    qt_app()
+    log = LogView()
+    log.show()
+    for i in range(lines):
+        log.append(f"[12:00:00] Status modtaget {i}", DEBUG)
+    process_events()
+    count = [0]
+
+    def run():
+        log.append(f"[12:00:00] Status modtaget {count[0]}", DEBUG)
+        count[0] += 1
+    return best_time(run) * 1000
+
+
+@benchmark('gui.log.empty', 'ms', 'lower')
+def bench_log_empty():
+    return log_append(0)
+
+
+@benchmark('gui.log.full', 'ms', 'lower')
+def bench_log_full():
+    from log_view import DEFAULT_MAX_LINES
+    return log_append(DEFAULT_MAX_LINES)
+
+
+def graph_dialog(samples):
+    qt_app()
+    import temperatur_app
+    app = temperatur_app.TemperaturApp()
+    app.timer.stop()
+    rng = np.random.default_rng(1)
+    start = time.time() - samples
+    for history, setpoint in zip(app.history, app.setpoints):
+        history.clear()
+        temps = setpoint + np.cumsum(rng.normal(0, 0.2, samples))
+        alarms = np.abs(temps - setpoint) > 2
+        changes = np.diff(alarms.astype(np.int8), prepend=0)
+        events = np.where(changes > 0, EVENT_START, np.where(changes < 0, EVENT_STOP, EVENT_NONE))
+        for k in range(samples):
+            history.append(start + k, temps[k], setpoint, alarms[k], events[k])
+    dialog = temperatur_app.GraphDialog(app.names, app.history, app)
+    dialog.update_timer.stop()
+    dialog.show()
+    process_events(0.2)
+    return app, dialog
+
+
+def graph_update(samples):
+    """GraphDialog.update_graph on a new sample, blitted onto the cached background"""
+    app, dialog = graph_dialog(samples)
+
+    def run():
+        dialog.update_graph(0)
+    result = best_time(run, repeat=3) * 1000
+    dialog.close()
+    return result
+
+
+def graph_redraw(samples):
+    """Full redraw after a rescale, as on a tab switch"""
+    app, dialog = graph_dialog(samples)
+    canvas = dialog.canvases[0]
+
+    def run():
+        dialog.update_graph(0, rescale=True)
+        canvas.draw()
+    result = best_time(run, repeat=3) * 1000
+    dialog.close()
+    return result
+
+
+for _samples in GRAPH_HISTORY_LENGTHS:
+    benchmark(f'graph.update.{_samples}', 'ms', 'lower')(lambda samples=_samples: graph_update(samples))
+    benchmark(f'graph.redraw.{_samples}', 'ms', 'lower')(lambda samples=_samples: graph_redraw(samples))
+
+
+def run_benchmarks(prefixes=()):
+    results = {}
+    for name, unit, better, func in BENCHMARKS:
+        if prefixes and not any(name.startswith(prefix) for prefix in prefixes):
+            continue
+        try:
+            value = func()
+        except Exception as e:
+            print(f"{name:24} FEJL: {e}")
+            continue
+        results[name] = {'value': value, 'unit': unit, 'better': better}
+        print(f"{name:24} {value:12.3f} {unit}", flush=True)
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'numpy': np.__version__,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print the change against the baseline; returns the regressed names"""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None or not reference['value']:
+            continue
+        ratio = result['value'] / reference['value']
+        # Slowdown as a fraction, whichever way the unit goes
+        slowdown = 1 / ratio - 1 if result['better'] == 'higher' else ratio - 1
+        flag = ''
+        if slowdown > tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:24} {reference['value']:12.3f} -> {result['value']:12.3f} {result['unit']}"
+              f" ({-slowdown:+.0%}){flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the BrewControl host side")
+    parser.add_argument('names', nargs='*', help="only run benchmarks starting with these names")
+    parser.add_argument('--output', default=RESULTS_FILE, help=f"results file (default: {RESULTS_FILE})")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help=f"baseline file (default: {BASELINE_FILE})")
+    parser.add_argument('--save-baseline', action='store_true', help="also store the results as the baseline")
+    parser.add_argument('--compare', action='store_true', help="compare with the baseline, exit 1 on regressions")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f"slowdown counted as a regression (default: {DEFAULT_TOLERANCE})")
+    parser.add_argument('--list', action='store_true', help="list the benchmarks and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, unit, better, func in BENCHMARKS:
+            print(f"{name:24} {unit:9} {func.__doc__.splitlines()[0] if func.__doc__ else ''}")
+        return 0
+
+    results = run_benchmarks(args.names)
+    report = {'environment': environment(), 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline gemt i {args.baseline}")
+
+    if args.compare:
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            print(f"Ingen baseline i {args.baseline}; gem en med --save-baseline")
+            return 1
+        print(f"\nSammenlignet med {args.baseline} ({baseline['environment'].get('commit') or 'ukendt commit'}):")
+        if compare(results, baseline['results'], args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
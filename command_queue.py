@@ -0,0 +1,281 @@
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+# Size of the Arduino Mega's hardware serial receive buffer. Firmware
+# before SerialInput did not read the port while writing a ~2 KB reply or
+# a pushed status frame, so everything unanswered had to fit in here.
+SERIAL_RX_BUFFER = 64
+# The firmware now moves received bytes into its 2 KB input buffer also
+# while it writes. Unanswered commands are held to half of that, leaving
+# room for line noise and a line cut short.
+RX_BUDGET = 1024
+
+# Sequence numbers wrap well inside the firmware's 32 bit integer range
+SEQ_LIMIT = 1 << 16
+
+
+class CommandError(Exception):
+    def __init__(self, message, error_code=0):
+        super().__init__(message)
+        self.error_code = error_code
+
+
+class CommandTimeout(CommandError):
+    pass
+
+
+class PendingCommand:
+    """Handle for a command submitted to a CommandQueue.
+
+    Works like a small future: wait for it with result(), or register a
+    callback with add_done_callback(). Callbacks run in whichever thread
+    completes the command, usually the serial reader thread.
+    """
+
+    def __init__(self, seq, command, timeout, retries, priority=False):
+        self.seq = seq
+        self.command = command
+        self.priority = priority
+        self.timeout = timeout
+        self.retries_left = retries
+        self.attempts = 0
+        self.payload = b''
+        self.submitted_at = None
+        self.sent_at = None
+        self.deadline = None
+        self.round_trip = None
+        self.response = None
+        self.error = None
+        self._event = threading.Event()
+        self._callbacks = []
+
+    @property
+    def name(self):
+        return self.command.get('command', '')
+
+    def describe(self):
+        text = f"{self.name} #{self.seq}"
+        if 'regulator_id' in self.command:
+            text += f" (regulator_id={self.command['regulator_id']})"
+        return text
+
+    def done(self):
+        return self._event.is_set()
+
+    def failed(self):
+        return self.done() and self.error is not None
+
+    def result(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise CommandTimeout(f"{self.describe()} not completed")
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+    def add_done_callback(self, callback):
+        if self.done():
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def _finish(self, response=None, error=None):
+        self.response = response
+        self.error = error
+        self._event.set()
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"Command callback error: {e}")
+
+
+class CommandQueue:
+    """Sequenced, flow controlled command queue for the regulator link.
+
+    Every command gets a "seq" number which the firmware echoes in its reply,
+    so replies can be matched to commands even though each of them carries
+    the full system status. Replies without "seq" (older firmware) are
+    matched to the oldest in-flight command of the same name, as the
+    firmware handles commands strictly in order.
+
+    At most max_in_flight commands are outstanding at a time, and together
+    they are limited to rx_budget bytes: until its reply comes, a command
+    may still be waiting unread in the firmware's input buffer. A command
+    larger than the budget on its own is sent only when nothing else is
+    outstanding. Older firmware lost what arrived while it was writing; when
+    a command comes back mangled while others were outstanding, the budget
+    drops to SERIAL_RX_BUFFER until cancel_all() ends the link. Commands that are not answered within their timeout are
+    resent up to `retries` times.
+
+    Commands submitted with priority, such as an emergency stop, go ahead
+    of everything queued that is not itself a priority command.
+    """
+
+    def __init__(self, write, max_in_flight=4, rx_budget=RX_BUDGET,
+                 timeout=2.0, retries=1, clock=time.monotonic):
+        self.write = write
+        self.max_in_flight = max_in_flight
+        self.rx_budget = rx_budget
+        self.full_rx_budget = rx_budget
+        self.timeout = timeout
+        self.retries = retries
+        self.clock = clock
+        self.queued = deque()
+        self.in_flight = []
+        self.lock = threading.RLock()
+        self._seq = itertools.count(1)
+
+    def submit(self, command, timeout=None, retries=None, callback=None, priority=False):
+        if not isinstance(command, dict):
+            # The sequence number has to go into a JSON object
+            raise ValueError(f"Command must be a JSON object, not {type(command).__name__}")
+        with self.lock:
+            seq = next(self._seq) % SEQ_LIMIT
+            pending = PendingCommand(
+                seq, command,
+                self.timeout if timeout is None else timeout,
+                self.retries if retries is None else retries,
+                priority,
+            )
+            pending.payload = (json.dumps(dict(command, seq=seq), separators=(',', ':')) + '\n').encode()
+            pending.submitted_at = self.clock()
+            if callback:
+                pending.add_done_callback(callback)
+            if priority:
+                # Behind earlier priority commands, ahead of the rest
+                position = 0
+                while position < len(self.queued) and self.queued[position].priority:
+                    position += 1
+                self.queued.insert(position, pending)
+            else:
+                self.queued.append(pending)
+            self._pump()
+        return pending
+
+    def has_pending(self, name):
+        with self.lock:
+            for pending in itertools.chain(self.in_flight, self.queued):
+                if pending.name == name:
+                    return True
+        return False
+
+    def __len__(self):
+        with self.lock:
+            return len(self.in_flight) + len(self.queued)
+
+    def handle_frame(self, frame):
+        """Match a received frame to its command. Returns the command or None."""
+        finished = None
+        with self.lock:
+            pending = self._match(frame)
+            if pending is None:
+                return None
+            self.in_flight.remove(pending)
+
+            if 'error' in frame:
+                error = CommandError(frame['error'], frame.get('errorCode', 0))
+                if 'command' not in frame and self.in_flight:
+                    # Mangled while others were outstanding: likely firmware
+                    # that does not read while it writes
+                    self.rx_budget = min(self.rx_budget, SERIAL_RX_BUFFER)
+                if 'command' not in frame and pending.retries_left > 0:
+                    # The firmware could not even parse the command, so it
+                    # was mangled on the wire - worth sending again
+                    pending.retries_left -= 1
+                    self.queued.appendleft(pending)
+                else:
+                    finished = (pending, None, error)
+            else:
+                finished = (pending, frame, None)
+            self._pump()
+
+        if finished:
+            self._complete(*finished)
+            return finished[0]
+        return None
+
+    def poll(self):
+        """Expire timed out commands and send whatever the window allows.
+
+        Returns the monotonic time of the next deadline, or None when
+        nothing is in flight.
+        """
+        now = self.clock()
+        expired = []
+        with self.lock:
+            retry = []
+            for pending in list(self.in_flight):
+                if pending.deadline > now:
+                    continue
+                self.in_flight.remove(pending)
+                if pending.retries_left > 0:
+                    pending.retries_left -= 1
+                    retry.append(pending)
+                else:
+                    expired.append(pending)
+            # Resend ahead of newer commands, keeping the original order
+            self.queued.extendleft(reversed(retry))
+            self._pump()
+            deadline = min((p.deadline for p in self.in_flight), default=None)
+
+        for pending in expired:
+            self._complete(pending, None, CommandTimeout(
+                f"timed out after {pending.attempts} attempts"))
+        return deadline
+
+    def cancel_all(self, reason="Connection closed"):
+        with self.lock:
+            cancelled = self.in_flight + list(self.queued)
+            self.in_flight = []
+            self.queued.clear()
+            # The next link may well be to newer firmware
+            self.rx_budget = self.full_rx_budget
+        for pending in cancelled:
+            self._complete(pending, None, CommandError(reason))
+
+    def _match(self, frame):
+        if not self.in_flight:
+            return None
+        seq = frame.get('seq')
+        if seq is not None:
+            for pending in self.in_flight:
+                if pending.seq == seq:
+                    return pending
+            # Late reply to a command that already timed out
+            return None
+        name = frame.get('command')
+        if name is None:
+            # Firmware errors such as "Invalid JSON" carry no command name
+            return self.in_flight[0] if 'error' in frame else None
+        for pending in self.in_flight:
+            if pending.name == name:
+                return pending
+        return None
+
+    def _pump(self):
+        while self.queued and len(self.in_flight) < self.max_in_flight:
+            pending = self.queued[0]
+            if self.in_flight:
+                # Nothing unanswered is known to have been read yet
+                waiting = sum(len(p.payload) for p in self.in_flight)
+                if waiting + len(pending.payload) > self.rx_budget:
+                    break
+            self.queued.popleft()
+            try:
+                self.write(pending.payload)
+            except Exception as e:
+                self._complete(pending, None, CommandError(f"Send error: {e}"))
+                continue
+            pending.attempts += 1
+            pending.sent_at = self.clock()
+            pending.deadline = pending.sent_at + pending.timeout
+            self.in_flight.append(pending)
+
+    def _complete(self, pending, response, error):
+        if pending.sent_at is not None:
+            pending.round_trip = self.clock() - pending.sent_at
+        pending._finish(response, error)
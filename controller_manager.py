@@ -0,0 +1,334 @@
+"""Several regulator links on one asyncio event loop.
+
+Each link gets its own ControllerSession, so it has its own command queue,
+poll schedule and status, but all of them share one thread: every read,
+write and timer of every link runs on the loop. Ports are watched with
+loop.add_reader where the platform allows it; Windows serial ports and
+socket:// URLs have no selectable handle and are read without blocking
+every READ_INTERVAL seconds instead.
+
+In the GUI every link runs here, the primary one included: its
+AcquisitionCore hands its session to the manager (AcquisitionCore(manager=
+...)), so the "Controllere" tab shows all controllers side by side while
+the detail tabs follow the primary one. A port is used by one link only.
+
+Controller names become directory names under history_dir, so they are
+limited to letters, digits, spaces, '-' and '_'.
+
+    python controller_manager.py HLT=/dev/ttyACM0 Mæsk=/dev/ttyACM1
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import os
+import re
+import threading
+import time
+
+import serial
+
+from acquisition import (ControllerSession, HISTORY_DIR, NUM_SENSORS, NUM_THERMOSTATS,
+                         EVENT_CONNECTED, EVENT_DISCONNECTED, EVENT_FRAME, EVENT_COMMAND,
+                         EVENT_ALARM)
+from recorder import StatusRecorder
+
+# Seconds between reads of ports the loop cannot watch, and the most
+# taken in one read
+READ_INTERVAL = 0.02
+READ_SIZE = 4096
+# Shortest wait between polls
+MIN_WAIT = 0.01
+
+# What a controller name may be; it is used as a directory name
+NAME_PATTERN = re.compile(r'\w([\w\- ]*\w)?')
+
+
+class ControllerLink:
+    """One regulator on the manager's event loop. Only touched from the loop
+    thread; send() may be called from anywhere and hands the command over
+    to it.
+
+    Without a session the link has its own and passes its events to the
+    manager. A session given to it belongs to someone else, who writes
+    through write() and sees to its events.
+    """
+
+    def __init__(self, manager, name, port, baudrate=115200, recorder=None, session=None):
+        self.manager = manager
+        self.name = name
+        self.port = port
+        self.baudrate = baudrate
+        self.recorder = recorder
+        self.session = ControllerSession(self.write, self._emit) if session is None else session
+        self.serial_conn = None
+        self.connected = False
+        self.error = None
+        self.last_frame_time = None
+        self.poll_handle = None
+        self.read_handle = None
+        self.watched = False
+
+    @property
+    def loop(self):
+        return self.manager.loop
+
+    def open(self):
+        try:
+            # Non-blocking; the loop tells us when there is something to read
+            self.serial_conn = serial.serial_for_url(self.port, self.baudrate, timeout=0)
+        except Exception as e:
+            self.error = str(e)
+            self.session.emit(EVENT_DISCONNECTED, self.error)
+            return
+        self.connected = True
+        self.error = None
+        self.session.start()
+        self.session.emit(EVENT_CONNECTED, self.port)
+        try:
+            self.loop.add_reader(self.serial_conn.fileno(), self._on_readable)
+            self.watched = True
+        except (NotImplementedError, AttributeError, ValueError):
+            # Windows serial ports and socket:// URLs have no selectable handle
+            self.watched = False
+            self.read_handle = self.loop.call_soon(self._read_available)
+        self.schedule()
+
+    def close(self, reason=None):
+        if not self.connected:
+            return
+        self.connected = False
+        self.error = reason
+        if self.poll_handle:
+            self.poll_handle.cancel()
+            self.poll_handle = None
+        if self.read_handle:
+            self.read_handle.cancel()
+            self.read_handle = None
+        if self.watched:
+            self.loop.remove_reader(self.serial_conn.fileno())
+            self.watched = False
+        self.session.stop(reason)
+        self.serial_conn.close()
+        self.session.emit(EVENT_DISCONNECTED, reason)
+
+    def write(self, payload):
+        if not self.connected:
+            raise serial.SerialException("Port not open")
+        self.serial_conn.write(payload)
+
+    def send(self, command, callback=None, timeout=None, retries=None, priority=False):
+        """Queue a command from any thread; it is written from the loop"""
+        return self.manager._call(self._send, command, callback, timeout, retries, priority)
+
+    def _send(self, command, callback, timeout, retries, priority):
+        pending = self.session.send(command, callback=callback, timeout=timeout, retries=retries,
+                                    priority=priority)
+        # The command's deadline may be earlier than the current wake-up
+        self.schedule()
+        return pending
+
+    def schedule(self):
+        """Run the session's timers and arm the loop for its next deadline"""
+        if self.poll_handle:
+            self.poll_handle.cancel()
+            self.poll_handle = None
+        if not self.connected:
+            return
+        deadline = self.session.poll()
+        if deadline is not None:
+            self.poll_handle = self.loop.call_at(max(deadline, self.loop.time() + MIN_WAIT),
+                                                 self.schedule)
+
+    def _on_readable(self):
+        try:
+            chunk = self.serial_conn.read(self.serial_conn.in_waiting or 1)
+        except Exception as e:
+            self.close(str(e))
+            return
+        if chunk:
+            self.session.feed(chunk)
+            self.schedule()
+
+    def _read_available(self):
+        """Take what a port the loop cannot watch has received, without
+        blocking, and come back in READ_INTERVAL"""
+        self.read_handle = None
+        try:
+            chunk = self.serial_conn.read(max(self.serial_conn.in_waiting, READ_SIZE))
+        except Exception as e:
+            self.close(str(e))
+            return
+        if chunk:
+            self.session.feed(chunk)
+            self.schedule()
+        if self.connected:
+            self.read_handle = self.loop.call_later(READ_INTERVAL, self._read_available)
+
+    def _emit(self, event, data):
+        if event == EVENT_FRAME:
+            self.last_frame_time = time.time()
+            if self.recorder is not None:
+                self.recorder.record(data, self.last_frame_time)
+        self.manager.dispatch(self.name, event, data)
+
+
+class ControllerManager:
+    """Connections to any number of regulators, driven by one event loop.
+
+    The loop runs in a background thread; the public methods are safe to
+    call from any other thread. Subscribers are called as
+    callback(name, event, data) from the loop thread with the same events
+    as AcquisitionCore subscribers. With a history_dir every controller is
+    recorded to its own subdirectory.
+    """
+
+    def __init__(self, history_dir=None):
+        self.history_dir = history_dir
+        self.links = {}
+        self.subscribers = []
+        self.subscriber_lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name="ControllerManager", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def subscribe(self, callback):
+        with self.subscriber_lock:
+            self.subscribers = self.subscribers + [callback]
+
+    def unsubscribe(self, callback):
+        with self.subscriber_lock:
+            self.subscribers = [s for s in self.subscribers if s != callback]
+
+    def add(self, name, port, baudrate=115200, session=None):
+        """Connect a controller under the given name; returns its ControllerLink.
+        Raises ValueError for a name or port already in use or a name that
+        is not NAME_PATTERN. With a session, see ControllerLink, the link
+        drives that one and nothing is recorded for it here."""
+        return self._call(self._add, name, port, baudrate, session)
+
+    def remove(self, name):
+        self._call(self._remove, name)
+
+    def reconnect(self, name):
+        self._call(self._reconnect, name)
+
+    def send(self, name, command, callback=None, timeout=None, retries=None, priority=False):
+        """Queue a command for one controller; returns a PendingCommand, or
+        None when it is unknown or not connected"""
+        link = self.links.get(name)
+        if link is None or not link.connected:
+            return None
+        return link.send(command, callback=callback, timeout=timeout, retries=retries, priority=priority)
+
+    def status(self):
+        """Latest StatusSnapshot of every controller, by name"""
+        return {name: link.session.snapshot for name, link in list(self.links.items())}
+
+    def close(self):
+        if not self.loop.is_running():
+            return
+        for name in list(self.links):
+            self.remove(name)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def _call(self, func, *args):
+        """Run func in the loop thread and return its result"""
+        if threading.current_thread() is self.thread:
+            return func(*args)
+        future = concurrent.futures.Future()
+
+        def run():
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+        self.loop.call_soon_threadsafe(run)
+        return future.result()
+
+    def dispatch(self, name, event, data):
+        """Pass an event of the named controller on to the subscribers"""
+        for callback in self.subscribers:
+            try:
+                callback(name, event, data)
+            except Exception as e:
+                print(f"Subscriber error: {e}")
+
+    def _add(self, name, port, baudrate, session):
+        if not isinstance(name, str) or not NAME_PATTERN.fullmatch(name):
+            raise ValueError(f"Invalid controller name {name!r}: use letters, digits, spaces, '-' and '_'")
+        if name in self.links:
+            raise ValueError(f"Controller {name!r} already exists")
+        for link in self.links.values():
+            if link.port == port:
+                raise ValueError(f"Port {port} is already used by {link.name!r}")
+        recorder = None
+        if self.history_dir and session is None:
+            recorder = StatusRecorder(os.path.join(self.history_dir, name), NUM_SENSORS, NUM_THERMOSTATS)
+            recorder.start()
+        link = ControllerLink(self, name, port, baudrate, recorder, session)
+        self.links[name] = link
+        link.open()
+        return link
+
+    def _remove(self, name):
+        link = self.links.pop(name, None)
+        if link is None:
+            return
+        link.close()
+        if link.recorder is not None:
+            link.recorder.stop()
+
+    def _reconnect(self, name):
+        link = self.links.get(name)
+        if link is not None:
+            link.close()
+            link.open()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Log several BrewControl regulators")
+    parser.add_argument('controllers', nargs='+', metavar='NAVN=PORT',
+                        help="controller name and serial port, e.g. HLT=/dev/ttyACM0")
+    parser.add_argument('--baudrate', type=int, default=115200)
+    parser.add_argument('--history-dir', default=HISTORY_DIR,
+                        help="directory for the recorded history")
+    parser.add_argument('--no-record', action='store_true', help="do not record frames to disk")
+    args = parser.parse_args(argv)
+
+    manager = ControllerManager(None if args.no_record else args.history_dir)
+
+    def report(name, event, data):
+        timestamp = time.strftime("%H:%M:%S")
+        if event == EVENT_CONNECTED:
+            print(f"[{timestamp}] {name}: tilsluttet {data}")
+        elif event == EVENT_DISCONNECTED:
+            print(f"[{timestamp}] {name}: forbindelse lukket" + (f": {data}" if data else ""))
+        elif event == EVENT_ALARM:
+            print(f"[{timestamp}] {name}: alarm {data.regulator_id + 1}: niveau {data.previous} -> {data.level}")
+        elif event == EVENT_COMMAND and data.error is not None:
+            print(f"[{timestamp}] {name}: kommando {data.describe()} fejlede: {data.error}")
+
+    manager.subscribe(report)
+    for spec in args.controllers:
+        name, _, port = spec.partition('=')
+        if not port:
+            parser.error(f"expected NAVN=PORT, got {spec!r}")
+        manager.add(name, port, args.baudrate)
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        manager.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+def minmax_indices(values, buckets, keep=None):
+    """Indices of a min-max decimation of values into about buckets buckets.
+
+    Each bucket contributes the index of its smallest and largest value, so
+    peaks survive at any resolution. The first and last sample and the
+    indices in keep are always included. Returns sorted, unique indices.
+    """
+    n = len(values)
+    buckets = max(int(buckets), 1)
+    if n <= 2 * buckets:
+        return np.arange(n)
+
+    width = -(-n // buckets)
+    full = n // width * width
+    blocks = values[:full].reshape(-1, width)
+    offsets = np.arange(0, full, width)
+    parts = [
+        offsets + np.argmin(blocks, axis=1),
+        offsets + np.argmax(blocks, axis=1),
+        [0, n - 1],
+    ]
+    if full < n:
+        tail = values[full:]
+        parts.append([full + np.argmin(tail), full + np.argmax(tail)])
+    if keep is not None:
+        parts.append(keep)
+    return np.unique(np.concatenate(parts).astype(np.intp))
+
+
+def transitions(values):
+    """Indices on both sides of every change in values"""
+    changes = np.flatnonzero(values[1:] != values[:-1])
+    return np.concatenate((changes, changes + 1))
+
+
+def any_between(flags, indices):
+    """For each pair of consecutive indices a, b whether any of flags[a:b + 1]
+    is set, i.e. whether the decimated segment from a to b covers a flag"""
+    counts = np.concatenate(([0], np.cumsum(flags, dtype=np.int64)))
+    return counts[indices[1:] + 1] - counts[indices[:-1]] > 0
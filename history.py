@@ -0,0 +1,60 @@
+from collections import namedtuple
+
+import numpy as np
+
+# Event codes stored per sample
+EVENT_NONE = 0
+EVENT_START = 1  # Alarm started at this sample
+EVENT_STOP = 2   # Alarm cleared at this sample
+
+HistoryView = namedtuple('HistoryView', ['times', 'temperatures', 'setpoints', 'alarms', 'events'])
+
+
+class ChannelHistory:
+    """Fixed capacity, column oriented history for one temperature channel.
+
+    Columns are preallocated NumPy arrays. Every sample is written twice,
+    at i and i + capacity, so the newest samples always form one contiguous
+    slice and view() hands out views without copying. Views are only valid
+    until the next append overwrites the oldest sample.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = np.zeros(2 * capacity, dtype=np.float64)
+        self.temperatures = np.zeros(2 * capacity, dtype=np.float64)
+        self.setpoints = np.zeros(2 * capacity, dtype=np.float64)
+        self.alarms = np.zeros(2 * capacity, dtype=np.bool_)
+        self.events = np.zeros(2 * capacity, dtype=np.int8)
+        self.head = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, timestamp, temperature, setpoint, alarm, event=EVENT_NONE):
+        i = self.head
+        j = i + self.capacity
+        self.times[i] = self.times[j] = timestamp
+        self.temperatures[i] = self.temperatures[j] = temperature
+        self.setpoints[i] = self.setpoints[j] = setpoint
+        self.alarms[i] = self.alarms[j] = alarm
+        self.events[i] = self.events[j] = event
+        self.head = (i + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def clear(self):
+        self.head = 0
+        self.size = 0
+
+    def view(self):
+        start = self.head + self.capacity - self.size
+        end = self.head + self.capacity
+        return HistoryView(
+            self.times[start:end],
+            self.temperatures[start:end],
+            self.setpoints[start:end],
+            self.alarms[start:end],
+            self.events[start:end],
+        )
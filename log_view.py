@@ -0,0 +1,199 @@
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QSortFilterProxyModel, QTimer
+from PyQt5.QtGui import QBrush, QColor
+from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QListView, QComboBox,
+                             QLabel, QSpinBox, QPushButton)
+
+# Log levels
+DEBUG = 0
+INFO = 1
+WARNING = 2
+ERROR = 3
+LEVEL_NAMES = ["Debug", "Info", "Advarsel", "Fejl"]
+LEVEL_COLORS = [QColor('gray'), None, QColor('darkorange'), QColor('red')]
+
+DEFAULT_MAX_LINES = 5000
+
+
+class LogModel(QAbstractListModel):
+    """Ring buffer of (level, text) log lines exposed as a list model
+
+    The lines live in a list used as a circular buffer: row r is stored at
+    (head + r) % len(entries), so looking up a row and dropping the oldest
+    line are both O(1) however many lines are kept.
+    """
+
+    LevelRole = Qt.UserRole + 1
+
+    def __init__(self, max_lines=DEFAULT_MAX_LINES, parent=None):
+        super().__init__(parent)
+        self.max_lines = max_lines
+        self.entries = []
+        self.head = 0
+        self.count = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.count
+
+    def entry(self, row):
+        return self.entries[(self.head + row) % len(self.entries)]
+
+    def lines(self):
+        return [self.entry(row) for row in range(self.count)]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        level, text = self.entry(index.row())
+        if role == Qt.DisplayRole:
+            return text
+        if role == Qt.ForegroundRole and LEVEL_COLORS[level] is not None:
+            return QBrush(LEVEL_COLORS[level])
+        if role == self.LevelRole:
+            return level
+        return None
+
+    def append(self, text, level=INFO):
+        if self.count >= self.max_lines:
+            self._trim(self.max_lines - 1)
+        row = self.count
+        self.beginInsertRows(QModelIndex(), row, row)
+        if row < len(self.entries):
+            # Reuse the slot freed by the oldest line
+            self.entries[(self.head + row) % len(self.entries)] = (level, text)
+        else:
+            # Still growing towards max_lines, head is 0 here
+            self.entries.append((level, text))
+        self.count += 1
+        self.endInsertRows()
+
+    def set_max_lines(self, max_lines):
+        self.max_lines = max(1, max_lines)
+        self._trim(self.max_lines)
+        # Straighten the buffer out so it can grow or shrink from head 0
+        self.entries = self.lines()
+        self.head = 0
+
+    def clear(self):
+        self.beginResetModel()
+        self.entries = []
+        self.head = 0
+        self.count = 0
+        self.endResetModel()
+
+    def _trim(self, keep):
+        excess = self.count - keep
+        if excess <= 0:
+            return
+        self.beginRemoveRows(QModelIndex(), 0, excess - 1)
+        for row in range(excess):
+            self.entries[(self.head + row) % len(self.entries)] = None
+        self.head = (self.head + excess) % len(self.entries)
+        self.count = keep
+        self.endRemoveRows()
+
+
+class LevelFilterModel(QSortFilterProxyModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.min_level = DEBUG
+
+    def set_min_level(self, level):
+        self.min_level = level
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        return self.sourceModel().entry(source_row)[0] >= self.min_level
+
+
+class LogView(QWidget):
+    """Bounded log view with level filtering.
+
+    Drop-in replacement for a read-only QTextEdit used as a log: append()
+    adds a line, the oldest lines are dropped beyond max_lines, and the
+    list view only renders the rows that are visible.
+    """
+
+    def __init__(self, max_lines=DEFAULT_MAX_LINES, parent=None):
+        super().__init__(parent)
+        self.model = LogModel(max_lines, self)
+        self.filter_model = LevelFilterModel(self)
+        self.filter_model.setSourceModel(self.model)
+        self.scroll_pending = False
+        self.init_ui()
+
+    def init_ui(self):
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+
+        controls = QHBoxLayout()
+        controls.addWidget(QLabel("Niveau:"))
+        self.level_combo = QComboBox()
+        self.level_combo.addItems(LEVEL_NAMES)
+        self.level_combo.currentIndexChanged.connect(self.set_min_level)
+        controls.addWidget(self.level_combo)
+
+        controls.addWidget(QLabel("Maks linjer:"))
+        self.max_lines_spin = QSpinBox()
+        self.max_lines_spin.setRange(100, 1000000)
+        self.max_lines_spin.setSingleStep(1000)
+        self.max_lines_spin.setValue(self.model.max_lines)
+        self.max_lines_spin.valueChanged.connect(self.model.set_max_lines)
+        controls.addWidget(self.max_lines_spin)
+
+        controls.addStretch()
+        clear_btn = QPushButton("Ryd")
+        clear_btn.clicked.connect(self.clear)
+        controls.addWidget(clear_btn)
+        layout.addLayout(controls)
+
+        # Uniform row heights let the view lay out only the visible rows
+        self.list_view = QListView()
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setWordWrap(False)
+        self.list_view.setEditTriggers(QListView.NoEditTriggers)
+        self.list_view.setSelectionMode(QListView.ExtendedSelection)
+        self.list_view.setModel(self.model)
+        layout.addWidget(self.list_view)
+
+        self.setLayout(layout)
+
+    def set_min_level(self, level):
+        # The proxy is only put in between while a filter is active, so the
+        # common unfiltered case costs nothing per appended line
+        self.filter_model.set_min_level(level)
+        model = self.model if level == DEBUG else self.filter_model
+        if self.list_view.model() is not model:
+            self.list_view.setModel(model)
+        self.list_view.scrollToBottom()
+
+    def append(self, text, level=INFO):
+        scrollbar = self.list_view.verticalScrollBar()
+        at_bottom = scrollbar.value() >= scrollbar.maximum()
+        self.model.append(text, level)
+        # Follow new lines unless the user has scrolled up to read. Scrolling
+        # is coalesced per event loop pass and skipped while hidden
+        if at_bottom and not self.scroll_pending and self.isVisible():
+            self.scroll_pending = True
+            QTimer.singleShot(0, self.scroll_to_bottom)
+
+    def scroll_to_bottom(self):
+        self.scroll_pending = False
+        self.list_view.scrollToBottom()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.list_view.scrollToBottom()
+
+    def clear(self):
+        self.model.clear()
+
+    def setPlainText(self, text):
+        self.model.clear()
+        for line in text.splitlines():
+            self.model.append(line)
+
+    def toPlainText(self):
+        return "\n".join(text for level, text in self.model.lines())
+
+    def setFont(self, font):
+        self.list_view.setFont(font)
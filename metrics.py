@@ -0,0 +1,209 @@
+"""Runtime metrics for the host side hot paths.
+
+A Metrics registry holds three kinds of measurements, created on first use:
+
+- counters: totals such as timed out commands,
+- rates: amounts per second over the last RATE_WINDOW seconds, e.g. frames
+  or bytes received, with their running total,
+- histograms: durations with percentiles over the most recent samples,
+  e.g. parse time or command round trip.
+
+Recording is cheap enough for every frame and safe from any thread. The
+registry can be exported in the Prometheus text format (for a node
+exporter textfile collector or similar) or as JSON:
+
+    python acquisition.py --port /dev/ttyACM0 --metrics /var/lib/node_exporter/brewcontrol.prom
+"""
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+
+# Samples kept per histogram; percentiles describe the most recent ones
+HISTOGRAM_WINDOW = 1000
+# Period rates are averaged over, in seconds
+RATE_WINDOW = 10.0
+PERCENTILES = (50, 90, 99)
+
+PROMETHEUS_PREFIX = 'brewcontrol_'
+
+
+class Histogram:
+    """Recent samples for percentiles, plus lifetime count, sum and maximum"""
+
+    def __init__(self, window=HISTOGRAM_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def summary(self):
+        values = sorted(self.samples)
+        result = {'count': self.count, 'sum': self.total, 'max': self.max}
+        for p in PERCENTILES:
+            result[f'p{p}'] = percentile(values, p)
+        return result
+
+
+class Rate:
+    """Amount per second over a sliding window, kept in one second buckets"""
+
+    def __init__(self, window=RATE_WINDOW, clock=time.monotonic):
+        self.window = window
+        self.clock = clock
+        self.buckets = deque()
+        self.total = 0
+        self.started = clock()
+
+    def add(self, amount=1):
+        self.total += amount
+        second = int(self.clock())
+        if self.buckets and self.buckets[-1][0] == second:
+            self.buckets[-1][1] += amount
+        else:
+            self.buckets.append([second, amount])
+            self._expire(second)
+
+    def rate(self):
+        now = self.clock()
+        self._expire(int(now))
+        # Until a full window has passed, average over what there is
+        elapsed = min(self.window, max(now - self.started, 1.0))
+        return sum(amount for _, amount in self.buckets) / elapsed
+
+    def _expire(self, second):
+        while self.buckets and self.buckets[0][0] <= second - self.window:
+            self.buckets.popleft()
+
+
+class Metrics:
+    """Named counters, rates and histograms, safe to update from any thread"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.rates = {}
+        self.histograms = {}
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def mark(self, name, amount=1):
+        """Add to the rate of name, e.g. bytes received"""
+        with self.lock:
+            rate = self.rates.get(name)
+            if rate is None:
+                rate = self.rates[name] = Rate(clock=self.clock)
+            rate.add(amount)
+
+    def observe(self, name, value):
+        """Record a sample, e.g. a duration in seconds"""
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(value)
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.rates = {}
+            self.histograms = {}
+
+    def snapshot(self):
+        """Plain dict of everything recorded so far"""
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'rates': {name: {'rate': rate.rate(), 'total': rate.total}
+                          for name, rate in self.rates.items()},
+                'histograms': {name: histogram.summary()
+                               for name, histogram in self.histograms.items()},
+            }
+
+
+def percentile(values, p):
+    """Nearest rank percentile of sorted values, or None when empty"""
+    if not values:
+        return None
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def prometheus_name(name):
+    """name with the characters Prometheus does not allow in metric and
+    label names replaced by underscores"""
+    return re.sub(r'[^a-zA-Z0-9_:]', '_', name)
+
+
+def escape_label(value):
+    """A label value escaped for the Prometheus text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{prometheus_name(name)}="{escape_label(value)}"'
+                          for name, value in labels.items()) + '}'
+
+
+def format_prometheus(snapshot, prefix=PROMETHEUS_PREFIX, labels=None):
+    """A snapshot in the Prometheus text exposition format.
+
+    Counters and rate totals become counters, rates gauges and histograms
+    summaries over their recent samples. labels, e.g. {"port": "COM3"}, are
+    added to every sample so several loggers can share a collector.
+    """
+    labels = dict(labels or {})
+    common = format_labels(labels)
+    lines = []
+    for name, value in sorted(snapshot['counters'].items()):
+        name = prefix + prometheus_name(name)
+        lines.append(f'# TYPE {name}_total counter')
+        lines.append(f'{name}_total{common} {value}')
+    for name, rate in sorted(snapshot['rates'].items()):
+        name = prefix + prometheus_name(name)
+        lines.append(f'# TYPE {name}_total counter')
+        lines.append(f'{name}_total{common} {rate["total"]}')
+        lines.append(f'# TYPE {name}_per_second gauge')
+        lines.append(f'{name}_per_second{common} {rate["rate"]:.6g}')
+    for name, summary in sorted(snapshot['histograms'].items()):
+        name = prefix + prometheus_name(name)
+        lines.append(f'# TYPE {name} summary')
+        for p in PERCENTILES:
+            value = summary[f'p{p}']
+            if value is not None:
+                quantile = format_labels(dict(labels, quantile=f'{p / 100:g}'))
+                lines.append(f'{name}{quantile} {value:.6g}')
+        lines.append(f'{name}_sum{common} {summary["sum"]:.6g}')
+        lines.append(f'{name}_count{common} {summary["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def export(metrics, path, labels=None):
+    """Write the current metrics to path, as JSON if it ends in .json and in
+    the Prometheus text format otherwise. The file is replaced atomically so
+    a collector never reads half of it."""
+    snapshot = metrics.snapshot()
+    if path.lower().endswith('.json'):
+        if labels:
+            snapshot['labels'] = dict(labels)
+        text = json.dumps(dict(snapshot, time=time.time()), indent=2)
+    else:
+        text = format_prometheus(snapshot, labels=labels)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_path, path)
@@ -0,0 +1,167 @@
+import time
+
+from PyQt5.QtCore import Qt, QObject, QTimer
+from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem,
+                             QHeaderView, QAbstractItemView, QPushButton, QLabel, QFileDialog,
+                             QMessageBox)
+
+from metrics import PERCENTILES, export
+
+# How often the table is refreshed while it is visible, in ms
+REFRESH_INTERVAL = 1000
+
+# How often the stall monitor expects to run, and how late it has to be
+# before a GUI stall is counted
+STALL_CHECK_INTERVAL = 0.1
+STALL_THRESHOLD = 0.1
+
+# Display names of the metrics recorded by ControllerSession and the GUIs;
+# anything else is shown under its own name
+METRIC_NAMES = {
+    'frames': "Frames",
+    'received_bytes': "Modtaget",
+    'sent_bytes': "Sendt",
+    'parse_seconds': "Parsetid pr. frame",
+    'dispatch_seconds': "Behandling i seriel tråd",
+    'receive_latency_seconds': "Modtagelsesforsinkelse",
+    'command_round_trip_seconds': "Kommando-svartid",
+    'command_timeouts': "Kommandoer uden svar",
+    'command_errors': "Kommandofejl",
+    'command_retries': "Gensendte kommandoer",
+    'dropped_frames': "Tabte frames",
+    'discarded_bytes': "Kasserede bytes",
+    'stream_timeouts': "Afbrudte statusstrømme",
+    'gui_frame_seconds': "GUI-opdatering pr. frame",
+    'gui_stall_seconds': "GUI-tråd forsinket",
+    'gui_stalls': "GUI-tråd blokeret",
+    'graph_update_seconds': "Grafopdatering",
+}
+COLUMNS = ["Måling", "Værdi"] + [f"p{p}" for p in PERCENTILES] + ["Maks"]
+
+
+def format_value(name, value):
+    if value is None:
+        return "--"
+    if name.endswith('_seconds'):
+        return f"{value * 1000:.2f} ms"
+    return f"{value:g}"
+
+
+def format_rate(name, rate):
+    if name.endswith('_bytes'):
+        return f"{rate['rate']:.0f} B/s ({rate['total']} i alt)"
+    return f"{rate['rate']:.1f}/s ({rate['total']} i alt)"
+
+
+class StallMonitor(QObject):
+    """Measures how late a periodic timer fires in the GUI thread.
+
+    Anything that blocks the event loop - slow handlers, redraws - delays
+    the timer, so the lateness is the time the GUI could not respond.
+    """
+
+    def __init__(self, metrics, parent=None):
+        super().__init__(parent)
+        self.metrics = metrics
+        self.last = None
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.check)
+        self.timer.start(int(STALL_CHECK_INTERVAL * 1000))
+
+    def check(self):
+        now = time.perf_counter()
+        if self.last is not None:
+            stall = max(now - self.last - STALL_CHECK_INTERVAL, 0.0)
+            self.metrics.observe('gui_stall_seconds', stall)
+            if stall >= STALL_THRESHOLD:
+                self.metrics.count('gui_stalls')
+        self.last = now
+
+    def stop(self):
+        self.timer.stop()
+
+
+class MetricsView(QWidget):
+    """Table of a Metrics registry, refreshed while visible, with reset and
+    export to JSON or the Prometheus text format"""
+
+    def __init__(self, metrics, parent=None):
+        super().__init__(parent)
+        self.metrics = metrics
+        self.init_ui()
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(REFRESH_INTERVAL)
+
+    def init_ui(self):
+        layout = QVBoxLayout()
+
+        self.table = QTableWidget(0, len(COLUMNS))
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionMode(QAbstractItemView.NoSelection)
+        layout.addWidget(self.table)
+
+        controls = QHBoxLayout()
+        controls.addWidget(QLabel("Percentiler over de seneste målinger, rater over 10 s"))
+        controls.addStretch()
+        reset_btn = QPushButton("Nulstil")
+        reset_btn.clicked.connect(self.reset)
+        controls.addWidget(reset_btn)
+        export_btn = QPushButton("Eksportér...")
+        export_btn.clicked.connect(self.export)
+        controls.addWidget(export_btn)
+        layout.addLayout(controls)
+
+        self.setLayout(layout)
+
+    def rows(self):
+        snapshot = self.metrics.snapshot()
+        rows = []
+        for name, rate in snapshot['rates'].items():
+            rows.append((name, format_rate(name, rate), [], None))
+        for name, value in snapshot['counters'].items():
+            rows.append((name, format_value(name, value), [], None))
+        for name, summary in snapshot['histograms'].items():
+            percentiles = [format_value(name, summary[f'p{p}']) for p in PERCENTILES]
+            rows.append((name, f"{summary['count']} målinger", percentiles,
+                         format_value(name, summary['max'])))
+        return rows
+
+    def refresh(self):
+        if not self.isVisible():
+            return
+        rows = self.rows()
+        self.table.setRowCount(len(rows))
+        for row, (name, value, percentiles, maximum) in enumerate(rows):
+            cells = [METRIC_NAMES.get(name, name), value] + percentiles
+            cells += [""] * (len(PERCENTILES) + 2 - len(cells))
+            cells.append(maximum or "")
+            for column, text in enumerate(cells):
+                item = self.table.item(row, column)
+                if item is None:
+                    self.table.setItem(row, column, QTableWidgetItem(text))
+                elif item.text() != text:
+                    item.setText(text)
+
+    def reset(self):
+        self.metrics.reset()
+        self.refresh()
+
+    def export(self):
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Eksportér målinger", "brewcontrol-metrics.prom",
+            "Prometheus (*.prom);;JSON (*.json)")
+        if not path:
+            return
+        try:
+            export(self.metrics, path)
+        except OSError as e:
+            QMessageBox.warning(self, "Fejl", f"Kunne ikke gemme målinger: {str(e)}")
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
@@ -0,0 +1,292 @@
+"""Offline what-if runs of the thermostats' control loops.
+
+Runs the three controller types of the firmware - PID, Simple with
+hysteresis and Manual - against a ThermalPlant, for many parameter
+combinations at once. Every combination is one element of numpy arrays
+stepped together, so a sweep of thousands takes seconds:
+
+    python plant_sim.py --plant 1 --setpoint 66 --kp 5,10,20,40 --ki 0.01:0.2:20 --kd 0,200,500
+    python plant_sim.py --plant 2 --setpoint 66 --type simple --hysteresis 0.2:2:10
+
+The control cycle follows PIDController.cpp and the simulator's _Pid: once
+per UPDATE_INTERVAL the controller reads the kettle, and its output (0-255)
+drives the heater from then until the next cycle. The kettle is the same
+first order plant with dead time the simulator uses, or one fitted by
+autotune (from_model). Each run reports how far it overshoots the
+setpoint, when it gets there and settles, the integrated error and the
+energy the heater used.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from simulator import (CONTROLLER_MANUAL, CONTROLLER_PID, CONTROLLER_SIMPLE, UPDATE_INTERVAL,
+                       ThermalPlant, default_plants, pid_defaults)
+
+# Within this many °C of the setpoint counts as there
+SETTLING_BAND = 0.5
+# The heating element at full output, in watts, for the energy figures
+HEATER_POWER = 3000.0
+
+# Parameters that can be swept, with the firmware's configuration names
+CONFIG_PARAMETERS = ('type', 'kp', 'ki', 'kd', 'setpoint', 'hysteresis', 'manualOutput',
+                     'outputMin', 'outputMax')
+PLANT_PARAMETERS = ('gain', 'tau', 'dead_time', 'ambient', 'temperature')
+
+CONTROLLER_TYPES = {'pid': CONTROLLER_PID, 'simple': CONTROLLER_SIMPLE, 'manual': CONTROLLER_MANUAL}
+
+# What results can be sorted by; smaller is better for all of them
+METRICS = ('overshoot', 'rise_time', 'settling_time', 'iae', 'energy', 'switches')
+
+
+def from_model(model, ambient=None):
+    """ThermalPlant for an FopdtModel fitted by autotune.
+
+    The model's gain is per output unit and its offset is the temperature
+    at zero output, which is where the plant starts unless told otherwise.
+    """
+    return ThermalPlant(gain=model.gain * 255.0, tau=model.tau, dead_time=model.dead_time,
+                        ambient=model.offset if ambient is None else ambient)
+
+
+class SweepResult:
+    """Parameters and metrics of a batch of runs, as arrays by name.
+
+    Times are in seconds and NaN where the run never got there, iae is in
+    °C·s, energy in kWh and switches counts the Simple controller's relay
+    turning on or off.
+    """
+
+    def __init__(self, parameters, metrics, temperatures=None, dt=UPDATE_INTERVAL):
+        self.parameters = parameters
+        self.metrics = metrics
+        # Temperature of every run after every cycle, if recorded
+        self.temperatures = temperatures
+        self.dt = dt
+
+    def __len__(self):
+        return len(self.metrics['iae'])
+
+    def row(self, index):
+        row = {name: values[index].item() for name, values in self.parameters.items()}
+        row.update((name, values[index].item()) for name, values in self.metrics.items())
+        return row
+
+    def rank(self, by='iae', limit=10, max_overshoot=None):
+        """The best runs by one metric, as dicts of parameters and metrics.
+
+        Runs overshooting by more than max_overshoot °C are left out, and
+        runs that never got there (NaN) come last.
+        """
+        if by not in self.metrics:
+            raise ValueError(f"Unknown metric {by!r}")
+        values = self.metrics[by]
+        keep = np.ones(len(self), dtype=bool)
+        if max_overshoot is not None:
+            keep &= self.metrics['overshoot'] <= max_overshoot
+        indices = np.flatnonzero(keep)
+        order = indices[np.argsort(np.where(np.isnan(values[indices]), np.inf, values[indices]),
+                                   kind='stable')]
+        return [self.row(index) for index in order[:limit]]
+
+
+def simulate(plant, config, duration, dt=UPDATE_INTERVAL, band=SETTLING_BAND,
+             heater_power=HEATER_POWER, noise=0.0, seed=None, record=False):
+    """Run every combination in config against plant for duration seconds.
+
+    config maps the firmware's configuration names to scalars or arrays;
+    missing ones default as on a fresh board. plant is a ThermalPlant whose
+    attributes may be arrays as well, e.g. to check a tuning against a
+    range of time constants. Everything is broadcast to one batch. noise
+    adds Gaussian sensor noise of that many °C.
+    """
+    values = dict(pid_defaults())
+    values.update(config)
+    parameters = {name: np.asarray(values[name], dtype=float) for name in CONFIG_PARAMETERS}
+    parameters.update((name, np.asarray(getattr(plant, name), dtype=float)) for name in PLANT_PARAMETERS)
+    names = list(parameters)
+    arrays = np.broadcast_arrays(*parameters.values())
+    parameters = {name: np.array(array, dtype=float).ravel() for name, array in zip(names, arrays)}
+    count = len(parameters['kp'])
+
+    p = parameters
+    kind = p['type'].astype(int)
+    is_pid = kind == CONTROLLER_PID
+    is_simple = kind == CONTROLLER_SIMPLE
+    low, high = p['outputMin'], p['outputMax']
+    ki_dt, kd_dt = p['ki'] * dt, p['kd'] / dt
+    manual = np.clip(p['manualOutput'], low, high)
+    simple_off = np.clip(0.0, low, high)
+    decay = np.exp(-dt / p['tau'])
+    boiling_point = getattr(plant, 'boiling_point', np.inf)
+
+    # Like ThermalPlant, a power reaches the sensor once dead_time has passed
+    delays = np.ceil(p['dead_time'] / dt - 1e-9).astype(int)
+    history = np.zeros((delays.max() + 1, count))
+    rows = np.arange(count)
+
+    temperature = p['temperature'].copy()
+    output_sum = np.zeros(count)
+    last_input = None
+    simple_on = np.zeros(count, dtype=bool)
+    rng = np.random.default_rng(seed) if noise else None
+
+    steps = int(round(duration / dt))
+    peak = np.full(count, -np.inf)
+    rise_time = np.full(count, np.nan)
+    last_outside = np.full(count, -1)
+    iae = np.zeros(count)
+    work = np.zeros(count)
+    switches = np.zeros(count, dtype=int)
+    temperatures = np.empty((steps, count), dtype=np.float32) if record else None
+
+    for k in range(steps):
+        measured = temperature + rng.normal(0.0, noise, count) if noise else temperature
+        error = p['setpoint'] - measured
+
+        # PID_v1: proportional on error, derivative on measurement, the
+        # integral clamped to the output limits
+        d_input = 0.0 if last_input is None else measured - last_input
+        last_input = measured
+        output_sum = np.clip(output_sum + ki_dt * error, low, high)
+        pid = np.clip(p['kp'] * error + output_sum - kd_dt * d_input, low, high)
+
+        turned_on = ~simple_on & (error > p['hysteresis'])
+        turned_off = simple_on & (error < -p['hysteresis'])
+        simple_on ^= turned_on | turned_off
+        switches += (turned_on | turned_off) & is_simple
+        simple = np.where(simple_on, high, simple_off)
+
+        output = np.where(is_pid, pid, np.where(is_simple, simple, manual))
+        power = output / 255.0
+        work += power
+
+        history[k % len(history)] = power
+        arrived = history[(k - delays) % len(history), rows]
+        if k < delays.max():
+            # Before the dead time has passed the heater was off
+            arrived = np.where(k >= delays, arrived, 0.0)
+        target = p['ambient'] + p['gain'] * arrived
+        temperature = np.minimum(target + (temperature - target) * decay, boiling_point)
+
+        if record:
+            temperatures[k] = temperature
+        deviation = temperature - p['setpoint']
+        np.maximum(peak, deviation, out=peak)
+        reached = np.isnan(rise_time) & (deviation >= -band)
+        rise_time[reached] = (k + 1) * dt
+        last_outside[np.abs(deviation) > band] = k
+        iae += np.abs(deviation) * dt
+
+    settling_time = (last_outside + 1) * dt
+    settling_time[last_outside == steps - 1] = np.nan
+    metrics = {
+        'overshoot': np.maximum(peak, 0.0),
+        'rise_time': rise_time,
+        'settling_time': settling_time.astype(float),
+        'iae': iae,
+        'energy': work * dt * heater_power / 3.6e6,
+        'switches': switches,
+        'final_temperature': temperature,
+    }
+    return SweepResult(parameters, metrics, temperatures, dt)
+
+
+def sweep(plant, duration, dt=UPDATE_INTERVAL, **values):
+    """Simulate every combination of the given parameter values.
+
+    Each keyword is a configuration or plant parameter with a value or a
+    sequence of values, e.g. sweep(plant, 3600, setpoint=66, kp=[5, 10],
+    ki=np.linspace(0.01, 0.2, 20)); the remaining keywords of simulate()
+    are passed on.
+    """
+    options = {name: values.pop(name) for name in ('band', 'heater_power', 'noise', 'seed', 'record')
+               if name in values}
+    unknown = set(values) - set(CONFIG_PARAMETERS) - set(PLANT_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+    names = list(values)
+    grids = np.meshgrid(*(np.atleast_1d(np.asarray(values[name], dtype=float)) for name in names),
+                        indexing='ij')
+    grid = {name: array.ravel() for name, array in zip(names, grids)}
+
+    config = {name: array for name, array in grid.items() if name in CONFIG_PARAMETERS}
+    plant_values = {name: grid.get(name, getattr(plant, name)) for name in PLANT_PARAMETERS}
+    batch = ThermalPlant(ambient=plant.ambient, boiling_point=plant.boiling_point)
+    for name, value in plant_values.items():
+        setattr(batch, name, value)
+    return simulate(batch, config, duration, dt, **options)
+
+
+def parse_values(text):
+    """'5' or '5,10,20' or 'start:stop:count' (evenly spaced, inclusive)"""
+    if ':' in text:
+        start, stop, count = text.split(':')
+        return np.linspace(float(start), float(stop), int(count))
+    return [float(value) for value in text.split(',')]
+
+
+def format_time(seconds):
+    return "--" if np.isnan(seconds) else f"{seconds / 60:.1f} min"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep controller settings against a simulated kettle")
+    parser.add_argument('--plant', type=int, choices=(1, 2, 3), default=1,
+                        help="kettle of the simulator to start from (default: 1)")
+    parser.add_argument('--gain', type=parse_values, help="°C above ambient at full output")
+    parser.add_argument('--tau', type=parse_values, help="time constant in seconds")
+    parser.add_argument('--dead-time', type=parse_values, help="seconds")
+    parser.add_argument('--ambient', type=float)
+    parser.add_argument('--start', type=float, help="starting temperature (default: ambient)")
+    parser.add_argument('--type', choices=CONTROLLER_TYPES, default='pid')
+    for name in ('setpoint', 'kp', 'ki', 'kd', 'hysteresis', 'manual-output', 'output-max'):
+        parser.add_argument(f'--{name}', type=parse_values, help="value, list a,b,c or start:stop:count")
+    parser.add_argument('--duration', type=float, default=120.0, help="minutes (default: 120)")
+    parser.add_argument('--band', type=float, default=SETTLING_BAND, help="settling band in °C")
+    parser.add_argument('--heater-power', type=float, default=HEATER_POWER, help="watts")
+    parser.add_argument('--noise', type=float, default=0.0, help="sensor noise in °C")
+    parser.add_argument('--sort', choices=METRICS, default='iae')
+    parser.add_argument('--max-overshoot', type=float, help="leave out runs overshooting more")
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    plant = default_plants()[args.plant - 1]
+    if args.ambient is not None:
+        plant.ambient = args.ambient
+    plant.temperature = plant.ambient if args.start is None else args.start
+    values = {'type': CONTROLLER_TYPES[args.type]}
+    for option, name in (('gain', 'gain'), ('tau', 'tau'), ('dead_time', 'dead_time'),
+                         ('setpoint', 'setpoint'), ('kp', 'kp'), ('ki', 'ki'), ('kd', 'kd'),
+                         ('hysteresis', 'hysteresis'), ('manual_output', 'manualOutput'),
+                         ('output_max', 'outputMax')):
+        value = getattr(args, option)
+        if value is not None:
+            values[name] = value
+
+    started = time.perf_counter()
+    result = sweep(plant, args.duration * 60, band=args.band, heater_power=args.heater_power,
+                   noise=args.noise, **values)
+    elapsed = time.perf_counter() - started
+    print(f"{len(result)} kørsler à {args.duration:g} min simuleret på {elapsed:.2f} s")
+
+    swept = [name for name in values if np.size(values[name]) > 1]
+    rows = result.rank(args.sort, args.top, args.max_overshoot)
+    header = swept + ["oversving", "stigetid", "indsvingning", "IAE", "energi"]
+    if args.type == 'simple':
+        header.append("skift")
+    print("  ".join(f"{name:>12}" for name in header))
+    for row in rows:
+        cells = [f"{row[name]:12.4g}" for name in swept]
+        cells += [f"{row['overshoot']:10.2f}°C", f"{format_time(row['rise_time']):>12}",
+                  f"{format_time(row['settling_time']):>12}", f"{row['iae'] / 60:8.1f}°C·min",
+                  f"{row['energy']:8.2f} kWh"]
+        if args.type == 'simple':
+            cells.append(f"{row['switches']:12d}")
+        print("  ".join(cells))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,78 @@
+import time
+
+# Controller state reported while the firmware runs autotune
+STATE_TUNE = 2
+
+
+class PollScheduler:
+    """Chooses how long to wait before the next getStatus.
+
+    The interval drops to min_interval as soon as a temperature or setpoint
+    moves, an alarm is active or a controller is autotuning, and otherwise
+    backs off geometrically towards max_interval while everything is stable.
+    """
+
+    def __init__(self, base_interval=2.0, min_interval=0.5, max_interval=10.0,
+                 backoff=1.5, change_threshold=0.2, rate_threshold=0.01, noise_band=0.1):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        # Temperature change (°C) or rate (°C/s) counted as movement; changes
+        # inside the noise band are ignored whatever the rate
+        self.change_threshold = change_threshold
+        self.rate_threshold = rate_threshold
+        self.noise_band = noise_band
+        self.reset()
+
+    def reset(self):
+        self.interval = self.base_interval
+        self.last_time = None
+        self.last_temps = {}
+        self.last_setpoints = {}
+
+    def observe(self, frame, now=None):
+        """Update the interval from a status frame and return it in seconds"""
+        if now is None:
+            now = time.monotonic()
+        if 'thermostats' not in frame and 'sensors' not in frame:
+            return self.interval
+
+        temps = {}
+        for sensor in frame.get('sensors', ()):
+            temps[('sensor', sensor.get('sensor_id'))] = sensor.get('temperature', 0)
+        setpoints = {}
+        for i, thermostat in enumerate(frame.get('thermostats', ())):
+            key = thermostat.get('regulator_id', i)
+            temps[('thermostat', key)] = thermostat.get('currentTemp', 0)
+            setpoints[key] = thermostat.get('setpoint', 0)
+
+        if self.last_time is None:
+            busy = True
+        else:
+            busy = self._moving(temps, max(now - self.last_time, 1e-3))
+            busy = busy or setpoints != self.last_setpoints
+        busy = busy or any(alarm.get('level', 0) > 0 for alarm in frame.get('alarms', ()))
+        busy = busy or any(t.get('state') == STATE_TUNE for t in frame.get('thermostats', ()))
+
+        if busy:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+
+        self.last_time = now
+        self.last_temps = temps
+        self.last_setpoints = setpoints
+        return self.interval
+
+    def _moving(self, temps, elapsed):
+        for key, temp in temps.items():
+            previous = self.last_temps.get(key)
+            if previous is None:
+                return True
+            change = abs(temp - previous)
+            if change < self.noise_band:
+                continue
+            if change >= self.change_threshold or change / elapsed >= self.rate_threshold:
+                return True
+        return False
@@ -0,0 +1,246 @@
+"""Early warnings before a thermostat reaches its alarm limits.
+
+The firmware raises a warning or an alarm once the temperature is past a
+limit. PredictiveAlarms looks at where each thermostat's temperature is
+heading instead: it keeps a least-squares slope over the last RATE_WINDOW
+seconds and predicts when the temperature will reach each of the limits
+configured in the firmware (config.alarms in the status) or given with
+set_limits(). A prediction is raised when a limit is less than its
+horizon away at the current rate, and cleared once it is well beyond it
+again, or when the limit is reached and the firmware's own alarm takes
+over.
+
+Every sample costs O(1): the slope comes from running sums, updated as
+samples enter and leave the window, so it runs on every frame.
+"""
+from collections import deque, namedtuple
+
+# Seconds the rate of change is taken over
+RATE_WINDOW = 120.0
+# Seconds of samples needed before anything is predicted
+MIN_SPAN = 30.0
+# Slower than this (°C per second) counts as steady
+MIN_RATE = 0.05 / 60
+# A kettle does not move this many °C between two samples; such a jump,
+# e.g. from the 0 the firmware reports before its first reading or a
+# thermostat moved to another sensor, starts the window afresh
+MAX_JUMP = 5.0
+
+# The firmware's alarm levels
+LEVEL_WARNING = 1
+LEVEL_ALARM = 2
+
+# How far ahead a limit is warned about, in seconds, by level
+HORIZONS = {LEVEL_WARNING: 300.0, LEVEL_ALARM: 600.0}
+# A prediction clears once the limit is this many horizons away
+CLEAR_MARGIN = 1.5
+# Once a limit has been reached it is not predicted again until the
+# temperature is this many °C back from it, so hovering at a limit the
+# firmware already alarms on does not flap
+REARM_DISTANCE = 2.0
+
+# The window's time origin moves forward after this many seconds, so the
+# running sums stay small and exact
+REBASE_INTERVAL = 3600.0
+
+# Limits at or beyond this are the firmware's way of switching them off
+DISABLED_LIMIT = 999.0
+INVALID_TEMPERATURE = -999.0
+
+# Limit name in config.alarms, its level and the direction it is reached in
+LIMITS = (
+    ('warningHigh', LEVEL_WARNING, 1),
+    ('alarmHigh', LEVEL_ALARM, 1),
+    ('warningLow', LEVEL_WARNING, -1),
+    ('alarmLow', LEVEL_ALARM, -1),
+)
+
+# Display names of the limits, as the GUI labels them
+LIMIT_NAMES = {
+    'warningHigh': "advarsel høj",
+    'alarmHigh': "alarm høj",
+    'warningLow': "advarsel lav",
+    'alarmLow': "alarm lav",
+}
+
+# active is False when a prediction clears; rate is in °C per second, eta
+# the seconds until the limit is reached (None once it no longer will be)
+Prediction = namedtuple('Prediction', ['regulator_id', 'limit', 'level', 'active', 'threshold',
+                                       'temperature', 'rate', 'eta'])
+
+
+class SlidingSlope:
+    """Least-squares line through the samples of the last window seconds,
+    kept as running sums so adding a sample is O(1) amortised"""
+
+    def __init__(self, window=RATE_WINDOW):
+        self.window = window
+        self.samples = deque()
+        self.clear()
+
+    def clear(self):
+        self.samples.clear()
+        self.origin = None
+        self.sum_t = self.sum_y = self.sum_tt = self.sum_ty = 0.0
+
+    def add(self, t, y):
+        if self.origin is None:
+            self.origin = t
+        elif t - self.origin > REBASE_INTERVAL:
+            self._rebase(t - self.window)
+        x = t - self.origin
+        self.samples.append((x, y))
+        self._sum(x, y, 1)
+        while x - self.samples[0][0] > self.window:
+            self._sum(*self.samples.popleft(), -1)
+
+    @property
+    def last_time(self):
+        return self.samples[-1][0] + self.origin if self.samples else None
+
+    @property
+    def last_value(self):
+        return self.samples[-1][1] if self.samples else None
+
+    @property
+    def span(self):
+        return self.samples[-1][0] - self.samples[0][0] if self.samples else 0.0
+
+    def slope(self):
+        n = len(self.samples)
+        denominator = n * self.sum_tt - self.sum_t * self.sum_t
+        if n < 2 or denominator <= 0:
+            return None
+        return (n * self.sum_ty - self.sum_t * self.sum_y) / denominator
+
+    def level(self, slope):
+        """The line's value at the newest sample, a smoothed temperature"""
+        n = len(self.samples)
+        return self.sum_y / n + slope * (self.samples[-1][0] - self.sum_t / n)
+
+    def _sum(self, x, y, sign):
+        self.sum_t += sign * x
+        self.sum_y += sign * y
+        self.sum_tt += sign * x * x
+        self.sum_ty += sign * x * y
+
+    def _rebase(self, origin):
+        shift = origin - self.origin
+        samples = [(x - shift, y) for x, y in self.samples]
+        self.clear()
+        self.origin = origin
+        for x, y in samples:
+            self.samples.append((x, y))
+            self._sum(x, y, 1)
+
+
+class PredictiveAlarms:
+    """Predicts, per thermostat, when the temperature will cross its limits.
+
+    Call update() with every status snapshot and its time in seconds, the
+    regulator's own where frames carry it; it returns the predictions that
+    were raised or cleared. active holds the
+    raised ones by (regulator_id, limit), kept up to date.
+    """
+
+    def __init__(self, window=RATE_WINDOW, horizons=None):
+        self.window = window
+        self.horizons = dict(HORIZONS if horizons is None else horizons)
+        self.channels = {}
+        self.overrides = {}
+        self.active = {}
+        self.reached = set()
+
+    def set_limits(self, regulator_id, limits):
+        """Use these limits (a dict like config.alarms' records) instead of
+        the firmware's for one thermostat; None goes back to the firmware's"""
+        if limits is None:
+            self.overrides.pop(regulator_id, None)
+        else:
+            self.overrides[regulator_id] = dict(limits)
+
+    def rate(self, regulator_id):
+        """Current rate of change in °C per second, or None if not known yet"""
+        channel = self.channels.get(regulator_id)
+        if channel is None or channel.span < MIN_SPAN:
+            return None
+        return channel.slope()
+
+    def reset(self):
+        changes = [self._clear(key) for key in list(self.active)]
+        self.channels = {}
+        self.reached = set()
+        return changes
+
+    def update(self, snapshot, now):
+        changes = []
+        configured = snapshot.frame.get('config', {}).get('alarms') or []
+        for regulator_id, thermostat in snapshot.thermostats.items():
+            channel = self.channels.get(regulator_id)
+            if channel is None:
+                channel = self.channels[regulator_id] = SlidingSlope(self.window)
+            temperature = thermostat.get('currentTemp')
+            if temperature is None or temperature <= INVALID_TEMPERATURE:
+                # Nothing to go on with a failed sensor
+                channel.clear()
+                self.reached = {key for key in self.reached if key[0] != regulator_id}
+                changes += self._clear_channel(regulator_id)
+                continue
+            last = channel.last_time
+            if last is not None and now <= last:
+                if now == last:
+                    continue
+                # The regulator restarted and its clock with it
+                channel.clear()
+            elif last is not None and abs(temperature - channel.last_value) > MAX_JUMP:
+                channel.clear()
+            channel.add(now, temperature)
+            limits = self.overrides.get(regulator_id)
+            if limits is None and regulator_id < len(configured):
+                limits = configured[regulator_id]
+            changes += self._evaluate(regulator_id, channel, limits or {})
+        return changes
+
+    def _evaluate(self, regulator_id, channel, limits):
+        changes = []
+        slope = channel.slope() if channel.span >= MIN_SPAN else None
+        if slope is None:
+            return changes
+        temperature = channel.level(slope)
+        enabled = limits.get('enabled', True)
+        for name, level, direction in LIMITS:
+            key = (regulator_id, name)
+            threshold = limits.get(name)
+            if not enabled or threshold is None or abs(threshold) >= DISABLED_LIMIT:
+                if key in self.active:
+                    changes.append(self._clear(key))
+                continue
+            distance = direction * (threshold - temperature)
+            approach = direction * slope
+            if distance <= 0:
+                self.reached.add(key)
+            elif distance > REARM_DISTANCE:
+                self.reached.discard(key)
+            active = key in self.active
+            # Once raised, any approach counts; the horizon margin decides
+            eta = None
+            if distance > 0 and approach > (0.0 if active else MIN_RATE):
+                eta = distance / approach
+            horizon = self.horizons[level]
+            prediction = Prediction(regulator_id, name, level, True, threshold, temperature, slope, eta)
+            if active:
+                if eta is None or eta > horizon * CLEAR_MARGIN:
+                    changes.append(self._clear(key, prediction))
+                else:
+                    self.active[key] = prediction
+            elif eta is not None and eta <= horizon and key not in self.reached:
+                self.active[key] = prediction
+                changes.append(prediction)
+        return changes
+
+    def _clear_channel(self, regulator_id):
+        return [self._clear(key) for key in list(self.active) if key[0] == regulator_id]
+
+    def _clear(self, key, latest=None):
+        prediction = self.active.pop(key)
+        return (latest or prediction)._replace(active=False)
@@ -0,0 +1,477 @@
+"""Timed temperature programs - step mashes and the like - run on the
+regulator's thermostats.
+
+A recipe is a JSON file with a program of steps for each thermostat:
+
+    {
+      "name": "Trinmæskning",
+      "heatingRate": 1.5,
+      "programs": [
+        {"thermostat": 2, "steps": [
+          {"name": "Indmæskning", "setpoint": 52, "hold": 15},
+          {"name": "Maltoserast", "setpoint": 63, "ramp": 1.0, "hold": 40},
+          {"name": "Dextrinrast", "setpoint": 72, "hold": 20, "preheat": true},
+          {"name": "Udmæskning", "setpoint": 78, "hold": 10}
+        ]},
+        {"thermostat": 1, "steps": [
+          {"name": "Skyllevand", "setpoint": 78, "at": "07:30"}
+        ]}
+      ]
+    }
+
+A step has a setpoint in °C and may have:
+
+- ramp: move the setpoint there at this many °C per minute, not at once,
+- hold: minutes to stay at the setpoint (default 0),
+- wait: start the hold only once the temperature is within tolerance
+  (default 0.5 °C) of the setpoint (default true),
+- at: minutes after the start, or a time of day "HH:MM", by which the
+  setpoint should be reached; heating starts as long before as it takes,
+- preheat: start heating for this step before the previous hold ends, so
+  the rest begins when the previous one ends.
+
+For at and preheat the time it takes to heat is planned with heatingRate
+(°C per minute, for the recipe or one program, default 1) until the
+kettle has shown how fast it heats at full output.
+
+Like AutoTuner, RecipeRunner does no I/O of its own: it is given a send
+callable and every status frame, and sends a setConfig with just the
+setpoint, only when the setpoint has to change.
+
+    python recipe.py --port socket://localhost:7000 trinmaeskning.json
+"""
+import argparse
+import json
+import math
+import time
+from collections import namedtuple
+
+from status_model import StatusSnapshot
+
+# Setpoints are sent rounded to this
+SETPOINT_RESOLUTION = 0.1
+# A ramp moves the setpoint in steps of this many °C, one command each;
+# the kettle's lag smooths them out
+RAMP_STEP = 0.5
+DEFAULT_TOLERANCE = 0.5
+# °C per minute, until the kettle has been seen heating
+DEFAULT_HEATING_RATE = 1.0
+
+# From this output the heater counts as full on when learning the heating
+# rate, which is measured over windows of RATE_WINDOW seconds
+HEATING_OUTPUT = 230.0
+RATE_WINDOW = 120.0
+RATE_SMOOTHING = 0.3
+
+# How long the regulator may report another setpoint than the one sent
+# before it is sent again, e.g. after a reset or a lost command
+RESYNC_INTERVAL = 10.0
+
+# Sensor value the firmware reports for a failed sensor
+INVALID_TEMPERATURE = -999.0
+
+PHASE_WAITING = 'waiting'  # until it is time to heat for the step's at
+PHASE_RAMP = 'ramp'        # moving the setpoint
+PHASE_HEAT = 'heat'        # waiting for the temperature
+PHASE_HOLD = 'hold'
+PHASE_DONE = 'done'
+
+Step = namedtuple('Step', 'name setpoint ramp hold wait tolerance at preheat')
+Program = namedtuple('Program', 'regulator_id steps heating_rate')
+Recipe = namedtuple('Recipe', 'name programs')
+
+
+def _number(value, what, minimum=None):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{what} skal være et tal")
+    if minimum is not None and value < minimum:
+        raise ValueError(f"{what} må ikke være under {minimum:g}")
+    return float(value)
+
+
+def _parse_at(value, what):
+    if isinstance(value, str):
+        try:
+            hours, minutes = (int(part) for part in value.split(':'))
+        except ValueError:
+            raise ValueError(f"{what} skal være minutter eller et klokkeslæt TT:MM") from None
+        if not (0 <= hours < 24 and 0 <= minutes < 60):
+            raise ValueError(f"{what} er ikke et klokkeslæt")
+        return value
+    return _number(value, what, 0) * 60
+
+
+def parse_recipe(data):
+    """Recipe from the decoded JSON. Raises ValueError, in words for the
+    brewer, when something is missing or wrong."""
+    if not isinstance(data, dict) or not isinstance(data.get('programs'), list):
+        raise ValueError("Opskriften mangler programs")
+    heating_rate = _number(data.get('heatingRate', DEFAULT_HEATING_RATE), "heatingRate", 0.01)
+    programs = []
+    for program in data['programs']:
+        thermostat = program.get('thermostat') if isinstance(program, dict) else None
+        if not isinstance(thermostat, int) or thermostat < 1:
+            raise ValueError("Hvert program skal have et termostatnummer fra 1")
+        if any(p.regulator_id == thermostat - 1 for p in programs):
+            raise ValueError(f"Termostat {thermostat} har mere end ét program")
+        if not program.get('steps'):
+            raise ValueError(f"Programmet for termostat {thermostat} har ingen trin")
+        steps = []
+        for number, step in enumerate(program['steps'], 1):
+            what = f"Termostat {thermostat}, trin {number}"
+            if not isinstance(step, dict) or 'setpoint' not in step:
+                raise ValueError(f"{what}: mangler setpoint")
+            ramp = step.get('ramp')
+            steps.append(Step(
+                name=str(step.get('name', f"Trin {number}")),
+                setpoint=_number(step['setpoint'], f"{what}: setpoint"),
+                ramp=None if ramp is None else _number(ramp, f"{what}: ramp", 0.01),
+                hold=_number(step.get('hold', 0), f"{what}: hold", 0) * 60,
+                wait=bool(step.get('wait', True)),
+                tolerance=_number(step.get('tolerance', DEFAULT_TOLERANCE), f"{what}: tolerance", 0),
+                at=None if step.get('at') is None else _parse_at(step['at'], f"{what}: at"),
+                preheat=bool(step.get('preheat', False))))
+        rate = _number(program.get('heatingRate', heating_rate), f"Termostat {thermostat}: heatingRate", 0.01)
+        programs.append(Program(thermostat - 1, steps, rate / 60))
+    if not programs:
+        raise ValueError("Opskriften har ingen programmer")
+    return Recipe(str(data.get('name', "Opskrift")), programs)
+
+
+def load_recipe(path):
+    with open(path, encoding='utf-8') as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Ugyldig JSON: {e}") from None
+    return parse_recipe(data)
+
+
+def resolve_at(at, started):
+    """Clock time of a step's at: seconds after started, or the next time
+    the time of day comes round"""
+    if not isinstance(at, str):
+        return started + at
+    hours, minutes = (int(part) for part in at.split(':'))
+    day = time.localtime(started)
+    due = time.mktime((day.tm_year, day.tm_mon, day.tm_mday, hours, minutes, 0, 0, 0, -1))
+    if due < started:
+        due = time.mktime((day.tm_year, day.tm_mon, day.tm_mday + 1, hours, minutes, 0, 0, 0, -1))
+    return due
+
+
+class HeatingRate:
+    """How fast a kettle heats with the heater full on, in °C per second.
+
+    Learnt from windows of RATE_WINDOW seconds at an output of at least
+    HEATING_OUTPUT. The first window after the heater comes on is left out,
+    as the dead time would make it look slow.
+    """
+
+    def __init__(self, initial):
+        self.rate = initial
+        self.measured = False
+        self.window = None
+        self.warmed_up = False
+
+    def observe(self, now, temperature, output):
+        if output < HEATING_OUTPUT:
+            self.window = None
+            self.warmed_up = False
+            return
+        if self.window is None:
+            self.window = (now, temperature)
+            return
+        start, start_temperature = self.window
+        if now - start < RATE_WINDOW:
+            return
+        slope = (temperature - start_temperature) / (now - start)
+        self.window = (now, temperature)
+        if not self.warmed_up:
+            self.warmed_up = True
+        elif slope > 0:
+            self.rate = slope if not self.measured else self.rate + RATE_SMOOTHING * (slope - self.rate)
+            self.measured = True
+
+
+class ProgramRun:
+    """Where one thermostat is in its program"""
+
+    def __init__(self, program):
+        self.program = program
+        self.index = 0
+        self.phase = None
+        self.phase_time = 0.0  # seconds in the phase, pauses not counted
+        self.origin = None     # setpoint the step started from
+        self.due = None        # when the step's at falls
+        self.setpoint = None   # what the program wants now
+        self.sent = None
+        self.sent_at = None
+        self.temperature = None
+        self.reported = None   # setpoint the regulator reports
+        self.heating = HeatingRate(program.heating_rate)
+
+    @property
+    def regulator_id(self):
+        return self.program.regulator_id
+
+    @property
+    def step(self):
+        steps = self.program.steps
+        return steps[self.index] if self.index < len(steps) else None
+
+    @property
+    def done(self):
+        return self.phase == PHASE_DONE
+
+    def lead(self, origin, step):
+        """Seconds it takes to heat from origin to step's setpoint"""
+        rise = step.setpoint - origin
+        if rise <= 0:
+            return 0.0
+        rate = self.heating.rate
+        if step.ramp is not None:
+            rate = min(rate, step.ramp / 60)
+        return rise / rate
+
+
+class RecipeRunner:
+    """Runs a Recipe's programs side by side.
+
+    send(command) queues a command and returns something other than None
+    when it could be sent, e.g. AcquisitionCore.send. Feed every status
+    frame (merged, as subscribers get them) to handle_frame() from one
+    thread; a program starts on the first frame with its thermostat, from
+    the setpoint the thermostat has. notify(regulator_id, text) is told
+    when a program moves on. Times come from clock, the wall clock by
+    default as a step's at may be a time of day.
+    """
+
+    def __init__(self, send, recipe, clock=time.time, notify=None):
+        self.send = send
+        self.recipe = recipe
+        self.clock = clock
+        self.notify = notify
+        self.runs = [ProgramRun(program) for program in recipe.programs]
+        self.running = False
+        self.paused = False
+        self.started = None
+        self.last = None
+
+    def run_for(self, regulator_id):
+        for run in self.runs:
+            if run.regulator_id == regulator_id:
+                return run
+        return None
+
+    def start(self):
+        self.runs = [ProgramRun(program) for program in self.recipe.programs]
+        self.started = self.clock()
+        self.last = None
+        self.paused = False
+        self.running = True
+
+    def stop(self):
+        """Stop where it is; the thermostats keep their setpoints"""
+        self.running = False
+
+    def pause(self):
+        """Hold every program where it is, e.g. to adjust by hand"""
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def skip(self, regulator_id):
+        """Move the thermostat's program on to its next step"""
+        run = self.run_for(regulator_id)
+        if self.running and run is not None and run.phase not in (None, PHASE_DONE):
+            self._tell(run, f"{run.step.name} sprunget over")
+            self._advance(run)
+
+    def handle_frame(self, frame):
+        if not self.running:
+            return
+        now = self.clock()
+        dt = 0.0 if self.last is None or self.paused else max(now - self.last, 0.0)
+        self.last = now
+        snapshot = StatusSnapshot(frame)
+        for run in self.runs:
+            thermostat = snapshot.thermostat(run.regulator_id)
+            if thermostat is None:
+                continue
+            run.reported = thermostat.get('setpoint')
+            temperature = thermostat.get('currentTemp')
+            if temperature is None or temperature <= INVALID_TEMPERATURE:
+                continue
+            run.temperature = temperature
+            run.heating.observe(now, temperature, thermostat.get('output', 0.0))
+            if self.paused:
+                continue
+            self._update(run, now, dt)
+            self._sync(run, now)
+        if all(run.done for run in self.runs):
+            self.running = False
+
+    def _update(self, run, now, dt):
+        if run.phase is None:
+            self._begin(run, run.reported if run.reported is not None else run.temperature)
+        run.phase_time += dt
+        step = run.step
+        if run.phase == PHASE_WAITING:
+            if now >= run.due - run.lead(run.origin, step):
+                self._change(run)
+        elif run.phase == PHASE_RAMP:
+            distance = step.setpoint - run.origin
+            moved = step.ramp / 60 * run.phase_time
+            if moved >= abs(distance):
+                self._reach(run)
+            else:
+                run.setpoint = run.origin + math.copysign(moved - moved % RAMP_STEP, distance)
+        elif run.phase == PHASE_HEAT:
+            if abs(run.temperature - step.setpoint) <= step.tolerance:
+                self._enter(run, PHASE_HOLD)
+                self._tell(run, f"{step.name}: {step.setpoint:.1f}°C nået")
+        elif run.phase == PHASE_HOLD:
+            left = step.hold - run.phase_time
+            following = run.program.steps[run.index + 1] if run.index + 1 < len(run.program.steps) else None
+            if (following is not None and following.preheat and following.at is None
+                    and left <= run.lead(step.setpoint, following)):
+                self._advance(run)
+            elif left <= 0:
+                self._advance(run)
+
+    def _begin(self, run, origin):
+        run.origin = origin
+        step = run.step
+        if step.at is not None:
+            run.due = resolve_at(step.at, self.started)
+            self._enter(run, PHASE_WAITING)
+        else:
+            self._change(run)
+
+    def _change(self, run):
+        step = run.step
+        if step.ramp is not None and run.origin is not None and run.origin != step.setpoint:
+            run.setpoint = run.origin
+            self._enter(run, PHASE_RAMP)
+            self._tell(run, f"{step.name}: rampe til {step.setpoint:.1f}°C")
+        else:
+            self._reach(run)
+
+    def _reach(self, run):
+        step = run.step
+        run.setpoint = step.setpoint
+        if step.wait:
+            self._enter(run, PHASE_HEAT)
+            self._tell(run, f"{step.name}: sætpunkt {step.setpoint:.1f}°C")
+        else:
+            self._enter(run, PHASE_HOLD)
+            self._tell(run, f"{step.name}: sætpunkt {step.setpoint:.1f}°C, hold {step.hold / 60:.0f} min")
+
+    def _advance(self, run):
+        origin = run.step.setpoint
+        run.index += 1
+        if run.step is None:
+            self._enter(run, PHASE_DONE)
+            self._tell(run, "programmet er færdigt")
+        else:
+            self._begin(run, origin)
+
+    def _enter(self, run, phase):
+        run.phase = phase
+        run.phase_time = 0.0
+
+    def _sync(self, run, now):
+        if run.setpoint is None:
+            return
+        value = round(round(run.setpoint / SETPOINT_RESOLUTION) * SETPOINT_RESOLUTION, 6)
+        in_place = run.reported is not None and abs(run.reported - value) < SETPOINT_RESOLUTION / 2
+        if value == run.sent:
+            if in_place or now - run.sent_at < RESYNC_INTERVAL:
+                return
+        elif in_place:
+            run.sent, run.sent_at = value, now
+            return
+        command = {"command": "setConfig", "regulator_id": run.regulator_id, "setpoint": value}
+        if self.send(command) is not None:
+            run.sent, run.sent_at = value, now
+
+    def _tell(self, run, text):
+        if self.notify is not None:
+            self.notify(run.regulator_id, text)
+
+
+def describe(run):
+    """One line about where a program is, for the GUI and the command line"""
+    step = run.step
+    if run.phase is None:
+        return "Venter på status"
+    if run.phase == PHASE_DONE:
+        return "Færdig"
+    if run.phase == PHASE_WAITING:
+        start = run.due - run.lead(run.origin, step)
+        return f"Opvarmning starter {time.strftime('%H:%M', time.localtime(start))}"
+    if run.phase == PHASE_RAMP:
+        return f"Rampe {run.setpoint:.1f} → {step.setpoint:.1f}°C"
+    if run.phase == PHASE_HEAT:
+        return f"Venter på {step.setpoint:.1f}°C ({run.temperature:.1f}°C)"
+    left = max(step.hold - run.phase_time, 0.0)
+    return f"Hold {step.setpoint:.1f}°C, {math.ceil(left / 60)} min tilbage"
+
+
+def main(argv=None):
+    from acquisition import AcquisitionCore, EVENT_FRAME
+
+    parser = argparse.ArgumentParser(description="Run a recipe on a BrewControl regulator")
+    parser.add_argument('recipe', help="recipe JSON file")
+    parser.add_argument('--port', default='COM3', help="serial port or URL (default: COM3)")
+    parser.add_argument('--baudrate', type=int, default=115200)
+    args = parser.parse_args(argv)
+
+    try:
+        recipe = load_recipe(args.recipe)
+    except (OSError, ValueError) as e:
+        print(f"Kunne ikke indlæse opskriften: {e}")
+        return 1
+
+    def notify(regulator_id, text):
+        print(f"[{time.strftime('%H:%M:%S')}] Termostat {regulator_id + 1}: {text}")
+
+    core = AcquisitionCore()
+    runner = RecipeRunner(core.send, recipe, notify=notify)
+    frames = []
+
+    def collect(event, data):
+        # The runner runs in the main thread
+        if event == EVENT_FRAME:
+            frames.append(data)
+
+    core.subscribe(collect)
+    core.connect(args.port, args.baudrate)
+    try:
+        while not core.connected and core.worker.is_alive():
+            time.sleep(0.05)
+        runner.start()
+        print(f"{recipe.name} startet")
+        last_report = 0.0
+        while runner.running:
+            time.sleep(0.1)
+            while frames:
+                runner.handle_frame(frames.pop(0))
+            if time.monotonic() - last_report >= 60:
+                last_report = time.monotonic()
+                for run in runner.runs:
+                    print(f"[{time.strftime('%H:%M:%S')}] Termostat {run.regulator_id + 1}: {describe(run)}")
+        print(f"{recipe.name} er færdig")
+        return 0
+    except KeyboardInterrupt:
+        runner.stop()
+        print("Stoppet; termostaterne beholder deres sætpunkter")
+        return 1
+    finally:
+        core.close()
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,287 @@
+import bisect
+import glob
+import heapq
+import itertools
+import math
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from collections import namedtuple
+
+MAGIC = b'BREWLOG1'
+# Magic, number of sensors, number of thermostats
+HEADER = struct.Struct('<8sHH')
+NO_LEVEL = 255
+
+Sample = namedtuple('Sample', [
+    'time',            # Unix time the frame was received
+    'temperatures',    # Per sensor, NaN when not reported
+    'health',          # Per sensor, 255 when not reported
+    'thermostat_temps',
+    'setpoints',
+    'outputs',
+    'alarm_levels',    # Per thermostat, 255 when not reported
+])
+
+
+def record_struct(n_sensors, n_thermostats):
+    return struct.Struct(
+        '<d'
+        + 'f' * n_sensors + 'B' * n_sensors
+        + 'f' * (3 * n_thermostats) + 'B' * n_thermostats
+    )
+
+
+class StatusRecorder(threading.Thread):
+    """Background writer for a full resolution history of status frames.
+
+    Frames are queued by record() and written by this thread as fixed size
+    binary records to append-only chunk files, one file per chunk_seconds
+    of wall clock time. Records are flushed and fsync'ed in batches, at the
+    latest every flush_interval seconds. Because records have a fixed size
+    and are kept in time order, query() finds a time range by binary search.
+    A wall clock set back does not break that order: such records are
+    written with the latest time already in the chunk instead.
+
+    A chunk written with another number of sensors or thermostats is left
+    alone and continued in a new part, history-<start>-<part>.brewlog.
+    """
+
+    def __init__(self, directory, n_sensors=7, n_thermostats=3, chunk_seconds=3600,
+                 flush_interval=1.0, batch_size=50):
+        super().__init__(daemon=True)
+        self.directory = directory
+        self.n_sensors = n_sensors
+        self.n_thermostats = n_thermostats
+        self.chunk_seconds = chunk_seconds
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.record_struct = record_struct(n_sensors, n_thermostats)
+        self.queue = queue.Queue()
+        self.file = None
+        self.chunk_start = None
+        self.last_time = -math.inf
+        self.records_written = 0
+        self.write_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, frame, timestamp=None):
+        """Queue a status frame for writing. Cheap enough for the GUI thread."""
+        if 'sensors' not in frame and 'thermostats' not in frame:
+            return
+        self.queue.put((time.time() if timestamp is None else timestamp, frame))
+
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        pending = []
+        last_flush = time.monotonic()
+        running = True
+        while running:
+            timeout = max(self.flush_interval - (time.monotonic() - last_flush), 0.0)
+            try:
+                item = self.queue.get(timeout=timeout if pending else None)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                running = False
+            elif item:
+                pending.append(item)
+
+            if pending and (not running or len(pending) >= self.batch_size
+                            or time.monotonic() - last_flush >= self.flush_interval):
+                try:
+                    self._write_batch(pending)
+                except OSError as e:
+                    print(f"Recorder error: {e}")
+                pending = []
+                last_flush = time.monotonic()
+
+        with self.write_lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    def _write_batch(self, batch):
+        with self.write_lock:
+            for timestamp, frame in batch:
+                # Queries bisect on time, so it never goes backwards in a file
+                timestamp = max(timestamp, self.last_time)
+                chunk_start = int(timestamp // self.chunk_seconds * self.chunk_seconds)
+                if chunk_start != self.chunk_start:
+                    self._open_chunk(chunk_start)
+                    timestamp = max(timestamp, self.last_time)
+                try:
+                    record = self._pack(timestamp, frame)
+                except (struct.error, TypeError):
+                    # Malformed values in the frame; skip it rather than the batch
+                    continue
+                self.file.write(record)
+                self.last_time = timestamp
+                self.records_written += 1
+            if self.file:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+
+    def _open_chunk(self, chunk_start):
+        if self.file:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+        layout = (MAGIC, self.n_sensors, self.n_thermostats)
+        part = 0
+        while True:
+            path = self._chunk_path(chunk_start, part)
+            header, last_time = _chunk_tail(path)
+            if last_time is not None:
+                self.last_time = max(self.last_time, last_time)
+            if header is None or header == layout:
+                break
+            # Written with another sensor or thermostat count; our records
+            # would not line up with its own
+            part += 1
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(HEADER.pack(*layout))
+        else:
+            # Drop a record torn by a crash so the file stays aligned
+            size = self.file.tell() - HEADER.size
+            torn = size % self.record_struct.size
+            if torn:
+                self.file.truncate(self.file.tell() - torn)
+                self.file.seek(0, os.SEEK_END)
+        self.chunk_start = chunk_start
+
+    def _chunk_path(self, chunk_start, part=0):
+        if part:
+            return os.path.join(self.directory, f"history-{chunk_start}-{part}.brewlog")
+        return os.path.join(self.directory, f"history-{chunk_start}.brewlog")
+
+    def _pack(self, timestamp, frame):
+        n_sensors = self.n_sensors
+        n_thermostats = self.n_thermostats
+        temps = [math.nan] * n_sensors
+        health = [NO_LEVEL] * n_sensors
+        for sensor in frame.get('sensors', ()):
+            i = sensor.get('sensor_id')
+            if isinstance(i, int) and 0 <= i < n_sensors:
+                temps[i] = sensor.get('temperature', math.nan)
+                health[i] = sensor.get('health', NO_LEVEL)
+
+        thermostat_values = [math.nan] * (3 * n_thermostats)
+        for position, thermostat in enumerate(frame.get('thermostats', ())):
+            i = thermostat.get('regulator_id', position)
+            if isinstance(i, int) and 0 <= i < n_thermostats:
+                thermostat_values[3 * i] = thermostat.get('currentTemp', math.nan)
+                thermostat_values[3 * i + 1] = thermostat.get('setpoint', math.nan)
+                thermostat_values[3 * i + 2] = thermostat.get('output', math.nan)
+
+        levels = [NO_LEVEL] * n_thermostats
+        for position, alarm in enumerate(frame.get('alarms', ())):
+            i = alarm.get('regulator_id', alarm.get('thermostatIndex', position))
+            if isinstance(i, int) and 0 <= i < n_thermostats:
+                levels[i] = alarm.get('level', NO_LEVEL)
+
+        return self.record_struct.pack(timestamp, *temps, *health, *thermostat_values, *levels)
+
+    def query(self, start, end):
+        """All samples with start <= time < end, oldest first"""
+        first_chunk = int(start // self.chunk_seconds * self.chunk_seconds)
+        chunks = []
+        for path in glob.glob(os.path.join(self.directory, 'history-*.brewlog')):
+            chunk_start, _, part = os.path.basename(path)[8:-8].partition('-')
+            try:
+                chunk_start = int(chunk_start)
+                part = int(part or 0)
+            except ValueError:
+                continue
+            if first_chunk <= chunk_start < end:
+                chunks.append((chunk_start, part, path))
+
+        samples = []
+        for chunk_start, parts in itertools.groupby(sorted(chunks), key=lambda chunk: chunk[0]):
+            # Each part is in time order on its own
+            samples.extend(heapq.merge(*(self._query_chunk(path, start, end) for _, _, path in parts),
+                                       key=lambda sample: sample.time))
+        return samples
+
+    def _query_chunk(self, path, start, end):
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return []
+            magic, n_sensors, n_thermostats = HEADER.unpack(header)
+            if magic != MAGIC:
+                return []
+            rec = record_struct(n_sensors, n_thermostats)
+            count = (os.fstat(f.fileno()).st_size - HEADER.size) // rec.size
+            if count == 0:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                times = _RecordTimes(data, HEADER.size, rec.size, count)
+                lo = bisect.bisect_left(times, start)
+                hi = bisect.bisect_left(times, end, lo)
+                body = data[HEADER.size + lo * rec.size:HEADER.size + hi * rec.size]
+
+        samples = []
+        s = n_sensors
+        t = n_thermostats
+        for values in rec.iter_unpack(body):
+            thermostat_values = values[1 + 2 * s:1 + 2 * s + 3 * t]
+            samples.append(Sample(
+                values[0],
+                values[1:1 + s],
+                values[1 + s:1 + 2 * s],
+                thermostat_values[0::3],
+                thermostat_values[1::3],
+                thermostat_values[2::3],
+                values[1 + 2 * s + 3 * t:],
+            ))
+        return samples
+
+
+class _RecordTimes:
+    """Sequence view of the record timestamps in a chunk, for bisect"""
+
+    TIME = struct.Struct('<d')
+
+    def __init__(self, data, offset, record_size, count):
+        self.data = data
+        self.offset = offset
+        self.record_size = record_size
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.TIME.unpack_from(self.data, self.offset + index * self.record_size)[0]
+
+
+def _chunk_tail(path):
+    """Header of a chunk file and the time of its last whole record; None
+    for either when there is none. A header too short to read comes back
+    as an empty tuple, which matches no layout."""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+            if not header:
+                return None, None
+            if len(header) < HEADER.size:
+                return (), None
+            header = HEADER.unpack(header)
+            if header[0] != MAGIC:
+                return header, None
+            rec = record_struct(header[1], header[2])
+            count = (os.fstat(f.fileno()).st_size - HEADER.size) // rec.size
+            if count == 0:
+                return header, None
+            f.seek(HEADER.size + (count - 1) * rec.size)
+            return header, _RecordTimes.TIME.unpack(f.read(_RecordTimes.TIME.size))[0]
+    except FileNotFoundError:
+        return None, None
@@ -0,0 +1,264 @@
+"""Running statistics on every sensor, to catch a probe going bad before
+it fails outright.
+
+The firmware only says whether a sensor answered. SensorHealth follows
+each one over time, in constant time and memory per frame:
+
+- the temperature's mean and spread since the link came up (Welford),
+- the noise: the spread of the change from one reading to the next,
+  weighted towards the last NOISE_HALF_LIFE readings, so heating and
+  cooling do not count as noise,
+- how long the value has not changed at all, as a stuck probe or a dead
+  converter repeats its last value,
+- the share of the last half hour or so the sensor was failed or timed
+  out,
+- for groups of sensors that should read the same (set_groups), how far
+  each is from the group's median.
+
+Each of these raises an issue past its limit and clears it, with some
+hysteresis, once back within it.
+"""
+import math
+import threading
+from collections import namedtuple
+
+# Readings the noise is weighted over
+NOISE_HALF_LIFE = 300
+# Readings before noise is judged
+MIN_READINGS = 30
+# Seconds the dropout rate is averaged over
+DROPOUT_WINDOW = 1800.0
+# Readings the deviation from the group is averaged over
+DEVIATION_HALF_LIFE = 60
+
+# Limits at which an issue is raised, and the share of the limit it has
+# to fall back under to clear
+NOISE_LIMIT = 0.25       # °C, standard deviation of a single reading
+STUCK_TIME = 900.0       # seconds without any change
+DROPOUT_LIMIT = 0.01     # share of the time failed or timed out
+DEVIATION_LIMIT = 1.0    # °C from the group's median
+CLEAR_FACTOR = 0.7
+
+SENSOR_OK = 0
+INVALID_TEMPERATURE = -999.0
+
+ISSUE_NOISY = 'noisy'
+ISSUE_STUCK = 'stuck'
+ISSUE_DROPOUTS = 'dropouts'
+ISSUE_DEVIATION = 'deviation'
+
+# Display names of the issues, as the GUI shows them
+ISSUE_NAMES = {
+    ISSUE_NOISY: "støjende",
+    ISSUE_STUCK: "hænger",
+    ISSUE_DROPOUTS: "udfald",
+    ISSUE_DEVIATION: "uenig med gruppen",
+}
+
+# value is the figure that raised or cleared the issue: noise and
+# deviation in °C, stuck in seconds, dropouts as a share of the time
+HealthChange = namedtuple('HealthChange', ['sensor_id', 'issue', 'active', 'value'])
+
+
+class RunningStats:
+    """Mean and variance by Welford's method. With a half_life (in
+    samples) older samples count exponentially less, so the figures follow
+    recent behaviour; without, every sample counts the same."""
+
+    def __init__(self, half_life=None):
+        self.decay = 0.5 ** (1 / half_life) if half_life else 1.0
+        self.count = 0
+        self.weight = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.count += 1
+        self.weight = self.weight * self.decay + 1.0
+        delta = x - self.mean
+        self.mean += delta / self.weight
+        self.m2 = self.m2 * self.decay + delta * (x - self.mean)
+
+    @property
+    def variance(self):
+        return self.m2 / self.weight if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(max(self.variance, 0.0))
+
+
+class SensorStats:
+    """Everything tracked for one sensor"""
+
+    def __init__(self):
+        self.temperature = RunningStats()
+        self.steps = RunningStats(NOISE_HALF_LIFE)
+        self.deviation = RunningStats(DEVIATION_HALF_LIFE)
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.value = None          # latest valid reading
+        self.last_update = None    # the firmware's lastUpdate of it
+        self.changed_at = None     # when the value last changed
+        self.last_time = None
+        self.dropout_rate = 0.0
+        self.faulty = False
+        self.simulated = False
+        self.dropouts = 0          # times it went from OK to failed
+        self.issues = set()
+
+    @property
+    def noise(self):
+        """Standard deviation of a single reading's noise; the difference of
+        two readings has twice its variance"""
+        if self.steps.count < MIN_READINGS:
+            return None
+        return self.steps.std / math.sqrt(2)
+
+    def stuck_for(self, now):
+        if self.faulty or self.simulated or self.changed_at is None:
+            return 0.0
+        return max(now - self.changed_at, 0.0)
+
+    def observe(self, now, health, temperature, last_update, simulated):
+        if self.last_time is not None and now < self.last_time:
+            # The regulator restarted and its clock with it
+            self.last_time = self.changed_at = None
+            self.last_update = None
+        if self.last_time is not None:
+            # Time weighted, so frames coming faster or slower do not matter
+            share = 1.0 - math.exp(-(now - self.last_time) / DROPOUT_WINDOW)
+            self.dropout_rate += share * ((1.0 if self.faulty else 0.0) - self.dropout_rate)
+        self.last_time = now
+
+        faulty = health != SENSOR_OK
+        if faulty and not self.faulty:
+            self.dropouts += 1
+        self.faulty = faulty
+        if simulated and not self.simulated:
+            # A value set by hand says nothing about the probe
+            self.changed_at = None
+            self.deviation = RunningStats(DEVIATION_HALF_LIFE)
+        self.simulated = simulated
+        if faulty or simulated or temperature is None or temperature <= INVALID_TEMPERATURE:
+            # The latter before the first reading after boot
+            return False
+        if last_update is not None and last_update == self.last_update:
+            # The same reading again, e.g. in a frame about something else
+            return False
+        self.last_update = last_update
+        if self.value is not None:
+            self.steps.add(temperature - self.value)
+        if temperature != self.value or self.changed_at is None:
+            self.changed_at = now
+        self.value = temperature
+        self.temperature.add(temperature)
+        self.minimum = min(self.minimum, temperature)
+        self.maximum = max(self.maximum, temperature)
+        return True
+
+
+class SensorHealth:
+    """Statistics and issues of every sensor reported in the status.
+
+    Call update() with every status snapshot and its time in seconds, the
+    regulator's own where frames carry it; it returns the HealthChanges of
+    issues raised or cleared. Safe to read with summary() from another
+    thread.
+    """
+
+    def __init__(self, groups=None):
+        self.lock = threading.Lock()
+        self.sensors = {}
+        self.groups = []
+        self.set_groups(groups or [])
+
+    def set_groups(self, groups):
+        """Sensor ids that should read the same, e.g. [(0, 3)] for two
+        probes in one kettle; groups of fewer than two are ignored"""
+        with self.lock:
+            self.groups = [tuple(group) for group in groups if len(set(group)) > 1]
+            grouped = {sensor_id for group in self.groups for sensor_id in group}
+            for sensor_id, stats in self.sensors.items():
+                if sensor_id not in grouped:
+                    stats.deviation = RunningStats(DEVIATION_HALF_LIFE)
+
+    def reset(self):
+        """Forget every sensor's statistics, for a new link; returns the
+        issues that were raised, now cleared. The groups are kept"""
+        with self.lock:
+            changes = [HealthChange(sensor_id, issue, False, None)
+                       for sensor_id, stats in self.sensors.items() for issue in sorted(stats.issues)]
+            self.sensors = {}
+        return changes
+
+    def update(self, snapshot, now):
+        changes = []
+        with self.lock:
+            fresh = set()
+            for sensor_id, sensor in snapshot.sensors.items():
+                stats = self.sensors.get(sensor_id)
+                if stats is None:
+                    stats = self.sensors[sensor_id] = SensorStats()
+                if stats.observe(now, sensor.get('health', SENSOR_OK), sensor.get('temperature'),
+                                 sensor.get('lastUpdate'), sensor.get('simulated', False)):
+                    fresh.add(sensor_id)
+            self._compare_groups(fresh)
+            for sensor_id, stats in self.sensors.items():
+                changes += self._judge(sensor_id, stats, now)
+        return changes
+
+    def summary(self, now=None):
+        """Per sensor id, a dict of its figures for display"""
+        with self.lock:
+            result = {}
+            for sensor_id, stats in self.sensors.items():
+                result[sensor_id] = {
+                    'readings': stats.temperature.count,
+                    'mean': stats.temperature.mean if stats.temperature.count else None,
+                    'std': stats.temperature.std if stats.temperature.count else None,
+                    'minimum': stats.minimum if stats.temperature.count else None,
+                    'maximum': stats.maximum if stats.temperature.count else None,
+                    'noise': stats.noise,
+                    'stuck_for': stats.stuck_for(stats.last_time if now is None else now),
+                    'dropout_rate': stats.dropout_rate,
+                    'dropouts': stats.dropouts,
+                    'deviation': stats.deviation.mean if stats.deviation.count else None,
+                    'issues': sorted(stats.issues),
+                }
+            return result
+
+    def _compare_groups(self, fresh):
+        for group in self.groups:
+            values = [(sensor_id, self.sensors[sensor_id].value) for sensor_id in group
+                      if sensor_id in self.sensors and self.sensors[sensor_id].value is not None
+                      and not self.sensors[sensor_id].faulty and not self.sensors[sensor_id].simulated]
+            if len(values) < 2 or not any(sensor_id in fresh for sensor_id, _ in values):
+                continue
+            ordered = sorted(value for _, value in values)
+            middle = len(ordered) // 2
+            median = ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+            for sensor_id, value in values:
+                self.sensors[sensor_id].deviation.add(value - median)
+
+    def _judge(self, sensor_id, stats, now):
+        noise = stats.noise
+        deviation = stats.deviation.mean if stats.deviation.count else None
+        checks = (
+            (ISSUE_NOISY, noise, NOISE_LIMIT),
+            (ISSUE_STUCK, stats.stuck_for(now), STUCK_TIME),
+            (ISSUE_DROPOUTS, stats.dropout_rate, DROPOUT_LIMIT),
+            (ISSUE_DEVIATION, None if deviation is None else abs(deviation), DEVIATION_LIMIT),
+        )
+        changes = []
+        for issue, value, limit in checks:
+            if issue in stats.issues:
+                # A stuck value clears as soon as it moves
+                clear_at = limit if issue == ISSUE_STUCK else limit * CLEAR_FACTOR
+                if value is None or value < clear_at:
+                    stats.issues.discard(issue)
+                    changes.append(HealthChange(sensor_id, issue, False, value))
+            elif value is not None and value >= limit:
+                stats.issues.add(issue)
+                changes.append(HealthChange(sensor_id, issue, True, value))
+        return changes
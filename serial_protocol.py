@@ -0,0 +1,182 @@
+import json
+
+# Largest frame we are willing to buffer without seeing a newline. The
+# firmware builds each reply in a JSON_BUFFER_SIZE (2048 byte) document, so
+# anything much longer than that is line noise.
+MAX_FRAME_SIZE = 4 * 2048
+
+# Every reply from the firmware carries at least one of these keys. Used to
+# tell a real frame from a nested object when resynchronising mid-line.
+FRAME_KEYS = ('command', 'error')
+
+# Compact status encoding, enabled with {"command": "setFormat", "format":
+# "compact"}. Records are sent as arrays of values in the order below and
+# frames are marked with COMPACT_KEY; see Regulator/API.md.
+COMPACT_KEY = 'f'
+COMPACT_VERSION = 1
+SENSOR_FIELDS = ('temperature', 'health', 'errorCode', 'lastUpdate', 'simulated')
+THERMOSTAT_FIELDS = ('currentTemp', 'output', 'setpoint', 'enabled', 'type', 'outputActive',
+                     'sensorIndex', 'state')
+ALARM_FIELDS = ('level', 'errorCode', 'acknowledged', 'timestamp', 'active')
+PID_CONFIG_FIELDS = ('type', 'kp', 'ki', 'kd', 'setpoint', 'sensorIndex', 'enabled', 'manualOutput')
+ALARM_CONFIG_FIELDS = ('warningLow', 'warningHigh', 'alarmLow', 'alarmHigh', 'resetMode', 'enabled')
+# Sent as 0/1 in the compact encoding
+BOOL_FIELDS = frozenset(('simulated', 'enabled', 'outputActive', 'acknowledged', 'active'))
+
+
+def _expand_records(rows, fields, id_key=None):
+    records = []
+    for position, row in enumerate(rows):
+        if row is None:
+            # Unchanged record in a changesOnly frame from a subscription
+            continue
+        record = dict(zip(fields, row))
+        for key in BOOL_FIELDS.intersection(record):
+            record[key] = bool(record[key])
+        if id_key:
+            record[id_key] = position
+        records.append(record)
+    return records
+
+
+def expand_compact(frame):
+    """Rewrite a compact status frame into the regular layout, in place.
+
+    Returns the frame. Frames without the compact marker are returned as
+    they are.
+    """
+    if frame.pop(COMPACT_KEY, None) is None:
+        return frame
+    if 's' in frame:
+        frame['sensors'] = _expand_records(frame.pop('s'), SENSOR_FIELDS, 'sensor_id')
+    if 't' in frame:
+        frame['thermostats'] = _expand_records(frame.pop('t'), THERMOSTAT_FIELDS, 'regulator_id')
+    if 'a' in frame:
+        frame['alarms'] = _expand_records(frame.pop('a'), ALARM_FIELDS, 'regulator_id')
+    if 'c' in frame:
+        config = frame.pop('c')
+        frame['config'] = {
+            'pids': _expand_records(config.get('p', ()), PID_CONFIG_FIELDS),
+            'alarms': _expand_records(config.get('a', ()), ALARM_CONFIG_FIELDS),
+        }
+    return frame
+
+
+class FrameParser:
+    """Incremental parser for the newline framed JSON stream from the regulator.
+
+    Bytes are fed in as they arrive and complete frames come out as dicts.
+    Frames split across reads are reassembled, frames glued together on one
+    line are separated, and garbage is skipped up to the next '{' so the
+    parser resynchronises on the following frame. Frames in the compact
+    encoding come out in the regular layout.
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE, frame_keys=FRAME_KEYS):
+        self.max_frame_size = max_frame_size
+        self.frame_keys = frame_keys
+        self.buffer = bytearray()
+        self.decoder = json.JSONDecoder()
+        self.frames_parsed = 0
+        self.discarded_bytes = 0
+        # Frames lost to corruption or truncation
+        self.frames_dropped = 0
+
+    @property
+    def pending(self):
+        """Number of buffered bytes belonging to a not yet complete frame"""
+        return len(self.buffer)
+
+    def reset(self):
+        self.buffer.clear()
+
+    def feed(self, data):
+        """Add received bytes and return the list of frames completed by them"""
+        buffer = self.buffer
+        search_from = len(buffer)
+        buffer += data
+
+        end = buffer.rfind(b'\n', search_from)
+        if end < 0:
+            if len(buffer) > self.max_frame_size:
+                # No frame boundary in sight - drop it and wait for the next line
+                self.discarded_bytes += len(buffer)
+                self.frames_dropped += 1
+                buffer.clear()
+            return []
+
+        frames = []
+        view = memoryview(buffer)
+        try:
+            start = 0
+            while start < end:
+                line_end = buffer.find(b'\n', start, end + 1)
+                if line_end - start > 1:
+                    self._parse_line(view[start:line_end], frames)
+                start = line_end + 1
+        finally:
+            view.release()
+        del buffer[:end + 1]
+        return frames
+
+    def _parse_line(self, line, frames):
+        # Decode the line once and walk it with raw_decode, so frames glued
+        # together without a newline do not need to be copied out separately
+        text = str(line, 'utf-8', 'replace')
+        length = len(text)
+        pos = 0
+        resynced = False
+        dropping = False
+        while pos < length:
+            brace = text.find('{', pos)
+            if brace < 0:
+                self._discard(text[pos:])
+                return
+            if brace > pos and self._discard(text[pos:brace]):
+                resynced = True
+            try:
+                frame, end = self.decoder.raw_decode(text, brace)
+            except json.JSONDecodeError:
+                # Truncated or corrupted frame - resync on the next '{'
+                end = text.find('{', brace + 1)
+                if end < 0:
+                    end = length
+                self._discard(text[brace:end])
+                if not dropping:
+                    # Nested objects of the same frame fail too; count it once
+                    self.frames_dropped += 1
+                    dropping = True
+                pos = end
+                resynced = True
+                continue
+            # After skipping garbage we may have landed inside a frame, so
+            # only accept objects that look like a complete reply
+            if isinstance(frame, dict) and (not resynced or self._is_frame(frame)):
+                self.frames_parsed += 1
+                if COMPACT_KEY in frame:
+                    try:
+                        expand_compact(frame)
+                    except (TypeError, AttributeError):
+                        # Malformed compact records; pass on what is left
+                        pass
+                frames.append(frame)
+                resynced = False
+                dropping = False
+            else:
+                self._discard(text[brace:end])
+                resynced = True
+            pos = end
+
+    def _is_frame(self, frame):
+        for key in self.frame_keys:
+            if key in frame:
+                return True
+        return False
+
+    def _discard(self, text):
+        # Line endings and padding between frames are not worth counting
+        text = text.strip()
+        if not text:
+            return False
+        self.discarded_bytes += len(text.encode('utf-8', 'replace'))
+        return True
@@ -0,0 +1,931 @@
+"""Stand-in for the BrewControl regulator, for running the host side
+without an Arduino.
+
+SimulatedRegulator answers every command in Regulator/API.md, including
+seq, setFormat and subscribe, the way the firmware does. Each thermostat
+heats a kettle modelled as a first order plant with dead time, and the
+sensors not wired to a kettle follow the room. Instead of the plants it
+can replay a recorded history. Device time runs at any multiple of real
+time. A FaultInjector adds line noise, dropped bytes and garbled frames.
+
+The device is served on a pseudo terminal or a TCP port; the host side
+connects to the printed pty path or to the socket:// URL:
+
+    python simulator.py
+    python simulator.py --tcp 7000
+    python simulator.py --speed 20 --replay ~/BrewControl/historik
+    python simulator.py --drop 0.0001 --garble 0.01 --junk 0.01 --unthrottled
+
+Like the firmware it does one thing at a time: while it writes a frame,
+which takes as long as the baud rate says unless unthrottled, it only
+buffers what arrives, and input beyond the 2 KB input buffer is lost.
+--rx-buffer 64 behaves like firmware from before that buffering, which
+kept only what fit in the serial receive buffer.
+"""
+import argparse
+import bisect
+import json
+import math
+import os
+import random
+import select
+import socket
+import time
+from collections import Counter, deque
+
+from recorder import NO_LEVEL, StatusRecorder
+from serial_protocol import (COMPACT_KEY, COMPACT_VERSION, SENSOR_FIELDS, THERMOSTAT_FIELDS,
+                             ALARM_FIELDS, PID_CONFIG_FIELDS, ALARM_CONFIG_FIELDS, BOOL_FIELDS)
+
+# Mirrors Regulator/config.h, with times in seconds
+UPDATE_INTERVAL = 1.0
+SUBSCRIBE_MIN_INTERVAL = 0.1
+SUBSCRIBE_KEEPALIVE = 5.0
+JSON_BUFFER_SIZE = 2048
+INVALID_SENSOR_VALUE = -999.0
+NUM_PIDS = 3
+NUM_PT100_SENSORS = 4
+TOTAL_SENSORS = 7
+
+SENSOR_OK, SENSOR_FAILED, SENSOR_TIMED_OUT = range(3)
+CONTROLLER_PID, CONTROLLER_SIMPLE, CONTROLLER_MANUAL = range(3)
+STATE_IDLE, STATE_RUN, STATE_TUNE, STATE_DEMO, STATE_FAIL = range(5)
+ALARM_NONE, ALARM_WARNING, ALARM_ALARM, ALARM_TECHNICAL = range(4)
+AUTO_RESET, MANUAL_ACK = range(2)
+
+ERROR_NONE = 0
+ERROR_SENSOR_DISCONNECTED = 1003
+ERROR_COMMUNICATION = 2001
+ERROR_CONFIGURATION = 2002
+
+# Autotune gives up and applies what it has after this long (device time)
+AUTOTUNE_DURATION = 1800.0
+
+# How often a pty nobody has opened is checked for a new connection
+PTY_POLL = 0.2
+
+
+def pid_defaults(sensor_index=-1):
+    return {'type': CONTROLLER_PID, 'kp': 2.0, 'ki': 5.0, 'kd': 1.0, 'setpoint': 20.0,
+            'outputMin': 0.0, 'outputMax': 255.0, 'sensorIndex': sensor_index,
+            'enabled': False, 'manualOutput': 0.0, 'hysteresis': 0.5}
+
+
+def alarm_defaults():
+    return {'warningLow': -999.0, 'warningHigh': 999.0, 'alarmLow': -999.0, 'alarmHigh': 999.0,
+            'resetMode': AUTO_RESET, 'enabled': True}
+
+
+class ThermalPlant:
+    """A heated kettle: first order response to the heater with dead time.
+
+    gain is how far above ambient full power would eventually take it, tau
+    the time constant and dead_time the delay before the heater shows up
+    at the sensor, all in seconds. Water does not get hotter than boiling.
+    """
+
+    def __init__(self, gain=80.0, tau=900.0, dead_time=30.0, ambient=18.0, temperature=None,
+                 boiling_point=100.0):
+        self.gain = gain
+        self.tau = tau
+        self.dead_time = dead_time
+        self.ambient = ambient
+        self.boiling_point = boiling_point
+        self.temperature = ambient if temperature is None else temperature
+        self.inputs = deque()
+        self.power = 0.0
+        self.time = 0.0
+
+    def step(self, power, dt):
+        """Advance dt seconds with the heater at power (0..1)"""
+        self.time += dt
+        self.inputs.append((self.time + self.dead_time, power))
+        # The heater power that reaches the sensor now
+        while self.inputs and self.inputs[0][0] <= self.time:
+            self.power = self.inputs.popleft()[1]
+        target = self.ambient + self.gain * self.power
+        self.temperature = target + (self.temperature - target) * math.exp(-dt / self.tau)
+        self.temperature = min(self.temperature, self.boiling_point)
+        return self.temperature
+
+
+def default_plants(ambient=18.0):
+    """Hot liquor tank, mash tun and boil kettle"""
+    return [
+        ThermalPlant(gain=90.0, tau=1200.0, dead_time=30.0, ambient=ambient),
+        ThermalPlant(gain=70.0, tau=1800.0, dead_time=60.0, ambient=ambient),
+        ThermalPlant(gain=110.0, tau=900.0, dead_time=20.0, ambient=ambient),
+    ]
+
+
+class ReplaySource:
+    """Sensor and thermostat values from a recorded history, looped"""
+
+    def __init__(self, directory, start=0.0, end=math.inf, loop=True):
+        if not os.path.isdir(directory):
+            raise FileNotFoundError(f"No history in {directory}")
+        self.samples = StatusRecorder(directory).query(start, end)
+        if not self.samples:
+            raise ValueError(f"No recorded samples in {directory}")
+        first = self.samples[0].time
+        self.times = [sample.time - first for sample in self.samples]
+        self.loop = loop
+
+    @property
+    def duration(self):
+        return self.times[-1]
+
+    def sample_at(self, t):
+        """Recorded sample at t seconds into the recording"""
+        if self.loop:
+            t %= self.duration + UPDATE_INTERVAL
+        index = bisect.bisect_right(self.times, t) - 1
+        return self.samples[max(index, 0)]
+
+
+class _Pid:
+    """The parts of PID_v1 the firmware uses: proportional on error,
+    derivative on measurement, integral clamped to the output limits"""
+
+    def __init__(self):
+        self.output_sum = 0.0
+        self.last_input = None
+
+    def compute(self, value, config, dt=UPDATE_INTERVAL):
+        low, high = config['outputMin'], config['outputMax']
+        error = config['setpoint'] - value
+        d_input = 0.0 if self.last_input is None else value - self.last_input
+        self.last_input = value
+        self.output_sum = min(max(self.output_sum + config['ki'] * dt * error, low), high)
+        output = config['kp'] * error + self.output_sum - config['kd'] / dt * d_input
+        return min(max(output, low), high)
+
+
+class SimulatedRegulator:
+    """Protocol and control logic of the firmware, on simulated hardware.
+
+    handle_line() takes one received command line and returns the reply;
+    update() is the firmware's main loop body and returns a pushed status
+    frame when a subscription is due. Both return encoded bytes or None.
+    Device time is clock() seconds, running speed times faster than real
+    time; reset() is a power cycle of the board, the plants keep going.
+    """
+
+    def __init__(self, plants=None, replay=None, speed=1.0, noise=0.02, sensor_dropout=0.0,
+                 ambient=18.0, seed=None):
+        self.plants = default_plants(ambient) if plants is None else plants
+        self.replay = replay
+        self.speed = speed
+        self.noise = noise
+        self.sensor_dropout = sensor_dropout
+        self.ambient = ambient
+        self.random = random.Random(seed)
+        self.epoch = time.monotonic()
+        self.failed_sensors = set()
+        self.reset()
+
+    def clock(self):
+        return (time.monotonic() - self.epoch) * self.speed
+
+    def millis(self):
+        return int((self.clock() - self.boot_time) * 1000)
+
+    def wall_delay(self, deadline):
+        """Real seconds until device time deadline"""
+        return max(deadline - self.clock(), 0.0) / self.speed
+
+    def reset(self):
+        self.boot_time = self.clock()
+        self.last_update = self.boot_time
+        self.sensors = [self._reading() for _ in range(TOTAL_SENSORS)]
+        self.simulation = [{'simulated': False, 'value': 20.0} for _ in range(TOTAL_SENSORS)]
+        # The firmware starts with nothing assigned; here thermostat i is
+        # wired to sensor i, which sits in kettle i
+        self.pid_configs = [pid_defaults(i) for i in range(NUM_PIDS)]
+        self.alarm_configs = [alarm_defaults() for _ in range(NUM_PIDS)]
+        self.pid_status = [self._pid_status(i) for i in range(NUM_PIDS)]
+        self.alarms = [self._alarm_state() for _ in range(NUM_PIDS)]
+        self.states = [STATE_IDLE] * NUM_PIDS
+        self.buttons = [False] * NUM_PIDS
+        self.pids = [_Pid() for _ in range(NUM_PIDS)]
+        self.simple_on = [False] * NUM_PIDS
+        self.tunes = [None] * NUM_PIDS
+        self.compact = False
+        self.subscribe_interval = 0.0
+        self.changes_only = False
+        self.last_publish = self.last_full_publish = self.boot_time
+        self.sent = {}
+
+    def _reading(self):
+        return {'temperature': INVALID_SENSOR_VALUE, 'health': SENSOR_OK, 'errorCode': ERROR_NONE,
+                'lastUpdate': 0, 'simulated': False}
+
+    def _pid_status(self, i):
+        config = self.pid_configs[i]
+        return {'currentTemp': 0.0, 'output': 0.0, 'setpoint': config['setpoint'],
+                'enabled': config['enabled'], 'type': config['type'], 'outputActive': False,
+                'sensorIndex': config['sensorIndex'], 'state': STATE_IDLE}
+
+    def _alarm_state(self):
+        return {'level': ALARM_NONE, 'errorCode': ERROR_NONE, 'acknowledged': False,
+                'timestamp': 0, 'active': False}
+
+    def fail_sensor(self, index, failed=True):
+        """Make a sensor read as disconnected until called with failed=False"""
+        if failed:
+            self.failed_sensors.add(index)
+        else:
+            self.failed_sensors.discard(index)
+
+    # Main loop
+
+    def next_deadline(self):
+        """Device time at which update() has something to do"""
+        deadline = self.last_update + UPDATE_INTERVAL
+        if self.subscribe_interval:
+            deadline = min(deadline, self.last_publish + self.subscribe_interval)
+        return deadline
+
+    def update(self):
+        now = self.clock()
+        if now - self.last_update >= UPDATE_INTERVAL:
+            self._update_system(now - self.last_update)
+            self.last_update = now
+        return self._publish_status(now)
+
+    def step(self, dt=UPDATE_INTERVAL):
+        """Run one control cycle of dt device seconds, whatever the clock says"""
+        self._update_system(dt)
+
+    def _update_system(self, dt):
+        sample = self.replay.sample_at(self.clock() - self.boot_time) if self.replay else None
+        self._update_sensors(sample)
+        for i in range(NUM_PIDS):
+            config = self.pid_configs[i]
+            value = INVALID_SENSOR_VALUE
+            if 0 <= config['sensorIndex'] < TOTAL_SENSORS:
+                reading = self.sensors[config['sensorIndex']]
+                value = reading['temperature']
+                if reading['health'] == SENSOR_FAILED:
+                    self._set_technical_alarm(i, reading['errorCode'])
+                else:
+                    self._clear_technical_alarm(i)
+                    if value != INVALID_SENSOR_VALUE:
+                        self._update_process_alarm(i, value)
+            elif config['enabled']:
+                self._set_technical_alarm(i, ERROR_CONFIGURATION)
+            output_enabled = self.alarms[i]['level'] <= ALARM_WARNING and self.buttons[i]
+            self._update_pid(i, value, output_enabled)
+
+        if sample is not None:
+            self._apply_replay(sample)
+        else:
+            for i, plant in enumerate(self.plants):
+                power = self.pid_status[i]['output'] / 255.0 if i < NUM_PIDS else 0.0
+                plant.step(power, dt)
+
+    def _source_temperature(self, index):
+        if index in self.failed_sensors or (self.sensor_dropout and self.random.random() < self.sensor_dropout):
+            return INVALID_SENSOR_VALUE
+        if index < len(self.plants):
+            temperature = self.plants[index].temperature
+        else:
+            # Room sensors, each a little off
+            temperature = self.ambient + 0.3 * (index - len(self.plants))
+        return temperature + (self.random.gauss(0.0, self.noise) if self.noise else 0.0)
+
+    def _update_sensors(self, sample):
+        now = self.millis()
+        for i, reading in enumerate(self.sensors):
+            if self.simulation[i]['simulated']:
+                temperature = self.simulation[i]['value']
+            elif sample is not None:
+                temperature = sample.temperatures[i] if i < len(sample.temperatures) else math.nan
+                if math.isnan(temperature):
+                    temperature = INVALID_SENSOR_VALUE
+            else:
+                temperature = self._source_temperature(i)
+            if temperature != INVALID_SENSOR_VALUE:
+                reading.update(temperature=temperature, health=SENSOR_OK, errorCode=ERROR_NONE)
+            else:
+                reading.update(health=SENSOR_FAILED, errorCode=ERROR_SENSOR_DISCONNECTED)
+            reading['simulated'] = self.simulation[i]['simulated']
+            reading['lastUpdate'] = now
+
+    def _apply_replay(self, sample):
+        for i in range(min(NUM_PIDS, len(sample.thermostat_temps))):
+            status = self.pid_status[i]
+            for key, values in (('currentTemp', sample.thermostat_temps),
+                                ('setpoint', sample.setpoints), ('output', sample.outputs)):
+                if not math.isnan(values[i]):
+                    status[key] = values[i]
+            level = sample.alarm_levels[i]
+            if level != NO_LEVEL and level != self.alarms[i]['level']:
+                self.alarms[i].update(level=level, active=level != ALARM_NONE, timestamp=self.millis())
+
+    def _update_pid(self, i, value, output_enabled):
+        config = self.pid_configs[i]
+        status = self.pid_status[i]
+        if not config['enabled']:
+            self.states[i] = STATE_IDLE
+        status.update(currentTemp=value, setpoint=config['setpoint'], enabled=config['enabled'],
+                      type=config['type'], sensorIndex=config['sensorIndex'], state=self.states[i],
+                      outputActive=output_enabled and config['enabled'])
+        state = self.states[i]
+        if not status['outputActive'] and state != STATE_TUNE:
+            status['output'] = 0.0
+            return
+
+        output = 0.0
+        if state == STATE_TUNE:
+            output = self._update_autotune(i, value)
+        elif state == STATE_RUN:
+            if config['type'] == CONTROLLER_PID:
+                output = self.pids[i].compute(value, config)
+            elif config['type'] == CONTROLLER_SIMPLE:
+                error = config['setpoint'] - value
+                if not self.simple_on[i] and error > config['hysteresis']:
+                    self.simple_on[i] = True
+                elif self.simple_on[i] and error < -config['hysteresis']:
+                    self.simple_on[i] = False
+                output = config['outputMax'] if self.simple_on[i] else 0.0
+            elif config['type'] == CONTROLLER_MANUAL:
+                output = config['manualOutput']
+        elif state == STATE_DEMO:
+            output = config['outputMax'] * 0.5
+        status['output'] = min(max(output, config['outputMin']), config['outputMax'])
+
+    def _update_autotune(self, i, value):
+        config = self.pid_configs[i]
+        tune = self.tunes[i]
+        if value > config['setpoint']:
+            tune['output'] = 0.0
+            tune['high'] = max(tune['high'], value)
+        else:
+            tune['output'] = tune['step']
+            tune['low'] = min(tune['low'], value)
+        if self.clock() - tune['start'] > AUTOTUNE_DURATION:
+            amplitude = (tune['high'] - tune['low']) / 2.0
+            if amplitude > 0:
+                ku = 4.0 * tune['step'] / (math.pi * amplitude)
+                pu = AUTOTUNE_DURATION
+                config.update(kp=0.6 * ku, ki=1.2 * ku / pu, kd=0.075 * ku * pu)
+            self.states[i] = STATE_RUN
+            self.pid_status[i]['state'] = STATE_RUN
+        return tune['output']
+
+    def _update_process_alarm(self, i, value):
+        config = self.alarm_configs[i]
+        state = self.alarms[i]
+        if not config['enabled']:
+            return
+        level = ALARM_NONE
+        if value <= config['alarmLow'] or value >= config['alarmHigh']:
+            level = ALARM_ALARM
+        elif value <= config['warningLow'] or value >= config['warningHigh']:
+            level = ALARM_WARNING
+        if level > state['level']:
+            state.update(level=level, errorCode=ERROR_NONE, timestamp=self.millis(), active=True,
+                         acknowledged=False)
+        elif level < state['level'] and config['resetMode'] == AUTO_RESET:
+            state.update(level=level, active=level != ALARM_NONE)
+
+    def _set_technical_alarm(self, i, error_code):
+        self.alarms[i].update(level=ALARM_TECHNICAL, errorCode=error_code, timestamp=self.millis(),
+                              active=True, acknowledged=False)
+
+    def _clear_technical_alarm(self, i):
+        state = self.alarms[i]
+        if state['level'] == ALARM_TECHNICAL:
+            state['active'] = False
+            if self.alarm_configs[i]['resetMode'] == AUTO_RESET:
+                state.update(level=ALARM_NONE, errorCode=ERROR_NONE)
+
+    # Protocol
+
+    def handle_line(self, line):
+        """Reply to one command line (without the line ending)"""
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError
+        except ValueError:
+            return self.encode({'error': "Invalid JSON", 'errorCode': ERROR_COMMUNICATION})
+
+        response = {}
+        if 'seq' in request:
+            response['seq'] = request['seq']
+        command = request.get('command')
+        if not command:
+            response.update(error="Missing command", errorCode=ERROR_COMMUNICATION)
+            return self.encode(response)
+        response['command'] = command
+        response['timestamp'] = self.millis()
+
+        if command == 'setFormat':
+            self._set_format(request, response)
+        if self.compact:
+            response[COMPACT_KEY] = COMPACT_VERSION
+
+        handler = {
+            'getStatus': self._get_status,
+            'setFormat': lambda request, response: None,
+            'subscribe': self._subscribe,
+            'setConfig': self._set_config,
+            'ackAlarm': self._ack_alarm,
+            'setSimulation': self._set_simulation,
+            'toggleEnable': self._toggle_enable,
+            'autotune': self._autotune,
+            'setState': self._set_state,
+        }.get(command)
+        if handler is None:
+            response.update(error="Unknown command", errorCode=ERROR_COMMUNICATION)
+        else:
+            handler(request, response)
+        return self.encode(response)
+
+    def _add_status(self, response, config=True):
+        self._add_records(response)
+        if config:
+            response['config'] = {'pids': [dict(c) for c in self.pid_configs],
+                                  'alarms': [dict(c) for c in self.alarm_configs]}
+
+    def _regulator_id(self, request, response):
+        if 'regulator_id' not in request:
+            response.update(error="Missing regulator_id", errorCode=ERROR_COMMUNICATION)
+            return None
+        regulator_id = request['regulator_id']
+        if not isinstance(regulator_id, int) or not 0 <= regulator_id < NUM_PIDS:
+            response.update(error="Invalid regulator_id", errorCode=ERROR_COMMUNICATION)
+            return None
+        return regulator_id
+
+    def _get_status(self, request, response):
+        response['status'] = 'ok'
+        self._add_status(response, config=not self.compact or request.get('config') is True)
+
+    def _set_format(self, request, response):
+        if request.get('format') == 'compact':
+            self.compact = True
+        elif request.get('format') == 'json':
+            self.compact = False
+        else:
+            response.update(error="Invalid format", errorCode=ERROR_COMMUNICATION)
+            return
+        response['format'] = 'compact' if self.compact else 'json'
+        response['status'] = 'format_set'
+
+    def _subscribe(self, request, response):
+        interval = request.get('interval', UPDATE_INTERVAL * 1000)
+        if not isinstance(interval, (int, float)) or interval < 0:
+            response.update(error="Invalid interval", errorCode=ERROR_COMMUNICATION)
+            return
+        interval = int(interval) / 1000
+        if 0 < interval < SUBSCRIBE_MIN_INTERVAL:
+            interval = SUBSCRIBE_MIN_INTERVAL
+        self.subscribe_interval = interval
+        self.changes_only = bool(request.get('changesOnly', False))
+        self.last_publish = self.last_full_publish = self.clock()
+        response.update(status='subscribed' if interval else 'unsubscribed',
+                        interval=int(interval * 1000), changesOnly=self.changes_only,
+                        keepalive=int(SUBSCRIBE_KEEPALIVE * 1000))
+        self._add_status(response)
+
+    def _set_config(self, request, response):
+        regulator_id = request.get('regulator_id')
+        if isinstance(regulator_id, int) and 0 <= regulator_id < NUM_PIDS:
+            config = dict(self.pid_configs[regulator_id])
+            for key in ('type', 'setpoint', 'kp', 'ki', 'kd', 'sensorIndex', 'enabled', 'manualOutput'):
+                if key in request:
+                    config[key] = request[key]
+            # Same validation as PIDController::setPIDConfig
+            if min(config['kp'], config['ki'], config['kd']) >= 0 and config['outputMax'] > config['outputMin']:
+                self.pid_configs[regulator_id] = config
+        response['status'] = 'configured'
+        self._add_status(response)
+
+    def _ack_alarm(self, request, response):
+        regulator_id = self._regulator_id(request, response)
+        if regulator_id is not None:
+            state = self.alarms[regulator_id]
+            state['acknowledged'] = True
+            if self.alarm_configs[regulator_id]['resetMode'] == MANUAL_ACK and not state['active']:
+                state.update(level=ALARM_NONE, errorCode=ERROR_NONE)
+            response['status'] = 'acknowledged'
+        self._add_status(response)
+
+    def _set_simulation(self, request, response):
+        index = request.get('sensorIndex')
+        if isinstance(index, int) and 0 <= index < TOTAL_SENSORS:
+            if 'simulated' in request:
+                self.simulation[index]['simulated'] = bool(request['simulated'])
+            if 'value' in request:
+                self.simulation[index]['value'] = request['value']
+        response['status'] = 'simulation_set'
+        self._add_status(response)
+
+    def _toggle_enable(self, request, response):
+        regulator_id = self._regulator_id(request, response)
+        if regulator_id is not None:
+            enabled = request['enabled'] if 'enabled' in request else not self.buttons[regulator_id]
+            self.buttons[regulator_id] = bool(enabled)
+            response.update(status='toggled', regulator_id=regulator_id, enabled=self.buttons[regulator_id])
+        self._add_status(response)
+
+    def _autotune(self, request, response):
+        regulator_id = self._regulator_id(request, response)
+        if regulator_id is None:
+            return
+        setpoint = self.pid_configs[regulator_id]['setpoint']
+        step = request.get('outputStep', 50.0)
+        self.tunes[regulator_id] = {'step': step, 'output': step, 'start': self.clock(),
+                                    'high': setpoint, 'low': setpoint}
+        self.states[regulator_id] = STATE_TUNE
+        self.pid_status[regulator_id]['state'] = STATE_TUNE
+        response.update(status='autotune_started', regulator_id=regulator_id)
+        self._add_status(response)
+
+    def _set_state(self, request, response):
+        if 'regulator_id' not in request or 'state' not in request:
+            response.update(error="Missing regulator_id or state", errorCode=ERROR_COMMUNICATION)
+            return
+        regulator_id = self._regulator_id(request, response)
+        if regulator_id is None:
+            return
+        state = request['state']
+        if not isinstance(state, int) or not STATE_IDLE <= state <= STATE_FAIL:
+            response.update(error="Invalid state", errorCode=ERROR_COMMUNICATION)
+            return
+        self.states[regulator_id] = state
+        self.pid_status[regulator_id]['state'] = state
+        response.update(status='state_changed', regulator_id=regulator_id, state=state)
+        self._add_status(response)
+
+    def _add_records(self, frame, changes_only=False):
+        """Add sensors, thermostats and alarms; with changes_only only the
+        records that changed since they were last sent. Returns how many
+        records were added."""
+        added = 0
+        for key, records, id_key, fields in (
+                ('sensors', self.sensors, 'sensor_id', SENSOR_FIELDS),
+                ('thermostats', self.pid_status, 'regulator_id', THERMOSTAT_FIELDS),
+                ('alarms', self.alarms, 'regulator_id', ALARM_FIELDS)):
+            rows = []
+            for i, record in enumerate(records):
+                # As in the firmware, a sensor's lastUpdate alone is no change
+                signature = tuple(round(record[f], 2) if isinstance(record[f], float) else record[f]
+                                  for f in fields if f != 'lastUpdate')
+                if changes_only and self.sent.get((key, i)) == signature:
+                    rows.append(None)
+                    continue
+                self.sent[(key, i)] = signature
+                rows.append(dict(record, **{id_key: i}))
+                added += 1
+            frame[key] = rows
+        return added
+
+    def _publish_status(self, now):
+        if not self.subscribe_interval or now - self.last_publish < self.subscribe_interval:
+            return None
+        self.last_publish = now
+        changes_only = self.changes_only and now - self.last_full_publish < SUBSCRIBE_KEEPALIVE
+        if not changes_only:
+            self.last_full_publish = now
+        return self.status_frame(changes_only)
+
+    def status_frame(self, changes_only=False):
+        """Encoded status frame as pushed on a subscription, or None when
+        changes_only is set and nothing changed"""
+        frame = {'command': 'status', 'timestamp': self.millis()}
+        if self.compact:
+            frame[COMPACT_KEY] = COMPACT_VERSION
+        frame['status'] = 'ok'
+        if changes_only:
+            frame['delta'] = True
+        if not self._add_records(frame, changes_only) and changes_only:
+            return None
+        return self.encode(frame)
+
+    def encode(self, frame):
+        """Serialise a reply the way the firmware does, in the current format"""
+        # Unchanged records in a changesOnly frame are None: left out in
+        # JSON, null in the compact encoding where records are positional
+        for key, fields in (('sensors', SENSOR_FIELDS), ('thermostats', THERMOSTAT_FIELDS),
+                            ('alarms', ALARM_FIELDS)):
+            if key not in frame:
+                continue
+            if self.compact:
+                frame[key[0]] = [None if row is None else _compact_row(row, fields) for row in frame.pop(key)]
+            else:
+                frame[key] = [row for row in frame[key] if row is not None]
+        if self.compact and 'config' in frame:
+            config = frame.pop('config')
+            frame['c'] = {'p': [_compact_row(c, PID_CONFIG_FIELDS, None) for c in config['pids']],
+                          'a': [_compact_row(c, ALARM_CONFIG_FIELDS, None) for c in config['alarms']]}
+        return json.dumps(frame, separators=(',', ':')).encode() + b'\r\n'
+
+
+def _compact_row(record, fields, digits=2):
+    row = []
+    for field in fields:
+        value = record[field]
+        if field in BOOL_FIELDS:
+            value = int(bool(value))
+        elif digits is not None and isinstance(value, float):
+            value = round(value, digits)
+        row.append(value)
+    return row
+
+
+class FaultInjector:
+    """Damages outgoing frames the way a bad cable or a noisy USB hub does.
+
+    Each frame gets line noise in front of it with probability junk and is
+    garbled (truncated, overwritten or bit flipped) with probability
+    garble; every byte is then dropped with probability drop.
+    """
+
+    def __init__(self, drop=0.0, garble=0.0, junk=0.0, seed=None):
+        self.drop = drop
+        self.garble = garble
+        self.junk = junk
+        self.random = random.Random(seed)
+        self.counts = Counter()
+
+    def apply(self, data):
+        rng = self.random
+        if self.junk and rng.random() < self.junk:
+            self.counts['junk'] += 1
+            data = bytes(rng.choice(b'{}[]":,0123456789abc \r\n\x00\xff') for _ in range(rng.randint(1, 40))) + data
+        if self.garble and rng.random() < self.garble:
+            self.counts['garbled'] += 1
+            data = self._garble(data)
+        if self.drop:
+            kept = bytes(b for b in data if rng.random() >= self.drop)
+            self.counts['dropped'] += len(data) - len(kept)
+            data = kept
+        return data
+
+    def _garble(self, data):
+        rng = self.random
+        body = bytearray(data.rstrip(b'\r\n'))
+        if not body:
+            return data
+        kind = rng.randrange(3)
+        if kind == 0:
+            # Cut off, line ending included, so it runs into the next frame
+            return bytes(body[:rng.randrange(len(body))])
+        if kind == 1:
+            start = rng.randrange(len(body))
+            for i in range(start, min(start + rng.randint(1, 16), len(body))):
+                body[i] = rng.randrange(256)
+        else:
+            for _ in range(rng.randint(1, 4)):
+                body[rng.randrange(len(body))] ^= 1 << rng.randrange(8)
+        return bytes(body) + b'\r\n'
+
+
+class SimulatorLink:
+    """Serves a SimulatedRegulator on a pty or TCP port, one host at a time.
+
+    A new connection power cycles the board, as opening the Arduino's USB
+    port does. serve_forever() runs until stop() is called from another
+    thread.
+    """
+
+    def __init__(self, regulator, faults=None, baudrate=115200, throttle=True,
+                 rx_buffer=JSON_BUFFER_SIZE):
+        self.regulator = regulator
+        self.faults = faults
+        self.baudrate = baudrate
+        self.throttle = throttle
+        self.rx_buffer = rx_buffer
+        self.master = None
+        self.server = None
+        self.client = None
+        self.connected = False
+        self.running = False
+        self.rx = bytearray()
+        self.skipping = False
+        self.stats = Counter()
+
+    def open_pty(self):
+        """Create the pseudo terminal; returns the path for the host side"""
+        # POSIX only, unlike the TCP mode, so imported here
+        import tty
+        master, slave = os.openpty()
+        # No echo or line editing, whatever the host does with it later
+        tty.setraw(slave)
+        path = os.ttyname(slave)
+        os.close(slave)
+        os.set_blocking(master, False)
+        self.master = master
+        return path
+
+    def open_tcp(self, port=0, host='127.0.0.1'):
+        """Listen on a TCP port; returns the socket:// URL for the host side"""
+        self.server = socket.create_server((host, port))
+        host, port = self.server.getsockname()[:2]
+        return f"socket://{host}:{port}"
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        for closable in (self.client, self.server):
+            if closable is not None:
+                closable.close()
+        if self.master is not None:
+            os.close(self.master)
+        self.master = self.server = self.client = None
+
+    def serve_forever(self):
+        self.running = True
+        try:
+            while self.running:
+                wait = min(self.regulator.wall_delay(self.regulator.next_deadline()), PTY_POLL)
+                readers = [s for s in (self.server, self.client) if s is not None]
+                if self.master is not None and self.connected:
+                    readers.append(self.master)
+                if readers:
+                    ready = select.select(readers, [], [], wait)[0]
+                else:
+                    time.sleep(wait)
+                    ready = []
+                if self.master is not None and (self.master in ready or not self.connected):
+                    self._read_pty()
+                if self.server is not None and self.server in ready:
+                    self._accept()
+                if self.client is not None and self.client in ready:
+                    self._read_socket()
+                frame = self.regulator.update()
+                if frame is not None and self.connected:
+                    self._send(frame)
+        finally:
+            self.close()
+
+    def _connect(self):
+        self.connected = True
+        self.rx.clear()
+        self.skipping = False
+        self.regulator.reset()
+        self.stats['connections'] += 1
+
+    def _hangup(self):
+        self.connected = False
+        self.regulator.reset()
+
+    def _read_pty(self):
+        try:
+            data = os.read(self.master, 4096)
+        except BlockingIOError:
+            # Open on the other end, nothing to read
+            data = b''
+        except OSError:
+            # EIO: nobody has the pty open
+            if self.connected:
+                self._hangup()
+            return
+        if not self.connected:
+            self._connect()
+        if data:
+            self._receive(data)
+
+    def _accept(self):
+        conn, _ = self.server.accept()
+        if self.client is not None:
+            # One host at a time, like a serial port
+            conn.close()
+            return
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.client = conn
+        self._connect()
+
+    def _read_socket(self):
+        try:
+            data = self.client.recv(4096)
+        except OSError:
+            data = b''
+        if not data:
+            self.client.close()
+            self.client = None
+            self._hangup()
+            return
+        self._receive(data)
+
+    def _receive(self, data):
+        for byte in data:
+            if byte in (0x0A, 0x0D):
+                self.skipping = False
+                if self.rx:
+                    line, self.rx = bytes(self.rx), bytearray()
+                    self.stats['commands'] += 1
+                    self._send(self.regulator.handle_line(line))
+            elif self.skipping:
+                continue
+            elif len(self.rx) < JSON_BUFFER_SIZE - 1:
+                self.rx.append(byte)
+            else:
+                self.rx.clear()
+                self.skipping = True
+                self._send(self.regulator.encode({'error': "Command too long", 'errorCode': ERROR_COMMUNICATION}))
+
+    def _send(self, data):
+        self.stats['frames'] += 1
+        if self.faults is not None:
+            data = self.faults.apply(data)
+        self.stats['bytes'] += len(data)
+        if self.throttle:
+            # The host has the whole frame only once it is through the wire
+            time.sleep(len(data) * 10 / self.baudrate)
+        try:
+            if self.client is not None:
+                self.client.sendall(data)
+            elif self.master is not None:
+                self._write_pty(data)
+        except OSError:
+            pass
+        if self.throttle:
+            # Only after this frame is out, as replies to what arrived
+            # meanwhile come after it
+            self._receive_while_busy()
+
+    def _receive_while_busy(self):
+        # Whatever arrived while the frame was being written. Only what fit
+        # in the input buffer, next to a line already partly read, survives
+        try:
+            if self.client is not None:
+                if not select.select([self.client], [], [], 0)[0]:
+                    return
+                data = self.client.recv(4096)
+            else:
+                data = os.read(self.master, 4096)
+        except OSError:
+            # Nothing waiting, or the host hung up, which the loop notices
+            return
+        room = max(self.rx_buffer - len(self.rx), 0)
+        if len(data) > room:
+            self.stats['overrun_bytes'] += len(data) - room
+            data = data[:room]
+        self._receive(data)
+
+    def _write_pty(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(self.master, view)
+            except BlockingIOError:
+                select.select([], [self.master], [], 1.0)
+                continue
+            view = view[written:]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulated BrewControl regulator")
+    parser.add_argument('--tcp', type=int, metavar='PORT',
+                        help="serve on a TCP port instead of a pty (connect to socket://HOST:PORT)")
+    parser.add_argument('--host', default='127.0.0.1', help="interface for --tcp (default: 127.0.0.1)")
+    parser.add_argument('--speed', type=float, default=1.0, help="device time per real second (default: 1)")
+    parser.add_argument('--replay', metavar='DIR', help="replay a recorded history instead of simulating")
+    parser.add_argument('--ambient', type=float, default=18.0, help="room temperature in °C")
+    parser.add_argument('--noise', type=float, default=0.02, help="sensor noise, standard deviation in °C")
+    parser.add_argument('--sensor-dropout', type=float, default=0.0,
+                        help="probability that a sensor reading fails")
+    parser.add_argument('--drop', type=float, default=0.0, help="probability that a sent byte is lost")
+    parser.add_argument('--garble', type=float, default=0.0, help="probability that a frame is garbled")
+    parser.add_argument('--junk', type=float, default=0.0,
+                        help="probability of line noise in front of a frame")
+    parser.add_argument('--baudrate', type=int, default=115200)
+    parser.add_argument('--unthrottled', action='store_true',
+                        help="send as fast as the host reads instead of at the baud rate")
+    parser.add_argument('--rx-buffer', type=int, default=JSON_BUFFER_SIZE,
+                        help="bytes received while writing that are kept (default: 2048; 64 for old firmware)")
+    parser.add_argument('--seed', type=int, help="seed for noise and faults, for repeatable runs")
+    args = parser.parse_args(argv)
+
+    replay = ReplaySource(os.path.expanduser(args.replay)) if args.replay else None
+    regulator = SimulatedRegulator(replay=replay, speed=args.speed, noise=args.noise,
+                                   sensor_dropout=args.sensor_dropout, ambient=args.ambient,
+                                   seed=args.seed)
+    faults = None
+    if args.drop or args.garble or args.junk:
+        faults = FaultInjector(args.drop, args.garble, args.junk, args.seed)
+    link = SimulatorLink(regulator, faults, args.baudrate, throttle=not args.unthrottled,
+                         rx_buffer=args.rx_buffer)
+    if args.tcp is not None:
+        address = link.open_tcp(args.tcp, args.host)
+    else:
+        address = link.open_pty()
+    print(f"Simuleret regulator på {address}", flush=True)
+    try:
+        link.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    stats = ', '.join(f"{key} {value}" for key, value in sorted(link.stats.items()))
+    if faults is not None:
+        stats += ', ' + ', '.join(f"{key} {value}" for key, value in sorted(faults.counts.items()))
+    print(f"Stoppet: {stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+def index_records(records, id_keys):
+    """Map each record to its id, trying id_keys in order and falling back
+    to the position in the list"""
+    index = {}
+    for position, record in enumerate(records or ()):
+        record_id = position
+        for key in id_keys:
+            if key in record:
+                record_id = record[key]
+                break
+        index[record_id] = record
+    return index
+
+
+def merge_status(base, frame):
+    """Complete status from the previous one and a new frame.
+
+    Records in frame replace those with the same id in base; a frame marked
+    "delta" (a changesOnly frame from a subscription) only carries changed
+    records, so the rest are taken from base. The configuration is kept
+    from base when frame leaves it out. Neither argument is modified.
+    """
+    merged = dict(frame)
+    if frame.get('delta'):
+        for key, id_keys in (('sensors', ('sensor_id',)),
+                             ('thermostats', ('regulator_id',)),
+                             ('alarms', ('regulator_id', 'thermostatIndex'))):
+            if key in base:
+                records = index_records(base[key], id_keys)
+                records.update(index_records(frame.get(key), id_keys))
+                merged[key] = [records[i] for i in sorted(records)]
+        del merged['delta']
+    if 'config' not in frame and 'config' in base:
+        merged['config'] = base['config']
+    return merged
+
+
+class StatusSnapshot:
+    """A status frame indexed once by id so lookups are O(1).
+
+    thermostats and alarms are keyed by regulator_id (the firmware's alarm
+    records may use thermostatIndex instead) and sensors by sensor_id.
+    """
+
+    __slots__ = ('frame', 'thermostats', 'sensors', 'alarms')
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.thermostats = index_records(frame.get('thermostats'), ('regulator_id',))
+        self.sensors = index_records(frame.get('sensors'), ('sensor_id',))
+        self.alarms = index_records(frame.get('alarms'), ('regulator_id', 'thermostatIndex'))
+
+    def thermostat(self, regulator_id):
+        return self.thermostats.get(regulator_id)
+
+    def sensor(self, sensor_id):
+        return self.sensors.get(sensor_id)
+
+    def alarm(self, regulator_id):
+        return self.alarms.get(regulator_id)
+
+    def sensor_for(self, regulator_id):
+        """Sensor record the given thermostat regulates on, if reported"""
+        thermostat = self.thermostats.get(regulator_id)
+        if thermostat is None:
+            return None
+        return self.sensors.get(thermostat.get('sensorIndex'))
@@ -0,0 +1,338 @@
+"""Local fan-out of regulator status to any number of clients.
+
+Clients connect over plain TCP (one JSON object per line) or as WebSocket
+clients (one JSON object per text message) on the same port. Every status
+frame the acquisition core receives is republished to all of them; the
+server never talks to the regulator on its own, so clients add no load on
+the serial link.
+
+A client that cannot keep up only ever gets the newest frame: frames that
+arrive while it is still writing replace each other instead of queueing.
+
+With allow_commands, clients may also send commands as JSON objects. They
+go through the core's command queue like the GUI's, and the reply comes
+back as {"id": ..., "response": {...}} or {"id": ..., "error": "..."},
+where id is whatever the client put in the command's "id" field. Without
+it the server is read-only and every command gets an error reply.
+
+Browsers send an Origin header with every WebSocket upgrade, and any web
+page may try to connect to localhost. Upgrades from an origin not in
+allowed_origins are therefore refused; clients that send no Origin, such
+as scripts, are let in.
+"""
+import asyncio
+import base64
+import concurrent.futures
+import hashlib
+import json
+import struct
+import threading
+from collections import deque
+
+from acquisition import EVENT_FRAME
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Replies waiting for a slow client beyond this are dropped, oldest first
+MAX_QUEUED_REPLIES = 100
+# Largest command line or WebSocket message accepted from a client
+MAX_MESSAGE_SIZE = 64 * 1024
+# How long a new connection may take to send a WebSocket upgrade request
+# before it is treated as a plain TCP client
+HANDSHAKE_TIMEOUT = 0.5
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+OP_TEXT = 0x1
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+class ClientConnection:
+    """One connected client with its own latest-frame slot and reply queue"""
+
+    def __init__(self, reader, writer, websocket=False):
+        self.reader = reader
+        self.writer = writer
+        self.websocket = websocket
+        self.peer = writer.get_extra_info('peername')
+        self.latest = None
+        self.replies = deque(maxlen=MAX_QUEUED_REPLIES)
+        self.wakeup = asyncio.Event()
+        self.frames_sent = 0
+        self.frames_dropped = 0
+
+    def publish(self, payload):
+        if self.latest is not None:
+            self.frames_dropped += 1
+        self.latest = payload
+        self.wakeup.set()
+
+    def reply(self, payload):
+        self.replies.append(payload)
+        self.wakeup.set()
+
+    async def send_loop(self):
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.replies:
+                    self.write_message(self.replies.popleft())
+                if self.latest is not None:
+                    payload, self.latest = self.latest, None
+                    self.write_message(payload)
+                    self.frames_sent += 1
+                # Backpressure: while this waits, newer frames replace latest
+                await self.writer.drain()
+        except ConnectionError:
+            # The reader side notices too and cleans up
+            pass
+
+    def write_message(self, payload):
+        if self.websocket:
+            self.writer.write(websocket_frame(OP_TEXT, payload))
+        else:
+            self.writer.write(payload + b'\n')
+
+    async def read_message(self):
+        """Next message from the client, or None when it has gone away"""
+        if not self.websocket:
+            line = await self.reader.readline()
+            return line if line else None
+        while True:
+            opcode, payload = await read_websocket_frame(self.reader)
+            if opcode is None or opcode == OP_CLOSE:
+                return None
+            if opcode == OP_PING:
+                self.writer.write(websocket_frame(OP_PONG, payload))
+            elif opcode == OP_TEXT:
+                return payload
+
+
+class StatusServer:
+    """Republishes an AcquisitionCore's frames to local TCP/WebSocket clients.
+
+    Runs its own event loop in a background thread; start() and stop() may
+    be called from any thread.
+    """
+
+    def __init__(self, core, host=DEFAULT_HOST, port=DEFAULT_PORT, allow_commands=False,
+                 allowed_origins=()):
+        self.core = core
+        self.host = host
+        self.port = port
+        self.allow_commands = allow_commands
+        # Exact origins, e.g. "http://localhost:8000"
+        self.allowed_origins = set(allowed_origins)
+        self.clients = set()
+        self.handlers = {}
+        self.loop = None
+        self.thread = None
+        self.server = None
+
+    @property
+    def running(self):
+        return self.server is not None
+
+    def start(self):
+        """Start listening; raises OSError if the port cannot be bound"""
+        if self.running:
+            return
+        self.loop = asyncio.new_event_loop()
+        started = concurrent.futures.Future()
+        self.thread = threading.Thread(target=self._run, args=(started,), name="StatusServer", daemon=True)
+        self.thread.start()
+        try:
+            started.result()
+        except Exception:
+            self.thread.join()
+            self.loop.close()
+            self.loop = None
+            raise
+        self.core.subscribe(self._on_event)
+
+    def stop(self):
+        if not self.running:
+            return
+        self.core.unsubscribe(self._on_event)
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
+        self.server = None
+
+    def _run(self, started):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle_client, self.host, self.port))
+        except Exception as e:
+            started.set_exception(e)
+            return
+        started.set_result(None)
+        self.loop.run_forever()
+
+    async def _shutdown(self):
+        self.server.close()
+        # Closing the transports ends every handler's read loop. Handler
+        # tasks are not cancelled, as asyncio's stream callback reports
+        # cancelled handlers as errors
+        for writer in list(self.handlers.values()):
+            writer.close()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        await self.server.wait_closed()
+
+    def _on_event(self, event, data):
+        # Called in the serial thread
+        if event == EVENT_FRAME:
+            self._call_soon(self._publish, data)
+
+    def _call_soon(self, callback, *args):
+        """Hand work to the server's loop from another thread. Dropped once
+        stop() has taken the loop away or closed it"""
+        loop = self.loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # Closed after the check above
+            pass
+
+    def _publish(self, frame):
+        # Encoded once, however many clients there are
+        payload = json.dumps(frame, separators=(',', ':'), ensure_ascii=False).encode()
+        for client in self.clients:
+            client.publish(payload)
+
+    async def _handle_client(self, reader, writer):
+        handler = asyncio.current_task()
+        self.handlers[handler] = writer
+        try:
+            await self._serve_client(reader, writer)
+        finally:
+            del self.handlers[handler]
+            writer.close()
+
+    async def _serve_client(self, reader, writer):
+        # Plain TCP clients may never send anything, so only wait briefly
+        # for a WebSocket upgrade request
+        try:
+            first = await asyncio.wait_for(reader.readline(), HANDSHAKE_TIMEOUT)
+        except asyncio.TimeoutError:
+            first = b''
+        except (ConnectionError, ValueError):
+            return
+        websocket = first.startswith(b'GET ')
+        if websocket and not await self._accept_websocket(reader, writer):
+            return
+
+        client = ClientConnection(reader, writer, websocket)
+        self.clients.add(client)
+        if self.core.frame:
+            client.publish(json.dumps(self.core.frame, separators=(',', ':'), ensure_ascii=False).encode())
+        sender = asyncio.ensure_future(client.send_loop())
+        try:
+            message = await client.read_message() if websocket or not first else first
+            while message is not None:
+                if len(message) > MAX_MESSAGE_SIZE:
+                    break
+                if message.strip():
+                    self._handle_command(client, message)
+                message = await client.read_message()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self.clients.discard(client)
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+
+    def _handle_command(self, client, message):
+        try:
+            command = json.loads(message)
+        except ValueError as e:
+            client.reply(json.dumps({"error": f"Invalid JSON: {e}"}).encode())
+            return
+        if not isinstance(command, dict) or 'command' not in command:
+            client.reply(json.dumps({"error": "Missing command"}).encode())
+            return
+        request_id = command.pop('id', None)
+        if not self.allow_commands:
+            client.reply(json.dumps({"id": request_id, "error": "Commands are not allowed on this server"}).encode())
+            return
+        command.pop('seq', None)
+
+        def done(pending):
+            if pending.error is not None:
+                reply = {"id": request_id, "error": str(pending.error)}
+            else:
+                reply = {"id": request_id, "response": pending.response}
+            payload = json.dumps(reply, separators=(',', ':'), ensure_ascii=False).encode()
+            self._call_soon(client.reply, payload)
+
+        if self.core.send(command, callback=done) is None:
+            client.reply(json.dumps({"id": request_id, "error": "Ikke forbundet til enhed"}).encode())
+
+    async def _accept_websocket(self, reader, writer):
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if not line or line in (b'\r\n', b'\n'):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        key = headers.get('sec-websocket-key')
+        if headers.get('upgrade', '').lower() != 'websocket' or not key:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+            return False
+        origin = headers.get('origin')
+        if origin is not None and origin not in self.allowed_origins:
+            # A web page the user happens to have open, not one of ours
+            writer.write(b'HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\n\r\n')
+            return False
+        accept = base64.b64encode(hashlib.sha1(key.encode() + WEBSOCKET_GUID).digest())
+        writer.write(b'HTTP/1.1 101 Switching Protocols\r\n'
+                     b'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                     b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        await writer.drain()
+        return True
+
+
+def websocket_frame(opcode, payload):
+    """A single unmasked, unfragmented server frame"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+async def read_websocket_frame(reader):
+    """(opcode, payload) of the next client frame, or (None, None) at EOF.
+
+    Fragmented messages are not used by browsers for messages this small
+    and are not supported.
+    """
+    try:
+        first, second = await reader.readexactly(2)
+    except asyncio.IncompleteReadError:
+        return None, None
+    opcode = first & 0x0F
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack('!H', await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack('!Q', await reader.readexactly(8))
+    if length > MAX_MESSAGE_SIZE:
+        raise ValueError("WebSocket message too large")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
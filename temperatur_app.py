@@ -1,16 +1,39 @@
 import sys
 from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, 
                              QLabel, QPushButton, QDialog, QLineEdit, 
-                             QDoubleSpinBox, QFormLayout, QTextEdit, QTabWidget)
+                             QDoubleSpinBox, QFormLayout, QTabWidget)
 from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QFont
 import random
 from datetime import datetime
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba
+from matplotlib.patches import Polygon
+import time
 from collections import deque
 
+import numpy as np
+
+from downsample import minmax_indices, transitions, any_between
+from history import ChannelHistory, EVENT_NONE, EVENT_START, EVENT_STOP
+from log_view import LogView, INFO, WARNING
+from metrics import Metrics
+from metrics_view import MetricsView, StallMonitor
+
+# Maks antal linjer i alarm- og parameterlog
+LOG_LINES = 5000
+
+# Historik til grafer: et døgn ved 1 måling pr. sekund
+HISTORY_CAPACITY = 24 * 60 * 60
+
+# Farver for temperaturkurven
+NORMAL_COLOR = np.array(to_rgba('g'))
+ALARM_COLOR = np.array(to_rgba('r'))
+
 class ParameterDialog(QDialog):
     def __init__(self, names, setpoints, parent=None):
         super().__init__(parent)
@@ -60,13 +83,14 @@ class AlarmLogDialog(QDialog):
         
         layout = QVBoxLayout()
         
-        self.log_text = QTextEdit()
-        self.log_text.setReadOnly(True)
+        self.log_text = LogView(max_lines=LOG_LINES)
         self.log_text.setFont(QFont('Courier', 10))
         
         # Vis alarm log
-        log_content = "\n".join(alarm_log) if alarm_log else "Ingen alarmer endnu"
-        self.log_text.setPlainText(log_content)
+        for level, entry in alarm_log:
+            self.log_text.append(entry, level)
+        if not alarm_log:
+            self.log_text.append("Ingen alarmer endnu")
         
         layout.addWidget(QLabel('Alarm Historie:'))
         layout.addWidget(self.log_text)
@@ -86,12 +110,13 @@ class ParameterLogDialog(QDialog):
         
         layout = QVBoxLayout()
         
-        self.log_text = QTextEdit()
-        self.log_text.setReadOnly(True)
+        self.log_text = LogView(max_lines=LOG_LINES)
         self.log_text.setFont(QFont('Courier', 10))
         
-        log_content = "\n".join(param_log) if param_log else "Ingen parameter ændringer endnu"
-        self.log_text.setPlainText(log_content)
+        for entry in param_log:
+            self.log_text.append(entry)
+        if not param_log:
+            self.log_text.append("Ingen parameter ændringer endnu")
         
         layout.addWidget(QLabel('Parameter Historie:'))
         layout.addWidget(self.log_text)
@@ -102,8 +127,24 @@ class ParameterLogDialog(QDialog):
         
         self.setLayout(layout)
 
+class MetricsDialog(QDialog):
+    def __init__(self, metrics, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle('Ydelse')
+        self.setModal(True)
+        self.resize(700, 400)
+        
+        layout = QVBoxLayout()
+        layout.addWidget(MetricsView(metrics))
+        
+        close_btn = QPushButton('Luk')
+        close_btn.clicked.connect(self.accept)
+        layout.addWidget(close_btn)
+        
+        self.setLayout(layout)
+
 class GraphDialog(QDialog):
-    def __init__(self, names, temp_history, setpoint_history, alarm_history, parent=None):
+    def __init__(self, names, history, parent=None):
         super().__init__(parent)
         self.setWindowTitle('Temperatur Grafer')
         self.resize(800, 600)
@@ -115,6 +156,13 @@ class GraphDialog(QDialog):
         self.tabs = QTabWidget()
         self.canvases = []
         self.axes = []
+        self.artists = []
+        # Gemt baggrund (akser, gitter, legend) pr. graf til blitting
+        self.backgrounds = [None] * 3
+        # Om grafen følger de nyeste data, eller brugeren har zoomet/panoreret
+        self.following = [True] * 3
+        self.rescaling = False
+        self.redraw_pending = False
         
         for i in range(3):
             tab = QWidget()
@@ -124,14 +172,21 @@ class GraphDialog(QDialog):
             fig = Figure(figsize=(10, 6))
             canvas = FigureCanvas(fig)
             ax = fig.add_subplot(111)
+            canvas.mpl_connect('draw_event', lambda event, i=i: self.on_draw(i))
+            canvas.mpl_connect('resize_event', lambda event, i=i: self.schedule_redraw())
             
             self.canvases.append(canvas)
             self.axes.append(ax)
+            self.artists.append(self.init_axes(ax, names[i]))
+            ax.callbacks.connect('xlim_changed', lambda ax, i=i: self.on_xlim_changed(i))
             
+            tab_layout.addWidget(NavigationToolbar(canvas, tab))
             tab_layout.addWidget(canvas)
             tab.setLayout(tab_layout)
             self.tabs.addTab(tab, names[i])
         
+        # Skjulte grafer opdateres ikke, så et skift af fane tegner forfra
+        self.tabs.currentChanged.connect(lambda i: self.update_graph(i, rescale=True))
         layout.addWidget(self.tabs)
         
         close_btn = QPushButton('Luk')
@@ -145,72 +200,179 @@ class GraphDialog(QDialog):
         self.update_timer.timeout.connect(self.update_graphs)
         self.update_timer.start(2000)
         
-        self.update_graphs()
+        self.update_graph(self.tabs.currentIndex(), rescale=True)
+    
+    def init_axes(self, ax, name):
+        # Kunstnerne oprettes én gang; update_graphs udskifter kun deres data.
+        # De dynamiske er animated, så de ikke kommer med i den gemte baggrund
+        artists = {}
+        
+        # Hele temperaturkurven er én LineCollection med farve og
+        # linjebredde pr. segment
+        artists['temp'] = LineCollection(np.empty((0, 2, 2)), zorder=3, animated=True)
+        ax.add_collection(artists['temp'])
+        
+        # Stjerner kun for alarm start/stop
+        artists['start'] = ax.scatter(np.empty(0), np.empty(0), marker='*', s=150, color='red',
+                                      label='Alarm START', zorder=5, animated=True)
+        artists['stop'] = ax.scatter(np.empty(0), np.empty(0), marker='*', s=150, color='green',
+                                     label='Alarm STOP', zorder=5, animated=True)
+        
+        # Sætpunkt
+        artists['setpoint'], = ax.plot([], [], 'b--', label='Sætpunkt', linewidth=2, animated=True)
+        
+        # Normal område
+        artists['band'] = Polygon(np.empty((0, 2)), closed=True, alpha=0.2, animated=True,
+                                  facecolor='lightgreen', edgecolor='none', label='Normal område')
+        ax.add_patch(artists['band'])
+        
+        # Tilføj legend labels manuelt
+        ax.plot([], [], 'g-', label='Temperatur (Normal)', linewidth=2)
+        ax.plot([], [], 'r-', label='Temperatur (ALARM)', linewidth=3)
+        
+        artists['title'] = ax.set_title(f'{name} - Temperatur over tid')
+        ax.set_xlabel('Tid (målinger)')
+        ax.set_ylabel('Temperatur (°C)')
+        # Legenden skal ligge over kurverne og tegnes derfor også ved blitting.
+        # Fast placering, da 'best' ville søge gennem alle data hver gang
+        artists['legend'] = ax.legend(loc='upper left')
+        artists['legend'].set_animated(True)
+        ax.grid(True, alpha=0.3)
+        return artists
     
     def update_graphs(self):
-        if not self.parent_app:
+        if not self.parent_app or not self.isVisible():
             return
-            
-        for i in range(3):
-            ax = self.axes[i]
-            ax.clear()
-            
-            temp_history = self.parent_app.temp_history[i]
-            setpoint_history = self.parent_app.setpoint_history[i]
-            alarm_history = self.parent_app.alarm_history[i]
-            
-            if len(temp_history) > 0:
-                times = list(range(len(temp_history)))
-                temps = list(temp_history)
-                setpoints = list(setpoint_history)
-                alarms = list(alarm_history)
-                
-                # Plot kontinuerlig temperaturlinje med segmenter
-                for j in range(len(times) - 1):
-                    x_seg = [times[j], times[j + 1]]
-                    y_seg = [temps[j], temps[j + 1]]
-                    
-                    if alarms[j] or alarms[j + 1]:  # Hvis et af punkterne er i alarm
-                        ax.plot(x_seg, y_seg, 'r-', linewidth=3)
-                    else:
-                        ax.plot(x_seg, y_seg, 'g-', linewidth=2)
-                
-                # Tilføj stjerner kun for alarm start/stop
-                alarm_events = self.parent_app.alarm_events[i]
-                events = list(alarm_events)
-                
-                start_times = [t for t, e in zip(times, events) if e == 'start']
-                start_temps = [temp for temp, e in zip(temps, events) if e == 'start']
-                if start_times:
-                    ax.scatter(start_times, start_temps, marker='*', s=150, color='red', 
-                              label='Alarm START', zorder=5)
-                
-                stop_times = [t for t, e in zip(times, events) if e == 'stop']
-                stop_temps = [temp for temp, e in zip(temps, events) if e == 'stop']
-                if stop_times:
-                    ax.scatter(stop_times, stop_temps, marker='*', s=150, color='green', 
-                              label='Alarm STOP', zorder=5)
-                
-                # Plot sætpunkt
-                ax.plot(times, setpoints, 'b--', label='Sætpunkt', linewidth=2)
-                
-                # Normal område
-                ax.fill_between(times, 
-                               [sp - 2 for sp in setpoints], 
-                               [sp + 2 for sp in setpoints], 
-                               alpha=0.2, color='lightgreen', label='Normal område')
-                
-                # Tilføj legend labels manuelt
-                ax.plot([], [], 'g-', label='Temperatur (Normal)', linewidth=2)
-                ax.plot([], [], 'r-', label='Temperatur (ALARM)', linewidth=3)
-            
-            ax.set_title(f'{self.parent_app.names[i]} - Temperatur over tid')
-            ax.set_xlabel('Tid (målinger)')
-            ax.set_ylabel('Temperatur (°C)')
-            ax.legend()
-            ax.grid(True, alpha=0.3)
-            
-            self.canvases[i].draw()
+        started = time.perf_counter()
+        self.update_graph(self.tabs.currentIndex())
+        self.parent_app.metrics.observe('graph_update_seconds', time.perf_counter() - started)
+    
+    def update_graph(self, i, rescale=False):
+        if not self.parent_app or i < 0:
+            return
+        ax = self.axes[i]
+        artists = self.artists[i]
+        canvas = self.canvases[i]
+        
+        # Titlen er en del af baggrunden og kræver fuld gentegning ved ændring
+        title = f'{self.parent_app.names[i]} - Temperatur over tid'
+        if artists['title'].get_text() != title:
+            artists['title'].set_text(title)
+            self.backgrounds[i] = None
+        
+        history = self.parent_app.history[i].view()
+        n = len(history.temperatures)
+        if n == 0:
+            if rescale:
+                canvas.draw_idle()
+            return
+        
+        temps = history.temperatures
+        setpoints = history.setpoints
+        alarms = history.alarms
+        
+        # Akserne skaleres kun når data forlader det viste område, og
+        # aldrig mens brugeren har zoomet
+        if self.following[i]:
+            low = min(temps.min(), setpoints.min() - 2)
+            high = max(temps.max(), setpoints.max() + 2)
+            x_min, x_max = ax.get_xlim()
+            y_min, y_max = ax.get_ylim()
+            if rescale or n - 1 > x_max or low < y_min or high > y_max:
+                self.rescale(ax, n, low, high)
+                self.backgrounds[i] = None
+        
+        # Kun det synlige udsnit tegnes, decimeret til ca. to punkter pr.
+        # pixel. Alarm start/stop og sætpunktsskift bevares altid
+        x_min, x_max = ax.get_xlim()
+        first = min(max(int(np.floor(x_min)) - 1, 0), n - 1)
+        last = min(max(int(np.ceil(x_max)) + 2, first + 1), n)
+        keep = np.concatenate((
+            np.flatnonzero(history.events[first:last] != EVENT_NONE),
+            transitions(setpoints[first:last]),
+        ))
+        index = first + minmax_indices(temps[first:last], ax.bbox.width, keep)
+        times = index.astype(np.float64)
+        temps = temps[index]
+        setpoints = setpoints[index]
+        
+        # Segmentet mellem to viste punkter er rødt hvis blot én af de
+        # mellemliggende målinger er i alarm. Segmenter med samme farve
+        # samles til én polylinje
+        segment_alarms = any_between(alarms, index)
+        starts = np.flatnonzero(np.diff(segment_alarms)) + 1
+        if len(segment_alarms):
+            starts = np.concatenate(([0], starts))
+        ends = np.append(starts[1:], len(index) - 1)[:len(starts)]
+        points = np.column_stack((times, temps))
+        run_alarms = segment_alarms[starts]
+        artists['temp'].set_segments([points[a:b + 1] for a, b in zip(starts, ends)])
+        artists['temp'].set_color(np.where(run_alarms[:, None], ALARM_COLOR, NORMAL_COLOR))
+        artists['temp'].set_linewidth(np.where(run_alarms, 3, 2))
+        
+        events = history.events[index]
+        starts = events == EVENT_START
+        artists['start'].set_offsets(np.column_stack((times[starts], temps[starts])))
+        stops = events == EVENT_STOP
+        artists['stop'].set_offsets(np.column_stack((times[stops], temps[stops])))
+        
+        artists['setpoint'].set_data(times, setpoints)
+        artists['band'].set_xy(np.concatenate((
+            np.column_stack((times, setpoints - 2)),
+            np.column_stack((times[::-1], setpoints[::-1] + 2)),
+        )))
+        
+        if self.backgrounds[i] is None:
+            # Fuld gentegning; on_draw gemmer den nye baggrund
+            canvas.draw_idle()
+        else:
+            canvas.restore_region(self.backgrounds[i])
+            self.draw_dynamic(i)
+            canvas.blit(canvas.figure.bbox)
+    
+    def rescale(self, ax, n, low, high):
+        # Plads til ca. 10% flere målinger og lidt luft over og under, så
+        # nye data normalt kan blittes uden at skalere igen
+        margin = (high - low) * 0.05 or 1.0
+        self.rescaling = True
+        try:
+            ax.set_xlim(0, max(n * 1.1, 10))
+            ax.set_ylim(low - margin, high + margin)
+        finally:
+            self.rescaling = False
+    
+    def on_xlim_changed(self, i):
+        if self.rescaling:
+            return
+        # Zoom eller panorering fra værktøjslinjen. Grafen følger igen de
+        # nyeste data når hele historikken er synlig (f.eks. efter 'Hjem')
+        n = len(self.parent_app.history[i]) if self.parent_app else 0
+        x_min, x_max = self.axes[i].get_xlim()
+        self.following[i] = bool(x_min <= 0 and x_max >= n - 1)
+        self.backgrounds[i] = None
+        self.schedule_redraw()
+    
+    def schedule_redraw(self):
+        # Samler flere ændringer (f.eks. under panorering) til én opdatering
+        if not self.redraw_pending:
+            self.redraw_pending = True
+            QTimer.singleShot(0, self.redraw)
+    
+    def redraw(self):
+        self.redraw_pending = False
+        if self.isVisible():
+            self.update_graph(self.tabs.currentIndex())
+    
+    def on_draw(self, i):
+        canvas = self.canvases[i]
+        self.backgrounds[i] = canvas.copy_from_bbox(canvas.figure.bbox)
+        self.draw_dynamic(i)
+    
+    def draw_dynamic(self, i):
+        ax = self.axes[i]
+        artists = self.artists[i]
+        for name in ('band', 'setpoint', 'temp', 'start', 'stop', 'legend'):
+            ax.draw_artist(artists[name])
     
     def closeEvent(self, event):
         self.update_timer.stop()
@@ -223,21 +385,21 @@ class TemperaturApp(QWidget):
         self.setpoints = [22.0, 21.0, 20.0]
         self.temperatures = [22.5, 21.8, 20.2]
         self.alarm_states = [False, False, False]
-        self.alarm_log = []
-        self.param_log = []
+        self.alarm_log = deque(maxlen=LOG_LINES)  # (niveau, tekst)
+        self.param_log = deque(maxlen=LOG_LINES)
         
-        # Historik for grafer (max 100 punkter)
-        self.temp_history = [deque(maxlen=100) for _ in range(3)]
-        self.setpoint_history = [deque(maxlen=100) for _ in range(3)]
-        self.alarm_history = [deque(maxlen=100) for _ in range(3)]
-        self.alarm_events = [deque(maxlen=100) for _ in range(3)]  # Kun alarm start/stop
+        # Historik for grafer: tid, temperatur, sætpunkt, alarm og hændelse
+        # (alarm start/stop) i forhåndsallokerede arrays
+        self.history = [ChannelHistory(HISTORY_CAPACITY) for _ in range(3)]
         
         # Initialiser historik
+        now = time.time()
         for i in range(3):
-            self.temp_history[i].append(self.temperatures[i])
-            self.setpoint_history[i].append(self.setpoints[i])
-            self.alarm_history[i].append(False)
-            self.alarm_events[i].append(None)  # None = ingen ændring
+            self.history[i].append(now, self.temperatures[i], self.setpoints[i], False)
+        
+        # Tid brugt på grafopdateringer og blokeringer af GUI-tråden
+        self.metrics = Metrics()
+        self.stall_monitor = StallMonitor(self.metrics, self)
         
         self.initUI()
         
@@ -266,8 +428,11 @@ class TemperaturApp(QWidget):
         alarm_log_btn.clicked.connect(self.open_alarm_log)
         graph_btn = QPushButton('Grafer')
         graph_btn.clicked.connect(self.open_graphs)
+        metrics_btn = QPushButton('Ydelse')
+        metrics_btn.clicked.connect(self.open_metrics)
         button_layout2.addWidget(alarm_log_btn)
         button_layout2.addWidget(graph_btn)
+        button_layout2.addWidget(metrics_btn)
         
         layout.addLayout(button_layout1)
         layout.addLayout(button_layout2)
@@ -290,25 +455,24 @@ class TemperaturApp(QWidget):
     
     def update_temperatures(self):
         # Simuler temperaturændringer
+        now = time.time()
         for i in range(3):
             old_alarm = self.alarm_states[i]
             self.temperatures[i] += random.uniform(-0.5, 0.5)
             
-            # Tilføj til historik
-            self.temp_history[i].append(self.temperatures[i])
-            self.setpoint_history[i].append(self.setpoints[i])
-            
             # Check alarm status
             alarm = abs(self.temperatures[i] - self.setpoints[i]) > 2.0
-            self.alarm_history[i].append(alarm)
             
             # Registrer kun alarm ændringer
             if alarm and not old_alarm:
-                self.alarm_events[i].append('start')  # Alarm starter
+                event = EVENT_START  # Alarm starter
             elif not alarm and old_alarm:
-                self.alarm_events[i].append('stop')   # Alarm stopper
+                event = EVENT_STOP   # Alarm stopper
             else:
-                self.alarm_events[i].append(None)    # Ingen ændring
+                event = EVENT_NONE   # Ingen ændring
+            
+            # Tilføj til historik
+            self.history[i].append(now, self.temperatures[i], self.setpoints[i], alarm, event)
         
         self.update_display()
     
@@ -329,12 +493,12 @@ class TemperaturApp(QWidget):
                 self.alarm_states[i] = True
                 deviation = temp - setpoint
                 log_entry = f'{current_time} - ALARM START: {name} ({temp:.1f}°C, afvigelse: {deviation:+.1f}°C)'
-                self.alarm_log.append(log_entry)
+                self.alarm_log.append((WARNING, log_entry))
             elif not alarm and self.alarm_states[i]:
                 # Alarm cleared
                 self.alarm_states[i] = False
                 log_entry = f'{current_time} - ALARM CLEAR: {name} ({temp:.1f}°C, normaliseret)'
-                self.alarm_log.append(log_entry)
+                self.alarm_log.append((INFO, log_entry))
             
             text = f'{name}: {temp:.1f}°C (Sæt: {setpoint:.1f}°C)'
             if alarm:
@@ -376,7 +540,11 @@ class TemperaturApp(QWidget):
         dialog.exec_()
     
     def open_graphs(self):
-        dialog = GraphDialog(self.names, self.temp_history, self.setpoint_history, self.alarm_history, self)
+        dialog = GraphDialog(self.names, self.history, self)
+        dialog.exec_()
+    
+    def open_metrics(self):
+        dialog = MetricsDialog(self.metrics, self)
         dialog.exec_()
 
 if __name__ == '__main__':
@@ -0,0 +1,102 @@
+import pytest
+
+from autotune import (CONTROLLER_MANUAL, PHASE_FAILED, PHASE_STEP, TUNING_RULES, AutoTuner, fit_fopdt,
+                      pid_gains)
+from simulator import ThermalPlant
+
+
+def step_test(gain=80.0, tau=600.0, dead_time=30.0, duration=3000, step_at=60, output=127.5):
+    plant = ThermalPlant(gain=gain, tau=tau, dead_time=dead_time, ambient=18.0)
+    t, temperature, outputs = [], [], []
+    for second in range(duration):
+        value = 0.0 if second < step_at else output
+        temperature.append(plant.step(value / 255, 1.0))
+        t.append(plant.time)
+        outputs.append(value)
+    return t, temperature, outputs
+
+
+def test_fit_recovers_the_plant():
+    model = fit_fopdt(*step_test())
+    # Gain per output unit; the plant's is per full power
+    assert model.gain == pytest.approx(80.0 / 255, rel=0.1)
+    assert model.tau == pytest.approx(600.0, rel=0.1)
+    # The fit runs on bin averages, so the dead time is good to about a bin
+    assert model.dead_time == pytest.approx(30.0, abs=1.5 * model.sample_time)
+    assert model.r2 > 0.999
+
+
+def test_fit_rejects_unusable_tests():
+    t, temperature, output = step_test(duration=10, step_at=5)
+    with pytest.raises(ValueError):
+        fit_fopdt(t, temperature, output)
+    t, temperature, output = step_test(duration=600, step_at=1000)
+    with pytest.raises(ValueError):
+        fit_fopdt(t, temperature, output)
+
+
+@pytest.mark.parametrize('rule', TUNING_RULES)
+def test_gains_are_positive(rule):
+    gains = pid_gains(fit_fopdt(*step_test()), rule)
+    assert gains.kp > 0 and gains.ki > 0 and gains.kd >= 0
+
+
+def test_unknown_rule():
+    with pytest.raises(ValueError):
+        pid_gains(fit_fopdt(*step_test()), 'ziegler')
+
+
+def status(timestamp, output=0.0, active=True, config=False):
+    thermostat = {'regulator_id': 0, 'currentTemp': 20.0, 'output': output, 'setpoint': 65.0,
+                  'enabled': active, 'type': CONTROLLER_MANUAL, 'outputActive': active, 'state': 1}
+    frame = {'command': 'getStatus', 'timestamp': timestamp * 1000, 'thermostats': [thermostat]}
+    if config:
+        frame['config'] = {'pids': [{'type': 0, 'setpoint': 65.0, 'enabled': True}]}
+    return frame
+
+
+def running_tuner():
+    sent = []
+
+    def send(command):
+        sent.append(command)
+        return True
+
+    tuner = AutoTuner(send, 0, baseline=10.0, step_output=128.0, clock=lambda: 0.0)
+    tuner.start()
+    tuner.handle_frame(status(0, config=True))
+    tuner.handle_frame(status(1))
+    tuner.handle_frame(status(20))
+    assert tuner.phase == PHASE_STEP
+    tuner.handle_frame(status(21, output=128.0))
+    return tuner, sent
+
+
+def restored(sent):
+    config = [c for c in sent if c['command'] == 'setConfig' and 'manualOutput' not in c][-1]
+    enable = [c for c in sent if c['command'] == 'toggleEnable'][-1]
+    return config['enabled'], enable['enabled']
+
+
+def test_abort_puts_the_thermostat_back():
+    tuner, sent = running_tuner()
+    tuner.abort()
+    assert tuner.phase == PHASE_FAILED
+    assert restored(sent) == (True, True)
+
+
+def test_output_switched_off_elsewhere_stays_off():
+    tuner, sent = running_tuner()
+    tuner.handle_frame(status(22, active=False))
+    assert tuner.phase == PHASE_FAILED
+    assert restored(sent) == (False, False)
+
+
+def test_abort_with_disable_stays_off():
+    tuner, sent = running_tuner()
+    tuner.abort("NØDSTOP", disable=True)
+    assert restored(sent) == (False, False)
+    # Nothing more is sent once it has stopped
+    count = len(sent)
+    tuner.handle_frame(status(23, output=128.0))
+    assert len(sent) == count and tuner.phase == PHASE_FAILED
@@ -0,0 +1,181 @@
+import json
+
+import pytest
+
+from command_queue import CommandError, CommandQueue, CommandTimeout
+
+
+class Link:
+    """Collects what the queue writes, with a clock the test moves"""
+
+    def __init__(self):
+        self.written = []
+        self.now = 0.0
+
+    def write(self, payload):
+        self.written.append(json.loads(payload))
+
+    def clock(self):
+        return self.now
+
+
+def make_queue(**options):
+    link = Link()
+    return CommandQueue(link.write, clock=link.clock, **options), link
+
+
+def test_reply_is_matched_by_seq():
+    queue, link = make_queue()
+    first = queue.submit({'command': 'getStatus'})
+    second = queue.submit({'command': 'getStatus'})
+    assert [c['seq'] for c in link.written] == [first.seq, second.seq]
+
+    assert queue.handle_frame({'command': 'getStatus', 'seq': second.seq, 'n': 2}) is second
+    assert second.result(0) == {'command': 'getStatus', 'seq': second.seq, 'n': 2}
+    assert not first.done()
+    assert len(queue) == 1
+
+
+def test_reply_without_seq_is_matched_by_name():
+    queue, link = make_queue(rx_budget=1000)
+    toggle = queue.submit({'command': 'toggleEnable', 'regulator_id': 0})
+    status = queue.submit({'command': 'getStatus'})
+    assert queue.handle_frame({'command': 'getStatus'}) is status
+    assert queue.handle_frame({'command': 'toggleEnable'}) is toggle
+
+
+def test_late_reply_is_ignored():
+    queue, link = make_queue()
+    queue.submit({'command': 'getStatus'})
+    assert queue.handle_frame({'command': 'getStatus', 'seq': 999}) is None
+    assert len(queue) == 1
+
+
+def test_non_object_commands_are_rejected():
+    queue, link = make_queue()
+    for command in ('getStatus', [1], None):
+        with pytest.raises(ValueError):
+            queue.submit(command)
+    assert link.written == []
+    assert len(queue) == 0
+
+
+def test_in_flight_window():
+    queue, link = make_queue(max_in_flight=2, rx_budget=1000)
+    pending = [queue.submit({'command': 'ackAlarm', 'regulator_id': i}) for i in range(3)]
+    assert len(link.written) == 2
+    queue.handle_frame({'command': 'ackAlarm', 'seq': pending[0].seq})
+    assert [c['regulator_id'] for c in link.written] == [0, 1, 2]
+
+
+def test_unanswered_commands_fit_the_receive_buffer_together():
+    queue, link = make_queue(rx_budget=64)
+    first = queue.submit({'command': 'ackAlarm', 'regulator_id': 0})
+    queue.submit({'command': 'ackAlarm', 'regulator_id': 1})
+    assert len(first.payload) * 2 > 64
+    # The oldest counts too: until its reply comes it may still be unread
+    assert len(link.written) == 1
+    queue.handle_frame({'command': 'ackAlarm', 'seq': first.seq})
+    assert len(link.written) == 2
+
+
+def test_oversized_command_is_sent_alone():
+    queue, link = make_queue(rx_budget=64)
+    big = queue.submit({'command': 'setConfig', 'regulator_id': 0, 'kp': 2.0, 'ki': 0.1, 'kd': 0.0,
+                        'setpoint': 65.0, 'type': 1, 'enabled': True})
+    assert len(big.payload) > 64
+    assert len(link.written) == 1
+    queue.submit({'command': 'getStatus'})
+    assert len(link.written) == 1
+
+
+def test_config_changes_are_pipelined():
+    queue, link = make_queue()
+    for i in range(3):
+        queue.submit({'command': 'setConfig', 'regulator_id': i, 'kp': 2.0, 'ki': 0.1, 'kd': 0.0,
+                      'setpoint': 65.0, 'type': 1, 'enabled': True})
+        queue.submit({'command': 'toggleEnable', 'regulator_id': i, 'enabled': True})
+    assert len(link.written) == 4
+
+
+def test_budget_drops_for_firmware_that_loses_pipelined_commands():
+    queue, link = make_queue()
+    first = queue.submit({'command': 'ackAlarm', 'regulator_id': 0})
+    queue.submit({'command': 'ackAlarm', 'regulator_id': 1})
+    second = link.written[-1]['seq']
+    queue.handle_frame({'error': "Invalid JSON", 'errorCode': 2000})
+    assert queue.rx_budget == 64
+    # Resent once the other one is answered, as both do not fit any more
+    assert link.written[-1]['seq'] == second
+    queue.handle_frame({'command': 'ackAlarm', 'seq': second})
+    assert link.written[-1]['seq'] == first.seq
+    queue.cancel_all()
+    assert queue.rx_budget == queue.full_rx_budget
+
+
+def test_priority_commands_go_first():
+    queue, link = make_queue(max_in_flight=1)
+    queue.submit({'command': 'getStatus'})
+    queue.submit({'command': 'setConfig', 'regulator_id': 0, 'setpoint': 65.0})
+    stops = [queue.submit({'command': 'toggleEnable', 'regulator_id': i, 'enabled': False}, priority=True)
+             for i in range(2)]
+    for _ in range(4):
+        queue.handle_frame({'seq': link.written[-1]['seq'], 'command': link.written[-1]['command']})
+    assert [c['command'] for c in link.written] == ['getStatus', 'toggleEnable', 'toggleEnable', 'setConfig']
+    assert [c['seq'] for c in link.written[1:3]] == [stop.seq for stop in stops]
+
+
+def test_timed_out_command_is_resent_then_fails():
+    queue, link = make_queue(timeout=2.0, retries=1)
+    pending = queue.submit({'command': 'getStatus'})
+    link.now = 2.5
+    queue.poll()
+    assert len(link.written) == 2
+    assert link.written[0] == link.written[1]
+    link.now = 5.0
+    assert queue.poll() is None
+    with pytest.raises(CommandTimeout):
+        pending.result(0)
+    assert pending.attempts == 2
+
+
+def test_mangled_command_is_resent():
+    queue, link = make_queue(retries=1)
+    pending = queue.submit({'command': 'getStatus'})
+    # The firmware could not parse it, so it could not echo anything
+    queue.handle_frame({'error': 'Invalid JSON', 'errorCode': 3})
+    assert not pending.done()
+    assert len(link.written) == 2
+    queue.handle_frame({'command': 'getStatus', 'seq': pending.seq})
+    assert pending.result(0)['seq'] == pending.seq
+
+
+def test_refused_command_fails_with_its_error():
+    queue, link = make_queue(retries=1)
+    pending = queue.submit({'command': 'setState', 'regulator_id': 9})
+    queue.handle_frame({'command': 'setState', 'seq': pending.seq, 'error': 'Invalid regulator', 'errorCode': 4})
+    with pytest.raises(CommandError) as error:
+        pending.result(0)
+    assert error.value.error_code == 4
+    assert len(link.written) == 1
+
+
+def test_callbacks_and_cancel_all():
+    queue, link = make_queue(max_in_flight=1)
+    finished = []
+    queue.submit({'command': 'getStatus'}, callback=finished.append)
+    queue.submit({'command': 'getStatus'}, callback=finished.append)
+    queue.cancel_all("Connection closed")
+    assert len(finished) == 2
+    assert all(isinstance(p.error, CommandError) for p in finished)
+    assert len(queue) == 0
+
+
+def test_failed_write_fails_the_command():
+    def write(payload):
+        raise OSError("port gone")
+
+    queue = CommandQueue(write)
+    pending = queue.submit({'command': 'getStatus'})
+    with pytest.raises(CommandError):
+        pending.result(0)
@@ -0,0 +1,183 @@
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from acquisition import EVENT_CONNECTED, EVENT_DISCONNECTED, EVENT_FRAME, AcquisitionCore
+from controller_manager import ControllerManager
+from simulator import SimulatedRegulator, SimulatorLink
+
+
+class Simulator:
+    """A simulated regulator served on a TCP port in a background thread"""
+
+    def __init__(self, port=0):
+        self.link = SimulatorLink(SimulatedRegulator(seed=1), throttle=False)
+        self.url = self.link.open_tcp(port)
+        self.thread = threading.Thread(target=self.link.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.link.stop()
+        self.thread.join()
+
+
+class Events:
+    def __init__(self):
+        self.events = []
+        self.condition = threading.Condition()
+
+    def __call__(self, name, event, data):
+        with self.condition:
+            self.events.append((name, event, data))
+            self.condition.notify_all()
+
+    def wait(self, name, event, match=None, timeout=10.0):
+        """Wait for such an event, if there has not been one, and return its data"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                for n, e, data in self.events:
+                    if (n, e) == (name, event) and (match is None or match(data)):
+                        return data
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise AssertionError(f"no {event} from {name}")
+                self.condition.wait(left)
+
+    def count(self, name, event):
+        with self.condition:
+            return sum(1 for n, e, _ in self.events if (n, e) == (name, event))
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = ControllerManager(str(tmp_path / 'history'))
+    events = Events()
+    manager.subscribe(events)
+    yield manager, events
+    manager.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_add_polls_and_remove(manager):
+    manager, events = manager
+    simulator = Simulator()
+    try:
+        assert manager.add('HLT', simulator.url).connected
+        # Polled or streamed without asking
+        frame = events.wait('HLT', EVENT_FRAME, lambda frame: 'thermostats' in frame)
+        assert len(frame['thermostats']) == 3
+        assert manager.status()['HLT'].thermostat(0) is not None
+        pending = manager.send('HLT', {'command': 'getStatus'})
+        assert pending.result(5)['command'] == 'getStatus'
+        assert os.path.isdir(os.path.join(manager.history_dir, 'HLT'))
+
+        manager.remove('HLT')
+        assert 'HLT' not in manager.links
+        assert manager.send('HLT', {'command': 'getStatus'}) is None
+    finally:
+        simulator.stop()
+
+
+def test_names_and_ports_are_checked(manager, tmp_path):
+    manager, events = manager
+    for name in ('../x', '/tmp/x', '', '.', 'a/b', ' HLT'):
+        with pytest.raises(ValueError):
+            manager.add(name, 'socket://127.0.0.1:1')
+    assert not os.path.exists(tmp_path / 'x')
+    simulator = Simulator()
+    try:
+        manager.add('Mæsk 1', simulator.url)
+        with pytest.raises(ValueError):
+            manager.add('Mæsk 2', simulator.url)
+        with pytest.raises(ValueError):
+            manager.add('Mæsk 1', 'socket://127.0.0.1:1')
+    finally:
+        simulator.stop()
+
+
+def test_failed_open_and_reconnect(manager):
+    manager, events = manager
+    port = free_port()
+    link = manager.add('HLT', f'socket://127.0.0.1:{port}')
+    assert not link.connected
+    assert events.wait('HLT', EVENT_DISCONNECTED)
+    assert link.error
+
+    simulator = Simulator(port)
+    try:
+        manager.reconnect('HLT')
+        assert link.connected and link.error is None
+        assert events.count('HLT', EVENT_CONNECTED) == 1
+        events.wait('HLT', EVENT_FRAME)
+    finally:
+        simulator.stop()
+
+
+def test_primary_link_runs_on_the_manager(manager):
+    manager, events = manager
+    core = AcquisitionCore(manager=manager)
+    core_events = []
+    core.subscribe(lambda event, data: core_events.append(event))
+    simulator = Simulator()
+    try:
+        core.connect(simulator.url)
+        assert core.connected and core.name in manager.links
+        events.wait(core.name, EVENT_FRAME)
+        assert EVENT_CONNECTED in core_events and EVENT_FRAME in core_events
+        assert core.send({'command': 'getStatus'}).result(5)['command'] == 'getStatus'
+        # Nothing is recorded for it by the manager; the core has its own recorder
+        assert not os.path.exists(os.path.join(manager.history_dir, core.name))
+        with pytest.raises(ValueError):
+            manager.add('HLT', simulator.url)
+
+        core.disconnect()
+        assert not core.connected and core.name not in manager.links
+        assert core_events[-1] == EVENT_DISCONNECTED
+    finally:
+        core.close()
+        simulator.stop()
+
+
+@pytest.mark.parametrize('on_manager', [False, True])
+def test_events_of_a_replaced_link_come_first(manager, on_manager):
+    manager, _ = manager
+    core = AcquisitionCore(manager=manager if on_manager else None)
+    tagged = []
+    # As CoreBridge does, tag each event in the thread that delivers it
+    core.subscribe(lambda event, data: tagged.append((core.link_id, event, data)))
+    simulator = Simulator()
+    try:
+        core.connect(f'socket://127.0.0.1:{free_port()}')
+        deadline = time.monotonic() + 10
+        while core.connected or not any(event == EVENT_DISCONNECTED for _, event, _ in tagged):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        core.connect(simulator.url)
+        deadline = time.monotonic() + 10
+        while not any(link_id == 2 and event == EVENT_FRAME for link_id, event, _ in tagged):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        # Replaced while it is running
+        core.connect(simulator.url)
+        deadline = time.monotonic() + 10
+        while (3, EVENT_CONNECTED, simulator.url) not in tagged:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+        ids = [link_id for link_id, _, _ in tagged]
+        assert ids == sorted(ids)
+        closed = [(link_id, data) for link_id, event, data in tagged if event == EVENT_DISCONNECTED]
+        assert [link_id for link_id, _ in closed] == [1, 2]
+        assert closed[0][1] and closed[1][1] is None
+    finally:
+        core.close()
+        simulator.stop()
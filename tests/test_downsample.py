@@ -0,0 +1,29 @@
+import numpy as np
+
+from downsample import any_between, minmax_indices, transitions
+
+
+def test_short_series_is_kept_whole():
+    assert list(minmax_indices(np.arange(10.0), 5)) == list(range(10))
+
+
+def test_peaks_and_ends_survive_decimation():
+    values = np.zeros(10000)
+    values[1234] = 5.0
+    values[8765] = -5.0
+    indices = minmax_indices(values, 50)
+    assert len(indices) <= 2 * 50 + 4
+    assert {0, 1234, 8765, 9999} <= set(indices)
+    assert np.all(np.diff(indices) > 0)
+
+
+def test_kept_indices_are_included():
+    values = np.sin(np.linspace(0, 20, 5000))
+    assert 2500 in minmax_indices(values, 10, keep=[2500])
+
+
+def test_transitions_and_any_between():
+    flags = np.array([False, False, True, True, False, False])
+    assert sorted(transitions(flags)) == [1, 2, 3, 4]
+    indices = np.array([0, 1, 4, 5])
+    assert list(any_between(flags, indices)) == [False, True, False]
@@ -0,0 +1,35 @@
+import numpy as np
+
+from history import EVENT_START, ChannelHistory
+
+
+def test_view_is_oldest_first_before_and_after_wrapping():
+    history = ChannelHistory(4)
+    for t in range(3):
+        history.append(t, 20.0 + t, 65.0, False)
+    assert len(history) == 3
+    assert list(history.view().times) == [0, 1, 2]
+
+    for t in range(3, 10):
+        history.append(t, 20.0 + t, 65.0, t == 8, EVENT_START if t == 8 else 0)
+    view = history.view()
+    assert len(history) == 4
+    assert list(view.times) == [6, 7, 8, 9]
+    assert list(view.temperatures) == [26.0, 27.0, 28.0, 29.0]
+    assert list(view.alarms) == [False, False, True, False]
+    assert list(view.events) == [0, 0, EVENT_START, 0]
+
+
+def test_view_does_not_copy():
+    history = ChannelHistory(8)
+    for t in range(20):
+        history.append(t, t, 0.0, False)
+    assert np.shares_memory(history.view().times, history.times)
+
+
+def test_clear():
+    history = ChannelHistory(4)
+    history.append(0, 1.0, 0.0, False)
+    history.clear()
+    assert len(history) == 0
+    assert len(history.view().times) == 0
@@ -0,0 +1,79 @@
+import pytest
+
+pytest.importorskip('PyQt5')
+
+from PyQt5.QtCore import Qt
+
+from log_view import DEBUG, INFO, WARNING, ERROR, LevelFilterModel, LogModel
+
+
+def texts(model):
+    return [model.data(model.index(row, 0)) for row in range(model.rowCount())]
+
+
+def test_append_keeps_the_newest_lines():
+    model = LogModel(max_lines=3)
+    removed = []
+    model.rowsRemoved.connect(lambda parent, first, last: removed.append((first, last)))
+    for i in range(7):
+        model.append(f"linje {i}")
+    assert model.rowCount() == 3
+    assert texts(model) == ["linje 4", "linje 5", "linje 6"]
+    # The buffer wraps around instead of growing
+    assert len(model.entries) == 3
+    assert removed == [(0, 0)] * 4
+
+
+def test_set_max_lines_shrinks_and_grows():
+    model = LogModel(max_lines=4)
+    for i in range(6):
+        model.append(f"linje {i}")
+    model.set_max_lines(2)
+    assert texts(model) == ["linje 4", "linje 5"]
+    model.set_max_lines(5)
+    for i in range(6, 10):
+        model.append(f"linje {i}")
+    assert texts(model) == [f"linje {i}" for i in range(5, 10)]
+    model.set_max_lines(0)
+    assert texts(model) == ["linje 9"]
+    model.append("linje 10")
+    assert texts(model) == ["linje 10"]
+
+
+def test_clear():
+    model = LogModel(max_lines=2)
+    for i in range(5):
+        model.append(f"linje {i}")
+    model.clear()
+    assert model.rowCount() == 0
+    model.append("ny")
+    assert texts(model) == ["ny"]
+
+
+def test_level_role():
+    model = LogModel()
+    model.append("fejl", ERROR)
+    index = model.index(0, 0)
+    assert model.data(index, LogModel.LevelRole) == ERROR
+    assert model.data(index, Qt.ForegroundRole) is not None
+    model.append("info", INFO)
+    assert model.data(model.index(1, 0), Qt.ForegroundRole) is None
+
+
+def test_level_filter_follows_trimming():
+    model = LogModel(max_lines=4)
+    proxy = LevelFilterModel()
+    proxy.setSourceModel(model)
+    levels = [DEBUG, WARNING, INFO, ERROR, DEBUG, WARNING]
+    for i, level in enumerate(levels):
+        model.append(f"linje {i}", level)
+    assert texts(proxy) == ["linje 2", "linje 3", "linje 4", "linje 5"]
+    proxy.set_min_level(WARNING)
+    assert texts(proxy) == ["linje 3", "linje 5"]
+    model.append("linje 6", ERROR)
+    model.append("linje 7", DEBUG)
+    assert texts(proxy) == ["linje 5", "linje 6"]
+    proxy.set_min_level(ERROR)
+    assert texts(proxy) == ["linje 6"]
+    proxy.set_min_level(DEBUG)
+    assert texts(proxy) == texts(model)
@@ -0,0 +1,149 @@
+import json
+
+import pytest
+
+from metrics import Metrics, escape_label, export, format_prometheus, percentile
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_metrics():
+    clock = Clock()
+    metrics = Metrics(clock=clock)
+    metrics.count('command_timeouts', 2)
+    for _ in range(20):
+        metrics.mark('frames')
+    clock.now += 5.0
+    for value in range(1, 101):
+        metrics.observe('parse_seconds', value / 1000)
+    return metrics
+
+
+def samples(text):
+    """{name with labels: value} of a Prometheus text exposition"""
+    result = {}
+    for line in text.splitlines():
+        if not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            result[name] = float(value)
+    return result
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    values = list(range(1, 11))
+    assert percentile(values, 50) == 5
+    assert percentile(values, 90) == 9
+    assert percentile(values, 99) == 10
+
+
+def test_rate_window():
+    clock = Clock()
+    metrics = Metrics(clock=clock)
+    for _ in range(20):
+        metrics.mark('frames', 2)
+        clock.now += 1.0
+    rate = metrics.snapshot()['rates']['frames']
+    assert rate['total'] == 40
+    # Nine full seconds in the window, the current one has nothing yet
+    assert rate['rate'] == pytest.approx(1.8)
+    clock.now += 30.0
+    assert metrics.snapshot()['rates']['frames']['rate'] == 0
+
+
+def test_prometheus_names_and_types():
+    text = format_prometheus(make_metrics().snapshot())
+    assert text.endswith('\n')
+    assert '# TYPE brewcontrol_command_timeouts_total counter' in text
+    assert '# TYPE brewcontrol_frames_total counter' in text
+    assert '# TYPE brewcontrol_frames_per_second gauge' in text
+    assert '# TYPE brewcontrol_parse_seconds summary' in text
+    assert samples(text) == {
+        'brewcontrol_command_timeouts_total': 2,
+        'brewcontrol_frames_total': 20,
+        'brewcontrol_frames_per_second': 4.0,
+        'brewcontrol_parse_seconds{quantile="0.5"}': 0.05,
+        'brewcontrol_parse_seconds{quantile="0.9"}': 0.09,
+        'brewcontrol_parse_seconds{quantile="0.99"}': 0.099,
+        'brewcontrol_parse_seconds_sum': 5.05,
+        'brewcontrol_parse_seconds_count': 100,
+    }
+
+
+def test_prometheus_labels():
+    text = format_prometheus(make_metrics().snapshot(), labels={'port': 'COM3'})
+    result = samples(text)
+    assert result['brewcontrol_command_timeouts_total{port="COM3"}'] == 2
+    assert result['brewcontrol_frames_per_second{port="COM3"}'] == 4.0
+    assert result['brewcontrol_parse_seconds{port="COM3",quantile="0.99"}'] == 0.099
+    assert result['brewcontrol_parse_seconds_count{port="COM3"}'] == 100
+
+
+def test_prometheus_escaping():
+    assert escape_label('\\\\.\\COM10') == '\\\\\\\\.\\\\COM10'
+    assert escape_label('a "b"\nc') == 'a \\"b\\"\\nc'
+    metrics = Metrics()
+    metrics.count('gui stalls/min-ø')
+    text = format_prometheus(metrics.snapshot(), labels={'serial port': 'say "hi"\n'})
+    assert text == ('# TYPE brewcontrol_gui_stalls_min___total counter\n'
+                    'brewcontrol_gui_stalls_min___total{serial_port="say \\"hi\\"\\n"} 1\n')
+
+
+def test_empty_histogram_has_no_quantiles():
+    snapshot = {'counters': {}, 'rates': {},
+                'histograms': {'parse_seconds': {'count': 0, 'sum': 0.0, 'max': 0.0,
+                                                 'p50': None, 'p90': None, 'p99': None}}}
+    assert samples(format_prometheus(snapshot)) == {'brewcontrol_parse_seconds_sum': 0,
+                                                    'brewcontrol_parse_seconds_count': 0}
+
+
+def test_export(tmp_path):
+    metrics = make_metrics()
+    path = str(tmp_path / 'brewcontrol.prom')
+    export(metrics, path, {'port': 'COM3'})
+    with open(path, encoding='utf-8') as f:
+        assert f.read() == format_prometheus(metrics.snapshot(), labels={'port': 'COM3'})
+
+    path = str(tmp_path / 'brewcontrol.json')
+    export(metrics, path, {'port': 'COM3'})
+    with open(path, encoding='utf-8') as f:
+        exported = json.load(f)
+    assert exported['labels'] == {'port': 'COM3'}
+    assert exported['counters'] == {'command_timeouts': 2}
+    assert exported['rates']['frames'] == {'rate': 4.0, 'total': 20}
+    assert exported['histograms']['parse_seconds']['p50'] == 0.05
+    assert 'time' in exported
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['brewcontrol.json', 'brewcontrol.prom']
+
+
+def test_stall_monitor(monkeypatch):
+    pytest.importorskip('PyQt5')
+    from PyQt5.QtCore import QCoreApplication
+    import metrics_view
+
+    # Kept referenced for the duration of the test
+    app = QCoreApplication.instance() or QCoreApplication([])  # noqa: F841
+    now = [10.0]
+    monkeypatch.setattr(metrics_view.time, 'perf_counter', lambda: now[0])
+    metrics = Metrics()
+    monitor = metrics_view.StallMonitor(metrics)
+    monitor.stop()
+    try:
+        # First run, on time, 50 ms late and blocked for 350 ms
+        for step in (0.0, 0.1, 0.15, 0.45):
+            now[0] += step
+            monitor.check()
+    finally:
+        monitor.deleteLater()
+    snapshot = metrics.snapshot()
+    histogram = snapshot['histograms']['gui_stall_seconds']
+    assert histogram['count'] == 3
+    assert histogram['max'] == pytest.approx(0.35)
+    assert histogram['sum'] == pytest.approx(0.4)
+    assert snapshot['counters'] == {'gui_stalls': 1}
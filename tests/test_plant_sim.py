@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from autotune import FopdtModel
+from plant_sim import from_model, simulate, sweep
+from simulator import CONTROLLER_MANUAL, CONTROLLER_SIMPLE, ThermalPlant
+
+
+def kettle():
+    return ThermalPlant(gain=80.0, tau=600.0, dead_time=30.0, ambient=18.0)
+
+
+def test_manual_output_follows_the_simulator_plant():
+    result = simulate(kettle(), {'type': CONTROLLER_MANUAL, 'manualOutput': 127.5}, 1200, record=True)
+    reference = kettle()
+    expected = [reference.step(0.5, 1.0) for _ in range(1200)]
+    np.testing.assert_allclose(result.temperatures[:, 0], expected, atol=1e-4)
+    assert result.metrics['energy'][0] == pytest.approx(0.5 * 1200 * 3000 / 3.6e6)
+
+
+def test_config_and_plant_arrays_broadcast():
+    plant = kettle()
+    plant.tau = np.array([300.0, 600.0, 1200.0])
+    result = simulate(plant, {'setpoint': 50.0, 'kp': np.array([[10.0], [40.0]])}, 600)
+    assert len(result) == 6
+    assert list(result.parameters['tau']) == [300.0, 600.0, 1200.0] * 2
+
+
+def test_simple_controller_switches_around_the_setpoint():
+    result = simulate(kettle(), {'type': CONTROLLER_SIMPLE, 'setpoint': 40.0, 'hysteresis': 0.5}, 3600)
+    assert result.metrics['switches'][0] > 2
+    assert result.metrics['rise_time'][0] > 0
+    assert abs(result.metrics['final_temperature'][0] - 40.0) < 3.0
+
+
+def test_sweep_ranks_every_combination():
+    result = sweep(kettle(), 3600, setpoint=50, kp=[5, 20, 80], ki=[0.01, 0.1])
+    assert len(result) == 6
+    ranked = result.rank('iae', limit=10)
+    assert len(ranked) == 6
+    assert [row['iae'] for row in ranked] == sorted(row['iae'] for row in ranked)
+    assert all(row['overshoot'] <= 1.0 for row in result.rank('iae', max_overshoot=1.0))
+    with pytest.raises(ValueError):
+        result.rank('speed')
+    with pytest.raises(ValueError):
+        sweep(kettle(), 60, colour=[1, 2])
+
+
+def test_runs_that_never_get_there_rank_last():
+    result = sweep(kettle(), 600, setpoint=[30, 200])
+    assert np.isnan(result.metrics['rise_time'][1])
+    assert [row['setpoint'] for row in result.rank('rise_time')] == [30, 200]
+
+
+def test_from_model():
+    plant = from_model(FopdtModel(0.3, 600.0, 30.0, 18.5, 0.1, 0.99, 10.0))
+    assert plant.gain == pytest.approx(0.3 * 255)
+    assert plant.ambient == plant.temperature == 18.5
@@ -0,0 +1,116 @@
+import json
+
+import pytest
+
+from acquisition import ControllerSession
+from poll_scheduler import STATE_TUNE, PollScheduler
+
+
+def status(temp=65.0, setpoint=65.0, alarm=0, state=0, sensor=20.0):
+    return {
+        'sensors': [{'sensor_id': 0, 'temperature': sensor}],
+        'thermostats': [{'regulator_id': 0, 'currentTemp': temp, 'setpoint': setpoint, 'state': state}],
+        'alarms': [{'regulator_id': 0, 'level': alarm}],
+    }
+
+
+def settle(scheduler, now=0.0, frame=None):
+    """Feed unchanged frames until the interval has backed off to the maximum"""
+    frame = frame or status()
+    intervals = [scheduler.observe(frame, now)]
+    while intervals[-1] < scheduler.max_interval:
+        now += intervals[-1]
+        intervals.append(scheduler.observe(frame, now))
+    return intervals, now
+
+
+def test_backoff_to_maximum():
+    scheduler = PollScheduler()
+    intervals, now = settle(scheduler)
+    # The first frame has nothing to compare with and counts as movement
+    assert intervals[0] == 0.5
+    for previous, interval in zip(intervals, intervals[1:-1]):
+        assert interval == pytest.approx(previous * 1.5)
+    assert intervals[-1] == 10.0
+    assert len(intervals) == 9
+    assert scheduler.observe(status(), now + 10.0) == 10.0
+
+
+def test_movement_resets_to_minimum():
+    scheduler = PollScheduler()
+    _, now = settle(scheduler)
+    now += 10.0
+    assert scheduler.observe(status(temp=65.3), now) == 0.5
+    now += 0.5
+    assert scheduler.observe(status(temp=65.3), now) == 0.75
+    assert scheduler.observe(status(temp=65.3, setpoint=66.0), now + 0.75) == 0.5
+
+
+def test_noise_is_ignored():
+    scheduler = PollScheduler()
+    _, now = settle(scheduler)
+    # Below the noise band, however fast
+    assert scheduler.observe(status(temp=65.05), now + 0.01) == 10.0
+
+
+def test_slow_drift_by_rate():
+    scheduler = PollScheduler()
+    _, now = settle(scheduler)
+    # 0.15 °C is below the change threshold: movement after 1 s, not after 20 s
+    assert scheduler.observe(status(temp=65.15), now + 20.0) == 10.0
+    assert scheduler.observe(status(temp=65.3), now + 21.0) == 0.5
+
+
+@pytest.mark.parametrize('frame', [
+    status(alarm=1),
+    status(state=STATE_TUNE),
+    status(sensor=25.0),
+    {'sensors': [{'sensor_id': 0, 'temperature': 20.0}, {'sensor_id': 1, 'temperature': 20.0}],
+     'thermostats': [{'regulator_id': 0, 'currentTemp': 65.0, 'setpoint': 65.0}]},
+])
+def test_busy_phases(frame):
+    scheduler = PollScheduler()
+    _, now = settle(scheduler)
+    assert scheduler.observe(frame, now + 10.0) == 0.5
+
+
+def test_command_replies_leave_interval():
+    scheduler = PollScheduler()
+    _, now = settle(scheduler)
+    assert scheduler.observe({'command': 'setSetpoint', 'status': 'ok'}, now + 1.0) == 10.0
+    scheduler.reset()
+    assert scheduler.interval == scheduler.base_interval
+
+
+class Link:
+    """Answers getStatus with a fixed status, with a clock the test moves"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.written = []
+
+    def write(self, payload):
+        self.written.append(json.loads(payload))
+
+    def clock(self):
+        return self.now
+
+
+def test_session_polls_on_schedule():
+    link = Link()
+    session = ControllerSession(link.write, lambda event, data: None, compact=False, stream_interval=0,
+                                clock=link.clock)
+    session.start()
+    assert session.poll() == 1.0
+    assert link.written == []
+
+    gaps = []
+    for _ in range(10):
+        link.now = session.poll()
+        assert session.poll() is not None
+        command = link.written.pop()
+        assert command['command'] == 'getStatus'
+        session.feed((json.dumps(dict(status(), command='getStatus', seq=command['seq'])) + '\n').encode())
+        gaps.append(session.next_poll - link.now)
+    assert gaps[:3] == [0.5, 0.75, pytest.approx(1.125)]
+    assert gaps[-1] == 10.0
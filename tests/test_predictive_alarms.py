@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from predictive_alarms import HORIZONS, LEVEL_WARNING, PredictiveAlarms, SlidingSlope
+from status_model import StatusSnapshot
+
+LIMITS = {'warningLow': 10.0, 'warningHigh': 70.0, 'alarmLow': 5.0, 'alarmHigh': 999.0, 'enabled': True}
+
+
+def snapshot(temperature, limits=LIMITS):
+    frame = {'command': 'status', 'thermostats': [{'regulator_id': 0, 'currentTemp': temperature}]}
+    if limits is not None:
+        frame['config'] = {'alarms': [limits]}
+    return StatusSnapshot(frame)
+
+
+def heat(alarms, start, end, rate=1.0 / 60, t0=0.0, dt=5.0, temperature=60.0, limits=LIMITS):
+    changes = []
+    for now in np.arange(start, end, dt):
+        changes += [(now, change) for change in
+                    alarms.update(snapshot(temperature + rate * (now - t0), limits), now)]
+    return changes
+
+
+def test_sliding_slope_matches_polyfit():
+    rng = np.random.default_rng(1)
+    t = np.cumsum(rng.uniform(0.5, 3.0, 3000))
+    y = 0.02 * t + rng.normal(0.0, 0.3, len(t))
+    slope = SlidingSlope(window=120.0)
+    for x, value in zip(t, y):
+        slope.add(x, value)
+    inside = t >= t[-1] - 120.0
+    expected, intercept = np.polyfit(t[inside], y[inside], 1)
+    assert t[-1] > 3600  # the time origin has moved on
+    assert slope.slope() == pytest.approx(expected, rel=1e-6)
+    assert slope.level(slope.slope()) == pytest.approx(expected * t[-1] + intercept, abs=1e-6)
+
+
+def test_rising_temperature_is_predicted_within_the_horizon():
+    alarms = PredictiveAlarms()
+    changes = heat(alarms, 0.0, 360.0)
+    assert [change.limit for _, change in changes] == ['warningHigh']
+    now, prediction = changes[0]
+    assert prediction.active and prediction.level == LEVEL_WARNING
+    assert prediction.eta <= HORIZONS[LEVEL_WARNING]
+    assert prediction.rate == pytest.approx(1.0 / 60)
+    # 10 °C to go at 1 °C a minute; raised once five minutes are left
+    assert now == pytest.approx(300.0, abs=5.0)
+    assert alarms.rate(0) == pytest.approx(1.0 / 60)
+    assert (0, 'warningHigh') in alarms.active
+
+
+def test_prediction_clears_when_the_temperature_levels_off():
+    alarms = PredictiveAlarms()
+    heat(alarms, 0.0, 360.0)
+    changes = heat(alarms, 360.0, 600.0, rate=0.0, temperature=66.0)
+    assert [(change.limit, change.active) for _, change in changes] == [('warningHigh', False)]
+    assert not alarms.active
+
+
+def test_disabled_and_overridden_limits():
+    alarms = PredictiveAlarms()
+    assert heat(alarms, 0.0, 360.0, limits=dict(LIMITS, enabled=False)) == []
+
+    alarms = PredictiveAlarms()
+    alarms.set_limits(0, {'warningHigh': 999.0, 'alarmHigh': 66.0})
+    changes = heat(alarms, 0.0, 240.0)
+    assert [change.limit for _, change in changes] == ['alarmHigh']
+
+
+def test_failed_sensor_and_reset_clear_predictions():
+    alarms = PredictiveAlarms()
+    heat(alarms, 0.0, 360.0)
+    changes = alarms.update(snapshot(-999.0), 365.0)
+    assert [(change.limit, change.active) for change in changes] == [('warningHigh', False)]
+    assert alarms.rate(0) is None
+
+    heat(alarms, 370.0, 730.0, t0=370.0)
+    assert [change.active for change in alarms.reset()] == [False]
+    assert not alarms.active and alarms.rate(0) is None
@@ -0,0 +1,132 @@
+import pytest
+
+from recipe import (PHASE_DONE, PHASE_HEAT, PHASE_HOLD, PHASE_RAMP, RESYNC_INTERVAL, RecipeRunner,
+                    parse_recipe)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def frame(temperature, setpoint, output=0.0, regulator_id=0):
+    return {'command': 'status', 'thermostats': [
+        {'regulator_id': regulator_id, 'currentTemp': temperature, 'setpoint': setpoint, 'output': output}]}
+
+
+def make_runner(steps, thermostat=1):
+    sent = []
+    clock = Clock()
+
+    def send(command):
+        sent.append(command)
+        return True
+
+    recipe = parse_recipe({'name': "Test", 'programs': [{'thermostat': thermostat, 'steps': steps}]})
+    runner = RecipeRunner(send, recipe, clock=clock)
+    runner.start()
+    return runner, clock, sent
+
+
+def test_parse_recipe_units():
+    recipe = parse_recipe({'heatingRate': 1.5, 'programs': [
+        {'thermostat': 2, 'steps': [{'setpoint': 63, 'hold': 40, 'at': 30}]},
+        {'thermostat': 1, 'heatingRate': 3, 'steps': [{'setpoint': 78, 'at': "07:30"}]},
+    ]})
+    first, second = recipe.programs
+    assert first.regulator_id == 1
+    assert first.heating_rate == pytest.approx(1.5 / 60)
+    assert first.steps[0].hold == 40 * 60
+    assert first.steps[0].at == 30 * 60
+    assert first.steps[0].name == "Trin 1"
+    assert second.heating_rate == pytest.approx(3 / 60)
+    assert second.steps[0].at == "07:30"
+
+
+@pytest.mark.parametrize('data', [
+    {},
+    {'programs': []},
+    {'programs': [{'thermostat': 0, 'steps': [{'setpoint': 50}]}]},
+    {'programs': [{'thermostat': 1, 'steps': []}]},
+    {'programs': [{'thermostat': 1, 'steps': [{'hold': 10}]}]},
+    {'programs': [{'thermostat': 1, 'steps': [{'setpoint': "varm"}]}]},
+    {'programs': [{'thermostat': 1, 'steps': [{'setpoint': 50, 'hold': -1}]}]},
+    {'programs': [{'thermostat': 1, 'steps': [{'setpoint': 50, 'at': "25:00"}]}]},
+    {'programs': [{'thermostat': 1, 'steps': [{'setpoint': 50}]},
+                  {'thermostat': 1, 'steps': [{'setpoint': 60}]}]},
+])
+def test_parse_recipe_rejects(data):
+    with pytest.raises(ValueError):
+        parse_recipe(data)
+
+
+def test_heat_hold_and_advance():
+    runner, clock, sent = make_runner([{'setpoint': 52, 'hold': 15}, {'setpoint': 63, 'wait': False}])
+    run = runner.runs[0]
+    runner.handle_frame(frame(20.0, 20.0))
+    assert sent == [{'command': 'setConfig', 'regulator_id': 0, 'setpoint': 52.0}]
+    assert run.phase == PHASE_HEAT
+
+    clock.now += 600
+    runner.handle_frame(frame(51.8, 52.0))
+    assert run.phase == PHASE_HOLD
+    clock.now += 14 * 60
+    runner.handle_frame(frame(52.0, 52.0))
+    assert run.phase == PHASE_HOLD and len(sent) == 1
+
+    clock.now += 60
+    runner.handle_frame(frame(52.0, 52.0))
+    assert sent[-1]['setpoint'] == 63.0
+    runner.handle_frame(frame(52.0, 63.0))
+    assert run.phase == PHASE_DONE
+    assert not runner.running
+
+
+def test_ramp_moves_the_setpoint_in_steps():
+    runner, clock, sent = make_runner([{'setpoint': 52, 'ramp': 1.0}])
+    run = runner.runs[0]
+    runner.handle_frame(frame(50.0, 50.0))
+    assert run.phase == PHASE_RAMP and sent == []
+    clock.now += 45
+    runner.handle_frame(frame(50.0, 50.0))
+    assert sent[-1]['setpoint'] == 50.5
+    clock.now += 75
+    runner.handle_frame(frame(50.5, 50.5))
+    assert run.phase == PHASE_HEAT
+    assert sent[-1]['setpoint'] == 52.0
+
+
+def test_pause_stops_the_hold_clock():
+    runner, clock, sent = make_runner([{'setpoint': 52, 'hold': 10, 'wait': False}])
+    run = runner.runs[0]
+    runner.handle_frame(frame(52.0, 52.0))
+    runner.pause()
+    clock.now += 3600
+    runner.handle_frame(frame(52.0, 52.0))
+    runner.resume()
+    clock.now += 60
+    runner.handle_frame(frame(52.0, 52.0))
+    assert run.phase == PHASE_HOLD
+    assert run.phase_time == 60
+    runner.skip(0)
+    assert run.phase == PHASE_DONE
+
+
+def test_setpoint_is_resent_when_the_regulator_disagrees():
+    runner, clock, sent = make_runner([{'setpoint': 52}])
+    runner.handle_frame(frame(20.0, 20.0))
+    clock.now += 1
+    runner.handle_frame(frame(20.0, 20.0))
+    assert len(sent) == 1
+    clock.now += RESYNC_INTERVAL
+    runner.handle_frame(frame(20.0, 20.0))
+    assert len(sent) == 2
+
+
+def test_other_thermostats_are_ignored():
+    runner, clock, sent = make_runner([{'setpoint': 52}], thermostat=3)
+    runner.handle_frame(frame(20.0, 20.0, regulator_id=0))
+    assert sent == [] and runner.runs[0].phase is None
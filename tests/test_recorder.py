@@ -0,0 +1,71 @@
+import math
+import os
+
+from recorder import NO_LEVEL, StatusRecorder
+
+FRAME = {
+    'sensors': [{'sensor_id': 0, 'temperature': 20.5, 'health': 0}, {'sensor_id': 2, 'temperature': 64.0, 'health': 2}],
+    'thermostats': [{'regulator_id': 1, 'currentTemp': 64.0, 'setpoint': 65.0, 'output': 128.0}],
+    'alarms': [{'regulator_id': 1, 'level': 1}],
+}
+
+
+def record(directory, times, n_sensors=3, n_thermostats=2, chunk_seconds=3600):
+    recorder = StatusRecorder(str(directory), n_sensors, n_thermostats, chunk_seconds, flush_interval=0.01)
+    recorder.start()
+    for timestamp in times:
+        recorder.record(FRAME, timestamp)
+    recorder.stop()
+    return recorder
+
+
+def test_round_trip(tmp_path):
+    recorder = record(tmp_path, [1000.0])
+    [sample] = recorder.query(0, 2000)
+    assert sample.time == 1000.0
+    assert sample.temperatures[0] == 20.5
+    assert math.isnan(sample.temperatures[1])
+    assert sample.health == (0, NO_LEVEL, 2)
+    assert math.isnan(sample.thermostat_temps[0])
+    assert (sample.thermostat_temps[1], sample.setpoints[1], sample.outputs[1]) == (64.0, 65.0, 128.0)
+    assert sample.alarm_levels == (NO_LEVEL, 1)
+
+
+def test_frames_without_status_are_not_recorded(tmp_path):
+    recorder = StatusRecorder(str(tmp_path))
+    recorder.record({'command': 'ackAlarm'}, 1.0)
+    assert recorder.queue.empty()
+
+
+def test_query_range_across_chunks(tmp_path):
+    times = [float(t) for t in range(0, 400, 10)]
+    recorder = record(tmp_path, times, chunk_seconds=100)
+    assert len(os.listdir(tmp_path)) == 4
+    assert [s.time for s in recorder.query(95, 125)] == [100.0, 110.0, 120.0]
+    assert [s.time for s in recorder.query(0, 1000)] == times
+    assert recorder.query(1000, 2000) == []
+
+
+def test_clock_set_back_keeps_records_in_order(tmp_path):
+    recorder = record(tmp_path, [1000.0, 1010.0, 1005.0, 1020.0])
+    assert [s.time for s in recorder.query(0, 2000)] == [1000.0, 1010.0, 1010.0, 1020.0]
+    # Also across a restart of the recorder
+    recorder = record(tmp_path, [1015.0])
+    assert [s.time for s in recorder.query(1011, 2000)] == [1020.0, 1020.0]
+
+
+def test_changed_layout_continues_in_a_new_part(tmp_path):
+    record(tmp_path, [1000.0], n_sensors=3)
+    recorder = record(tmp_path, [1010.0], n_sensors=4)
+    assert sorted(os.listdir(tmp_path)) == ['history-0-1.brewlog', 'history-0.brewlog']
+    samples = recorder.query(0, 2000)
+    assert [(s.time, len(s.temperatures)) for s in samples] == [(1000.0, 3), (1010.0, 4)]
+
+
+def test_torn_record_is_dropped_on_append(tmp_path):
+    recorder = record(tmp_path, [1000.0])
+    path = os.path.join(str(tmp_path), 'history-0.brewlog')
+    with open(path, 'ab') as f:
+        f.write(b'\x00' * 5)
+    record(tmp_path, [1010.0])
+    assert [s.time for s in recorder.query(0, 2000)] == [1000.0, 1010.0]
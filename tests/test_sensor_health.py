@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from sensor_health import (ISSUE_DEVIATION, ISSUE_DROPOUTS, ISSUE_NOISY, ISSUE_STUCK, STUCK_TIME,
+                           RunningStats, SensorHealth)
+from status_model import StatusSnapshot
+
+
+def snapshot(readings, now, health=None):
+    health = health or {}
+    return StatusSnapshot({'command': 'status', 'sensors': [
+        {'sensor_id': sensor_id, 'temperature': temperature, 'health': health.get(sensor_id, 0),
+         'lastUpdate': int(now * 1000)}
+        for sensor_id, temperature in readings.items()]})
+
+
+def run(monitor, readings, start, end, dt=1.0, health=None):
+    """Feed readings(now) -> {sensor_id: temperature}; returns the changes"""
+    changes = []
+    for now in np.arange(start, end, dt):
+        changes += monitor.update(snapshot(readings(now), now, health), now)
+    return changes
+
+
+def issues(changes):
+    return [(change.sensor_id, change.issue, change.active) for change in changes]
+
+
+def test_running_stats_match_numpy():
+    values = np.random.default_rng(2).normal(20.0, 3.0, 500)
+    stats = RunningStats()
+    for value in values:
+        stats.add(value)
+    assert stats.mean == pytest.approx(values.mean())
+    assert stats.std == pytest.approx(values.std())
+
+    stats = RunningStats(half_life=50)
+    for value in values:
+        stats.add(value)
+    weights = 0.5 ** (np.arange(len(values))[::-1] / 50)
+    mean = np.average(values, weights=weights)
+    assert stats.mean == pytest.approx(mean)
+    assert stats.variance == pytest.approx(np.average((values - mean) ** 2, weights=weights), rel=1e-6)
+
+
+def test_noisy_sensor_is_flagged():
+    rng = np.random.default_rng(3)
+    monitor = SensorHealth()
+    changes = run(monitor, lambda now: {0: 60.0 + 0.01 * now + rng.normal(0.0, 0.02),
+                                        1: 60.0 + rng.normal(0.0, 0.5)}, 0.0, 100.0)
+    assert issues(changes) == [(1, ISSUE_NOISY, True)]
+    summary = monitor.summary()
+    assert summary[0]['noise'] < 0.05
+    assert summary[1]['noise'] == pytest.approx(0.5, rel=0.25)
+
+
+def test_stuck_sensor_raises_and_clears():
+    monitor = SensorHealth()
+    changes = run(monitor, lambda now: {0: 55.0}, 0.0, STUCK_TIME + 10, dt=5.0)
+    assert issues(changes) == [(0, ISSUE_STUCK, True)]
+    changes = run(monitor, lambda now: {0: 55.5}, STUCK_TIME + 10, STUCK_TIME + 20, dt=5.0)
+    assert issues(changes) == [(0, ISSUE_STUCK, False)]
+
+
+def test_dropouts_are_counted():
+    def readings(now):
+        return {0: 20.0 + 0.01 * now}
+
+    monitor = SensorHealth()
+    assert run(monitor, readings, 0.0, 600.0, dt=5.0) == []
+    changes = run(monitor, readings, 600.0, 660.0, dt=5.0, health={0: 1})
+    assert issues(changes) == [(0, ISSUE_DROPOUTS, True)]
+    assert monitor.summary()[0]['dropouts'] == 1
+
+
+def test_sensor_apart_from_its_group():
+    monitor = SensorHealth(groups=[(0, 1, 2)])
+    changes = run(monitor, lambda now: {0: 65.0, 1: 65.2, 2: 67.0 + 0.001 * now}, 0.0, 30.0)
+    assert issues(changes) == [(2, ISSUE_DEVIATION, True)]
+    assert monitor.summary()[2]['deviation'] == pytest.approx(1.8, abs=0.05)
+
+
+def test_reset_clears_issues_and_keeps_groups():
+    monitor = SensorHealth(groups=[(0, 1, 2)])
+    run(monitor, lambda now: {0: 65.0, 1: 65.2, 2: 67.0 + 0.001 * now}, 0.0, 30.0)
+    changes = monitor.reset()
+    assert [(change.sensor_id, change.issue, change.active, change.value) for change in changes] == [
+        (2, ISSUE_DEVIATION, False, None)]
+    assert monitor.summary() == {}
+    assert monitor.groups == [(0, 1, 2)]
@@ -0,0 +1,72 @@
+import json
+
+from serial_protocol import FrameParser
+
+
+def frame(**fields):
+    return (json.dumps(dict(command='getStatus', **fields)) + '\n').encode()
+
+
+def test_frames_split_across_reads_are_reassembled():
+    parser = FrameParser()
+    data = frame(seq=1, status='ok')
+    assert parser.feed(data[:10]) == []
+    assert parser.pending == 10
+    assert parser.feed(data[10:]) == [{'command': 'getStatus', 'seq': 1, 'status': 'ok'}]
+    assert parser.pending == 0
+
+
+def test_several_frames_in_one_read():
+    parser = FrameParser()
+    frames = parser.feed(frame(seq=1) + frame(seq=2) + frame(seq=3)[:5])
+    assert [f['seq'] for f in frames] == [1, 2]
+    assert [f['seq'] for f in parser.feed(frame(seq=3)[5:])] == [3]
+
+
+def test_frames_glued_together_on_one_line():
+    parser = FrameParser()
+    frames = parser.feed(b'{"command":"a"}{"command":"b"}\n')
+    assert [f['command'] for f in frames] == ['a', 'b']
+
+
+def test_crlf_and_blank_lines():
+    parser = FrameParser()
+    frames = parser.feed(b'\r\n{"command":"a"}\r\n\n')
+    assert frames == [{'command': 'a'}]
+    assert parser.discarded_bytes == 0
+
+
+def test_garbage_before_a_frame_is_skipped():
+    parser = FrameParser()
+    frames = parser.feed(b'\x00\xffboot{"command":"a"}\n')
+    assert frames == [{'command': 'a'}]
+    assert parser.discarded_bytes > 0
+
+
+def test_truncated_frame_is_dropped_and_the_next_one_kept():
+    parser = FrameParser()
+    frames = parser.feed(b'{"command":"a","sensors":[{"sensor_id":0\n' + frame(seq=2))
+    assert frames == [{'command': 'getStatus', 'seq': 2}]
+    assert parser.frames_dropped == 1
+
+
+def test_nested_object_after_resync_is_not_taken_for_a_frame():
+    parser = FrameParser()
+    # The start of the frame was lost, leaving one of its records
+    frames = parser.feed(b'ors":[{"sensor_id":0,"health":0}]}\n')
+    assert frames == []
+
+
+def test_runaway_line_is_discarded():
+    parser = FrameParser(max_frame_size=100)
+    assert parser.feed(b'x' * 150) == []
+    assert parser.pending == 0
+    assert parser.frames_dropped == 1
+    assert parser.feed(frame(seq=1)) == [{'command': 'getStatus', 'seq': 1}]
+
+
+def test_reset_drops_a_partial_frame():
+    parser = FrameParser()
+    parser.feed(b'{"command":"a"')
+    parser.reset()
+    assert parser.feed(frame(seq=1)) == [{'command': 'getStatus', 'seq': 1}]
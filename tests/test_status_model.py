@@ -0,0 +1,49 @@
+from status_model import StatusSnapshot, index_records, merge_status
+
+
+def test_records_are_indexed_by_id_or_position():
+    index = index_records([{'sensor_id': 5}, {'other': 1}, {'sensor_id': 0}], ('sensor_id',))
+    assert sorted(index) == [0, 1, 5]
+    assert index[1] == {'other': 1}
+
+
+def test_snapshot_lookups():
+    frame = {
+        'thermostats': [{'regulator_id': 0, 'sensorIndex': 2}, {'regulator_id': 1, 'sensorIndex': 9}],
+        'sensors': [{'sensor_id': 2, 'temperature': 64.5}],
+        'alarms': [{'thermostatIndex': 1, 'level': 2}],
+    }
+    snapshot = StatusSnapshot(frame)
+    assert snapshot.thermostat(1)['sensorIndex'] == 9
+    assert snapshot.alarm(1)['level'] == 2
+    assert snapshot.sensor_for(0)['temperature'] == 64.5
+    assert snapshot.sensor_for(1) is None
+    assert snapshot.sensor_for(7) is None
+
+
+def test_empty_frame():
+    snapshot = StatusSnapshot({})
+    assert snapshot.thermostats == snapshot.sensors == snapshot.alarms == {}
+
+
+def test_delta_frame_keeps_unchanged_records():
+    base = {
+        'sensors': [{'sensor_id': 0, 'temperature': 20.0}, {'sensor_id': 1, 'temperature': 21.0}],
+        'thermostats': [{'regulator_id': 0, 'output': 0.0}],
+        'config': {'pids': []},
+    }
+    delta = {'delta': True, 'timestamp': 5, 'sensors': [{'sensor_id': 1, 'temperature': 22.0}]}
+    merged = merge_status(base, delta)
+    assert merged['sensors'] == [{'sensor_id': 0, 'temperature': 20.0}, {'sensor_id': 1, 'temperature': 22.0}]
+    assert merged['thermostats'] == base['thermostats']
+    assert merged['config'] is base['config']
+    assert 'delta' not in merged
+    # Neither argument is modified
+    assert base['sensors'][1]['temperature'] == 21.0
+    assert delta['delta'] is True
+
+
+def test_full_frame_replaces_records():
+    base = {'sensors': [{'sensor_id': 0}, {'sensor_id': 1}]}
+    merged = merge_status(base, {'sensors': [{'sensor_id': 0}]})
+    assert merged['sensors'] == [{'sensor_id': 0}]
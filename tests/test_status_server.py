@@ -0,0 +1,176 @@
+import asyncio
+import json
+import os
+import socket
+import struct
+
+import pytest
+
+from acquisition import EVENT_FRAME
+from status_server import (MAX_MESSAGE_SIZE, OP_CLOSE, OP_TEXT, StatusServer,
+                           read_websocket_frame, websocket_frame)
+
+# The worked example from RFC 6455 section 1.3
+RFC_KEY = 'dGhlIHNhbXBsZSBub25jZQ=='
+RFC_ACCEPT = b's3pPLMBiTxaQ9kYGzzhZRbK+xOo='
+
+
+class Reply:
+    def __init__(self, response):
+        self.response = response
+        self.error = None
+
+
+class FakeCore:
+    """The parts of AcquisitionCore the server uses"""
+
+    def __init__(self):
+        self.frame = None
+        self.subscribers = []
+        self.sent = []
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def emit_frame(self, frame):
+        self.frame = frame
+        for callback in list(self.subscribers):
+            callback(EVENT_FRAME, frame)
+
+    def send(self, command, callback=None):
+        self.sent.append(command)
+        callback(Reply({"ok": command['command']}))
+        return object()
+
+
+@pytest.fixture
+def core():
+    return FakeCore()
+
+
+def start_server(core, **kwargs):
+    server = StatusServer(core, port=0, **kwargs)
+    server.start()
+    server.port = server.server.sockets[0].getsockname()[1]
+    return server
+
+
+@pytest.fixture
+def server(core):
+    server = start_server(core)
+    yield server
+    server.stop()
+
+
+def connect(server):
+    sock = socket.create_connection(('127.0.0.1', server.port), timeout=5)
+    return sock, sock.makefile('rb')
+
+
+def handshake(sock, stream, origin=None):
+    request = ('GET / HTTP/1.1\r\nHost: localhost\r\n'
+               'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+               f'Sec-WebSocket-Key: {RFC_KEY}\r\nSec-WebSocket-Version: 13\r\n')
+    if origin is not None:
+        request += f'Origin: {origin}\r\n'
+    sock.sendall((request + '\r\n').encode())
+    lines = []
+    while True:
+        line = stream.readline()
+        if line in (b'\r\n', b''):
+            return lines
+        lines.append(line.rstrip(b'\r\n'))
+
+
+def masked_frame(opcode, payload, mask=b'\x37\xfa\x21\x3d'):
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, 0x80 | length)
+    else:
+        header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, length)
+    return header + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+
+def read_frame(stream):
+    first, second = stream.read(2)
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack('!H', stream.read(2))
+    return first & 0x0F, stream.read(length)
+
+
+def decode(data):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await read_websocket_frame(reader)
+    return asyncio.run(run())
+
+
+def test_masked_frame_decoding():
+    # The masked "Hello" from RFC 6455 section 5.7
+    assert decode(bytes.fromhex('818537fa213d7f9f4d5158')) == (OP_TEXT, b'Hello')
+    payload = os.urandom(300)
+    assert decode(masked_frame(OP_TEXT, payload)) == (OP_TEXT, payload)
+    assert decode(b'') == (None, None)
+    with pytest.raises(ValueError):
+        decode(struct.pack('!BBQ', 0x81, 0xFF, MAX_MESSAGE_SIZE + 1))
+
+
+def test_server_frames_are_unmasked():
+    assert websocket_frame(OP_TEXT, b'Hello') == bytes.fromhex('810548656c6c6f')
+    frame = websocket_frame(OP_TEXT, b'x' * 300)
+    assert frame[:4] == struct.pack('!BBH', 0x81, 126, 300)
+
+
+def test_handshake_accept_key(server, core):
+    sock, stream = connect(server)
+    with sock:
+        lines = handshake(sock, stream)
+        assert lines[0] == b'HTTP/1.1 101 Switching Protocols'
+        assert b'Sec-WebSocket-Accept: ' + RFC_ACCEPT in lines
+        core.emit_frame({"sensors": [1]})
+        assert read_frame(stream) == (OP_TEXT, b'{"sensors":[1]}')
+        sock.sendall(masked_frame(OP_CLOSE, b''))
+
+
+def test_rejected_origin(core):
+    server = start_server(core, allowed_origins=['http://localhost:8000'])
+    try:
+        sock, stream = connect(server)
+        with sock:
+            assert handshake(sock, stream, origin='http://example.com')[0] == b'HTTP/1.1 403 Forbidden'
+            assert stream.read() == b''
+        sock, stream = connect(server)
+        with sock:
+            assert handshake(sock, stream, origin='http://localhost:8000')[0] == b'HTTP/1.1 101 Switching Protocols'
+    finally:
+        server.stop()
+
+
+def test_commands_refused_without_allow_commands(server, core):
+    sock, stream = connect(server)
+    with sock:
+        sock.sendall(b'{"id": 7, "command": "setSetpoint", "value": 65}\n')
+        reply = json.loads(stream.readline())
+        assert reply == {"id": 7, "error": "Commands are not allowed on this server"}
+    assert core.sent == []
+
+
+def test_commands_allowed(core):
+    server = start_server(core, allow_commands=True)
+    try:
+        sock, stream = connect(server)
+        with sock:
+            handshake(sock, stream)
+            sock.sendall(masked_frame(OP_TEXT, b'{"id": "a", "command": "getStatus"}'))
+            opcode, payload = read_frame(stream)
+            assert json.loads(payload) == {"id": "a", "response": {"ok": "getStatus"}}
+            sock.sendall(masked_frame(OP_CLOSE, b''))
+        assert core.sent == [{"command": "getStatus"}]
+    finally:
+        server.stop()